@@ -0,0 +1,145 @@
+"""
+bench_collect.py
+
+Compares `phototag collect`'s header-only, threaded tag reads against the naive approach: a sequential loop reading
+each JPEG's keywords through iptcinfo3 and fully parsing each XMP sidecar with ElementTree.
+
+    python benchmarks/bench_collect.py --jpegs 2000 --size 4 --raws 500 --workers 32
+
+Storage latency is what the threads hide: run it against network storage (--directory), or simulate a network share's
+round trip on every open with --latency.
+"""
+
+import builtins
+import contextlib
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import click
+import iptcinfo3
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Runs from a checkout, uninstalled
+
+from corpus import SIDECAR
+from phototag import iptc
+from phototag.collect import collect
+from phototag.xmp import LI
+
+WORDS = ['sky', 'mountain', 'lake', 'tree', 'dog', 'city', 'night', 'beach', 'snow', 'portrait', 'food', 'car']
+
+
+def naive(paths: List[Path]) -> Counter:
+    counts = Counter()
+    for path in paths:
+        if path.suffix == '.jpg':
+            keywords = [keyword.decode() for keyword in iptcinfo3.IPTCInfo(str(path))['keywords']]
+        else:
+            tree = ET.parse(str(path.with_suffix('.xmp')))
+            keywords = [item.text for item in tree.iter(LI)]
+        counts.update(set(keywords))
+    return counts
+
+
+def evict(paths: List[Path]) -> None:
+    """
+    Asks the kernel to drop the files from the page cache, so that reads go to storage again (Linux only).
+    """
+    for path in paths:
+        for name in [path, path.with_suffix('.xmp')]:
+            if name.exists():
+                with open(name, 'rb') as file:
+                    os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+@contextlib.contextmanager
+def latency(seconds: float) -> Iterator[None]:
+    """
+    Delays every file opened (by either approach) by the given number of seconds, like a network share would.
+    """
+    original = builtins.open
+
+    def delayed(*args, **kwargs):
+        time.sleep(seconds)
+        return original(*args, **kwargs)
+
+    builtins.open = delayed
+    try:
+        yield
+    finally:
+        builtins.open = original
+
+
+def create_corpus(directory: str, jpegs: int, size: float, raws: int) -> List[Path]:
+    """
+    Copies a noisy JPEG of the given size (in megabytes), tagging each copy with a random subset of WORDS, and
+    creates RAW placeholders with sidecars.
+    """
+    rng = random.Random(0)
+    side = int((size * 1024 ** 2 / 1.2) ** 0.5)
+    source = os.path.join(directory, 'source.jpeg')
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(source, format='jpeg', quality=95)
+
+    paths = []
+    for index in range(jpegs):
+        path = Path(directory, f'{index:05}.jpg')
+        shutil.copyfile(source, path)
+        iptc.write_keywords(str(path), rng.sample(WORDS, rng.randint(2, 6)))
+        paths.append(path)
+    os.remove(source)
+
+    for index in range(jpegs, jpegs + raws):
+        path = Path(directory, f'{index:05}.nef')
+        path.write_bytes(b'')
+        path.with_suffix('.xmp').write_text(SIDECAR.replace('benchmark', rng.choice(WORDS)))
+        paths.append(path)
+    return paths
+
+
+@click.command()
+@click.option('--jpegs', type=int, default=500, show_default=True)
+@click.option('--size', type=float, default=4, show_default=True, help='The size of each JPEG, in megabytes.')
+@click.option('--raws', type=int, default=100, show_default=True, help='The number of RAW files with sidecars.')
+@click.option('--workers', type=int, default=32, show_default=True)
+@click.option('--latency', 'delay', type=float, default=0.0, show_default=True,
+              help='Simulated storage latency added to every file opened, in seconds.')
+@click.option('--cold', is_flag=True, help='Drop the corpus from the page cache before each approach.')
+@click.option('--directory', type=click.Path(file_okay=False), help='Where to create the corpus, e.g. a network share.')
+def main(jpegs: int, size: float, raws: int, workers: int, delay: float, cold: bool, directory: Optional[str]):
+    logging.getLogger('iptcinfo').setLevel(logging.ERROR)  # iptcinfo3 warns about every marker it does not know
+    directory = tempfile.mkdtemp(prefix='bench_collect', dir=directory)
+    try:
+        paths = create_corpus(directory, jpegs, size, raws)
+        click.echo(f'{jpegs} JPEGs of {size} MB & {raws} RAW sidecars, {delay * 1000:.0f} ms storage latency.')
+
+        if cold:
+            evict(paths)
+        start = time.perf_counter()
+        with latency(delay):
+            expected = naive(paths)
+        elapsed = time.perf_counter() - start
+        click.echo(f'{"naive":>10}: {len(paths) / elapsed:8.1f} files/s, {elapsed:6.2f}s')
+
+        if cold:
+            evict(paths)
+        start = time.perf_counter()
+        with latency(delay):
+            collection = collect(paths, workers=workers)
+        elapsed = time.perf_counter() - start
+        click.echo(f'{"collect":>10}: {len(paths) / elapsed:8.1f} files/s, {elapsed:6.2f}s')
+        assert collection.counts == expected, 'Both approaches must find the same tags'
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+bench_decode.py
+
+Compares the decode backends installed against a full-resolution decode (every pixel decoded, then shrunk) and against
+the previous decode path (Image.thumbnail, which drafts JPEGs to twice the thumbnail's size), per format & resolution,
+timing the decode & downscale to a thumbnail alone.
+
+    python benchmarks/bench_decode.py --resolution 1600x1200 --resolution 6000x4000 --repeat 10
+"""
+
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+import click
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Runs from a checkout, uninstalled
+
+from corpus import create_image, parse_resolution
+from phototag.backends import available_backends, get_backend
+from phototag.decode import THUMBNAIL_SIZE
+
+
+def full(path: str, size: Tuple[int, int]) -> Image.Image:
+    """
+    Decodes at full resolution before shrinking.
+    """
+    image = Image.open(path)
+    image.load()
+    return image
+
+
+def previous(path: str, size: Tuple[int, int]) -> Image.Image:
+    """
+    Leaves decoding to Image.thumbnail, as done before decode backends existed.
+    """
+    return Image.open(path)
+
+
+REFERENCES: Dict[str, Callable] = {'full': full, 'previous': previous}
+
+
+def measure(decode: Callable[[str, Tuple[int, int]], Image.Image], path: str, repeat: int) -> float:
+    """
+    :return: The median time taken to decode & shrink the image into a thumbnail, in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image = decode(path, THUMBNAIL_SIZE)
+        image.thumbnail(THUMBNAIL_SIZE, resample=Image.LANCZOS)
+        times.append(time.perf_counter() - start)
+        image.close()
+    return statistics.median(times) * 1000
+
+
+@click.command()
+@click.option('--resolution', 'resolutions', multiple=True, default=['1600x1200', '4000x3000', '6000x4000'],
+              show_default=True, help='A resolution to generate images at; may be repeated.')
+@click.option('--format', 'formats', multiple=True, type=click.Choice(['jpg', 'png']), default=['jpg', 'png'],
+              show_default=True)
+@click.option('--repeat', type=int, default=5, show_default=True, help='The number of decodes timed per image.')
+def main(resolutions: List[str], formats: List[str], repeat: int):
+    backends: Dict[str, Callable] = dict(REFERENCES)
+    backends.update({name: get_backend(name).open for name in available_backends()})
+    click.echo(f'Backends: {", ".join(backends)}')
+
+    directory = tempfile.mkdtemp(prefix='bench_decode')
+    try:
+        click.echo(f'{"format":<8}{"resolution":<12}{"backend":<12}{"ms":>10}{"speedup":>10}')
+        for resolution in resolutions:
+            for extension in formats:
+                path = os.path.join(directory, f'{resolution}.{extension}')
+                create_image(path, parse_resolution(resolution), seed=0)
+
+                reference = None
+                for name, decode in backends.items():
+                    if name not in REFERENCES and not get_backend(name).supports(extension):
+                        continue
+                    elapsed = measure(decode, path, repeat)
+                    reference = reference or elapsed
+                    click.echo(f'{extension:<8}{resolution:<12}{name:<12}{elapsed:>10.1f}{reference / elapsed:>9.1f}x')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
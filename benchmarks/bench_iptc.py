@@ -0,0 +1,87 @@
+"""
+bench_iptc.py
+
+Compares the throughput of tagging JPEGs through iptcinfo3 against the native APP13 writer in phototag.iptc.
+
+    python benchmarks/bench_iptc.py --size 20 --files 10
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+import click
+import iptcinfo3
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Runs from a checkout, uninstalled
+
+from phototag import iptc
+
+
+def create_jpeg(path: str, megabytes: float) -> None:
+    """
+    Creates a JPEG of roughly the given size, from noise (which compresses poorly).
+    """
+    side = int((megabytes * 1024 ** 2 / 1.2) ** 0.5)
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(path, format='jpeg', quality=95)
+
+
+def tag_iptcinfo3(path: str, keywords: List[str]) -> None:
+    info = iptcinfo3.IPTCInfo(path, force=True)
+    info['keywords'].extend(keywords)
+    info.save()
+    os.remove(path + '~')
+
+
+def tag_native(path: str, keywords: List[str]) -> None:
+    iptc.write_keywords(path, iptc.read_keywords(path) + keywords)
+
+
+def measure(name: str, tag: Callable[[str, List[str]], None], paths: List[str], rounds: int) -> None:
+    """
+    Tags every file once per round, with a different keyword set each round, then once more without any change.
+    """
+    size = sum(os.path.getsize(path) for path in paths)
+    start = time.perf_counter()
+    for round_index in range(rounds):
+        for path in paths:
+            tag(path, [f'keyword-{round_index}-{index}' for index in range(random.randint(4, 20))])
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for path in paths:
+        tag(path, [])
+    unchanged = time.perf_counter() - start
+
+    count = len(paths) * rounds
+    click.echo(f'{name:>10}: {count / elapsed:8.1f} files/s, {size * rounds / elapsed / 1024 ** 2:8.1f} MB/s, '
+               f'{elapsed / count * 1000:7.2f} ms/file, {unchanged / len(paths) * 1000:7.2f} ms/file unchanged')
+
+
+@click.command()
+@click.option('--size', type=float, default=20, show_default=True, help='The size of each JPEG, in megabytes.')
+@click.option('--files', type=int, default=5, show_default=True, help='The number of JPEGs tagged.')
+@click.option('--rounds', type=int, default=3, show_default=True, help='The number of times each JPEG is tagged.')
+def main(size: float, files: int, rounds: int):
+    directory = tempfile.mkdtemp(prefix='bench_iptc')
+    try:
+        source = os.path.join(directory, 'source.jpg')
+        create_jpeg(source, size)
+        click.echo(f'{files} JPEGs of {os.path.getsize(source) / 1024 ** 2:.1f} MB, tagged {rounds} times each.')
+
+        for name, tag in [('iptcinfo3', tag_iptcinfo3), ('native', tag_native)]:
+            paths = [os.path.join(directory, f'{name}-{index}.jpg') for index in range(files)]
+            for path in paths:
+                shutil.copyfile(source, path)
+            measure(name, tag, paths, rounds)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+bench_query.py
+
+Times `phototag query` lookups against a synthetic library index: files carrying a few tags each, drawn from a
+vocabulary with a long tail (a handful of tags on most photos, most tags on few), like labels from the Vision API.
+
+    python benchmarks/bench_query.py --files 1000000 --tags 2000 --per-file 8
+"""
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import List
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Runs from a checkout, uninstalled
+
+from phototag.index import TagIndex
+
+
+def populate(index: TagIndex, files: int, tags: int, per_file: int, seed: int = 0) -> List[str]:
+    """
+    Fills the index in bulk, bypassing update() (which is made for one file at a time).
+
+    :return: The tag vocabulary, most frequent first.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f'tag{number:05}' for number in range(tags)]
+    weights = [1 / (rank + 1) for rank in range(tags)]  # Zipf-like
+    connection = index.connection
+    connection.executemany("INSERT INTO tags (id, name) VALUES (?, ?)", enumerate(vocabulary, start=1))
+
+    chunk = 50_000
+    for start in range(0, files, chunk):
+        numbers = range(start + 1, min(files, start + chunk) + 1)
+        connection.executemany("INSERT INTO files (id, path, size, mtime_ns) VALUES (?, ?, 0, 0)",
+                               ((number, f'/library/{number // 1000:04}/{number:07}.jpg') for number in numbers))
+        connection.executemany("INSERT INTO postings VALUES (?, ?)",
+                               ((tag, number) for number in numbers
+                                for tag in set(rng.choices(range(1, tags + 1), weights, k=per_file))))
+    connection.execute("UPDATE tags SET files = (SELECT COUNT(*) FROM postings WHERE tag = tags.id)")
+    connection.commit()
+    connection.execute("ANALYZE")
+    return vocabulary
+
+
+def timed(function, repeat: int) -> float:
+    """
+    :return: The median time taken by the function, in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+@click.command()
+@click.option('--files', type=int, default=1_000_000, show_default=True)
+@click.option('--tags', type=int, default=2000, show_default=True, help='The size of the tag vocabulary.')
+@click.option('--per-file', type=int, default=8, show_default=True, help='The tags drawn for each file.')
+@click.option('--repeat', type=int, default=20, show_default=True)
+def main(files: int, tags: int, per_file: int, repeat: int):
+    path = os.path.join(tempfile.mkdtemp(prefix='bench_query'), 'index.sqlite')
+    index = TagIndex(path)
+    start = time.perf_counter()
+    vocabulary = populate(index, files, tags, per_file)
+    click.echo(f'Indexed {files} files in {time.perf_counter() - start:.1f}s ({os.path.getsize(path) / 1024 ** 2:.0f} '
+               f'MB).')
+
+    common, frequent, rare = vocabulary[0], vocabulary[5], vocabulary[-1]
+    cases = {
+        'one rare tag': ([rare], False),
+        'common AND rare': ([common, rare], False),
+        'common AND frequent': ([common, frequent], False),
+        'three-way AND': ([common, frequent, rare], False),
+        'rare OR rare': ([rare, vocabulary[-2]], True),
+    }
+    click.echo(f'{"query":<24}{"matches":>10}{"count ms":>10}{"first 100 ms":>14}')
+    for name, (query, any) in cases.items():
+        matches = index.count(query, any=any)
+        count = timed(lambda: index.count(query, any=any), repeat)
+        first = timed(lambda: index.query(query, any=any, limit=100), repeat)
+        click.echo(f'{name:<24}{matches:>10}{count:>10.2f}{first:>14.2f}')
+    index.close()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
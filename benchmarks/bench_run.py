@@ -0,0 +1,195 @@
+"""
+bench_run.py
+
+Runs the MasterFileProcessor end to end over a synthetic corpus, with the Vision API stubbed out, and writes the
+results as JSON so that runs can be compared across versions.
+
+    python benchmarks/bench_run.py --jpegs 200 --resolution 4000x3000 --output results.json
+    python benchmarks/bench_run.py --engine asyncio --process-pool --latency 0.05 0.2
+    python benchmarks/bench_run.py --max-bytes 32768 --no-optimize-huffman
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Runs from a checkout, uninstalled
+
+from corpus import generate, parse_resolution
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """
+    :return: The nearest-rank percentiles (and maximum) of the values, in milliseconds.
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {f'p{p}': values[min(len(values) - 1, int(len(values) * p / 100))] * 1000 for p in PERCENTILES}
+    result['max'] = values[-1] * 1000
+    return result
+
+
+def read_io() -> Dict[str, int]:
+    """
+    :return: The I/O counters of the current process, where available (Linux).
+    """
+    try:
+        with open('/proc/self/io') as file:
+            return {key: int(value) for key, value in (line.split(': ') for line in file)}
+    except OSError:
+        return {}
+
+
+def measure(paths: List[str], engine: str, latency: Tuple[float, float], process_pool: bool, raw_mode: str,
+            image_count: int, buffer_size: int, max_bytes: Optional[int], optimize_huffman: bool) -> Dict:
+    """
+    Processes the corpus once. Runs in a fresh process, so that peak RSS reflects processing alone.
+    """
+    from phototag.annotate import FakeImageAnnotatorClient, FakeImageAnnotatorAsyncClient
+    from phototag.decode import create_pool
+    from phototag.engine import AsyncMasterFileProcessor
+    from phototag.process import MasterFileProcessor, STAGES, OPTIMIZE_STAGES
+
+    if engine == 'asyncio':
+        client, processor_class = FakeImageAnnotatorAsyncClient(latency=latency), AsyncMasterFileProcessor
+    else:
+        client, processor_class = FakeImageAnnotatorClient(latency=latency), MasterFileProcessor
+    executor = create_pool() if process_pool else None
+
+    size_before = sum(os.path.getsize(path) for path in paths)
+    io_before = read_io()
+    start = time.perf_counter()
+    processors = []
+    mp = processor_class(map(Path, paths), image_count, buffer_size, True, client=client, executor=executor,
+                         raw_mode=raw_mode, max_bytes=max_bytes, optimize_huffman=optimize_huffman,
+                         on_finished=processors.append)
+    mp.load()
+    mp.join()
+    elapsed = time.perf_counter() - start
+    if executor is not None:
+        executor.shutdown()  # Waited upon, so that the workers' peak RSS is counted
+    io_after = read_io()
+
+    stages = {stage: percentiles([fp.timings[stage] for fp in processors if stage in fp.timings])
+              for stage in STAGES + OPTIMIZE_STAGES}
+    sizes = [fp.upload_bytes for fp in processors if fp.upload_bytes is not None]
+    stages['total'] = percentiles([sum(fp.timings.get(stage, 0.0) for stage in STAGES) for fp in processors])
+    return {
+        'files': len(processors),
+        'failed': sum(1 for fp in processors if not fp.succeeded),
+        'seconds': elapsed,
+        'files_per_second': len(processors) / elapsed,
+        'stages_ms': stages,
+        'decode_sources': mp.report.summary(),
+        'thumbnail_bytes': {
+            'mean': statistics.mean(sizes) if sizes else None,
+            'max': max(sizes, default=None),
+            'encodes': sum(fp.encodes for fp in processors),
+        },
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_rss_workers_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        'bytes_written': {
+            'storage': io_after.get('write_bytes', 0) - io_before.get('write_bytes', 0) if io_after else None,
+            'syscalls': io_after.get('wchar', 0) - io_before.get('wchar', 0) if io_after else None,
+            'corpus_growth': sum(os.path.getsize(path) for path in paths) - size_before,
+        },
+        'api': {'requests': client.requests, 'images': client.images},
+    }
+
+
+def revision() -> Optional[str]:
+    """
+    :return: The git revision benchmarked, if known.
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--jpegs', type=int, default=100, show_default=True)
+@click.option('--pngs', type=int, default=0, show_default=True)
+@click.option('--resolution', default='3000x2000', show_default=True, help='The resolution of generated images.')
+@click.option('--raw-sample', type=click.Path(exists=True, dir_okay=False), help='A RAW file to copy.')
+@click.option('--raws', type=int, default=0, show_default=True, help='The number of copies of the RAW sample.')
+@click.option('--corpus', type=click.Path(file_okay=False),
+              help='Keep the pristine corpus here, reusing it if it already exists.')
+@click.option('--engine', type=click.Choice(['threads', 'asyncio']), default='threads', show_default=True)
+@click.option('--process-pool', is_flag=True, help='Decode in a process pool.')
+@click.option('--raw-mode', type=click.Choice(['full', 'preview']), default='full', show_default=True)
+@click.option('--latency', type=float, nargs=2, default=(0.0, 0.0), show_default=True,
+              help='The range of the stubbed Vision API latency, in seconds.')
+@click.option('--image-count', type=int, default=10, show_default=True)
+@click.option('--buffer-size', type=int, default=1024 ** 3, show_default=True)
+@click.option('--max-bytes', type=int, help='The byte budget of each thumbnail.')
+@click.option('--optimize-huffman/--no-optimize-huffman', default=True, show_default=True)
+@click.option('--repeat', type=int, default=1, show_default=True, help='The number of runs, each on a fresh copy.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results to this JSON file.')
+def main(jpegs: int, pngs: int, resolution: str, raw_sample: Optional[str], raws: int, corpus: Optional[str],
+         engine: str, process_pool: bool, raw_mode: str, latency: Tuple[float, float], image_count: int,
+         buffer_size: int, max_bytes: Optional[int], optimize_huffman: bool, repeat: int, output: Optional[str]):
+    directory = tempfile.mkdtemp(prefix='bench_run')
+    try:
+        pristine = corpus or os.path.join(directory, 'corpus')
+        if not os.path.isdir(pristine) or not os.listdir(pristine):
+            click.echo(f'Generating corpus in {pristine}...')
+            generate(pristine, jpegs, pngs, parse_resolution(resolution), raw_sample, raws)
+
+        runs = []
+        for index in range(repeat):
+            # Every run tags a fresh copy, so that no run finds the keywords already written
+            work = os.path.join(directory, f'run-{index}')
+            shutil.copytree(pristine, work)
+            paths = sorted(os.path.join(work, name) for name in os.listdir(work) if not name.endswith('.xmp'))
+
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                result = pool.submit(measure, paths, engine, tuple(latency), process_pool, raw_mode, image_count,
+                                     buffer_size, max_bytes, optimize_huffman).result()
+            runs.append(result)
+            shutil.rmtree(work)
+            click.echo(f'Run {index + 1}: {result["files"]} files in {result["seconds"]:.2f}s '
+                       f'({result["files_per_second"]:.1f} files/s), peak RSS {result["peak_rss_kb"] / 1024:.0f} MB')
+    finally:
+        shutil.rmtree(directory)
+
+    report = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': {
+            'jpegs': jpegs, 'pngs': pngs, 'raws': raws if raw_sample else 0, 'resolution': resolution,
+            'engine': engine, 'process_pool': process_pool, 'raw_mode': raw_mode, 'latency': list(latency),
+            'image_count': image_count, 'buffer_size': buffer_size, 'max_bytes': max_bytes,
+            'optimize_huffman': optimize_huffman,
+        },
+        'runs': runs,
+    }
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        click.echo(f'Results written to {output}.')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
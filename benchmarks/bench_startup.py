@@ -0,0 +1,89 @@
+"""
+bench_startup.py
+
+Measures how long the CLI takes to start: the wall time of `phototag --help` and, from `python -X importtime`, the
+modules costing the most to import. Exits with an error if startup exceeds --max-ms or pulls in a heavy module,
+so that it can guard against regressions.
+
+    python benchmarks/bench_startup.py --repeat 20 --top 15 --max-ms 150
+"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import click
+
+# Modules only the commands needing them should import
+HEAVY_MODULES = ['google.cloud.vision', 'google.api_core', 'grpc', 'rawpy', 'numpy', 'PIL', 'rich', 'imageio',
+                 'iptcinfo3']
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def command(*args: str) -> List[str]:
+    return [sys.executable, *args, '-c', 'from phototag.cli import cli; cli()', '--help']
+
+
+def environment() -> Dict[str, str]:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    return env
+
+
+def wall_times(repeat: int) -> List[float]:
+    """
+    :return: The wall time of each `phototag --help`, in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command(), env=environment(), check=True, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def import_times() -> List[Tuple[str, int, int]]:
+    """
+    :return: Each module imported by `phototag --help`, with its own & cumulative import time in microseconds.
+    """
+    result = subprocess.run(command('-X', 'importtime'), env=environment(), check=True, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return modules
+
+
+@click.command()
+@click.option('--repeat', type=int, default=10, show_default=True, help='The number of startups timed.')
+@click.option('--top', type=int, default=10, show_default=True, help='The number of slowest imports listed.')
+@click.option('--max-ms', type=float, help='Fail if the median startup takes longer than this.')
+def main(repeat: int, top: int, max_ms: float):
+    modules = import_times()
+    cumulative = {name: total for name, _, total in modules}
+    click.echo(f'{"module":<48}{"self ms":>10}{"total ms":>10}')
+    for name, own, total in sorted(modules, key=lambda module: module[2], reverse=True)[:top]:
+        click.echo(f'{name:<48}{own / 1000:>10.1f}{total / 1000:>10.1f}')
+    click.echo(f'phototag.cli imports in {cumulative.get("phototag.cli", 0) / 1000:.1f} ms')
+
+    times = wall_times(repeat)
+    median = statistics.median(times)
+    click.echo(f'phototag --help: {median:.0f} ms median, {min(times):.0f} ms best over {repeat} runs')
+
+    failures = [f'{module} was imported' for module in HEAVY_MODULES if module in cumulative]
+    if max_ms is not None and median > max_ms:
+        failures.append(f'startup took {median:.0f} ms, over the {max_ms:.0f} ms allowed')
+    if failures:
+        raise click.ClickException('; '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
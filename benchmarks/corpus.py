@@ -0,0 +1,107 @@
+"""
+corpus.py
+
+Generates a synthetic photo corpus for benchmarking: JPEGs & PNGs of a given resolution, plus copies of a sample RAW
+file (RAW files cannot be synthesized) with matching XMP sidecars.
+
+    python benchmarks/corpus.py ./corpus --jpegs 200 --pngs 20 --resolution 4000x3000
+"""
+
+import os
+import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import click
+from PIL import Image, ImageDraw, ImageFilter
+
+SIDECAR = """<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="phototag benchmark">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:crs="http://ns.adobe.com/camera-raw-settings/1.0/"
+   crs:Exposure2012="+0.00">
+   <dc:subject>
+    <rdf:Bag>
+     <rdf:li>benchmark</rdf:li>
+    </rdf:Bag>
+   </dc:subject>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+def create_image(path: str, resolution: Tuple[int, int], seed: int) -> None:
+    """
+    Creates a photo-like image: smooth shapes with a little noise, so that it compresses like a real photo would.
+    """
+    rng = random.Random(seed)
+    width, height = resolution
+    image = Image.new('RGB', (width // 4, height // 4), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(24):
+        x, y = rng.randrange(image.width), rng.randrange(image.height)
+        radius = rng.randrange(8, max(image.width, 16) // 2)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=tuple(rng.randrange(256) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(4)).resize(resolution, Image.BICUBIC)
+
+    noise = Image.effect_noise(resolution, 24).convert('RGB')
+    image = Image.blend(image, noise, 0.08)
+    if path.lower().endswith('.png'):
+        image.save(path, format='png')
+    else:
+        image.save(path, format='jpeg', quality=92)
+
+
+def generate(directory: str, jpegs: int = 100, pngs: int = 0, resolution: Tuple[int, int] = (3000, 2000),
+             raw_sample: Optional[str] = None, raws: int = 0, workers: Optional[int] = None) -> List[str]:
+    """
+    Generates a corpus, in parallel.
+
+    :param directory: The directory to generate the corpus in, created if needed.
+    :param jpegs: The number of JPEGs to generate.
+    :param pngs: The number of PNGs to generate.
+    :param resolution: The resolution of the JPEGs & PNGs.
+    :param raw_sample: A RAW file copied to create the RAW portion of the corpus.
+    :param raws: The number of RAW copies (each with an XMP sidecar) to create.
+    :param workers: The number of processes generating images.
+    :return: The paths of the images created.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, f'{index:05}.jpg') for index in range(jpegs)]
+    paths += [os.path.join(directory, f'{index:05}.png') for index in range(jpegs, jpegs + pngs)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(create_image, paths, [resolution] * len(paths), range(len(paths))))
+
+    if raw_sample is not None:
+        ext = os.path.splitext(raw_sample)[1]
+        for index in range(jpegs + pngs, jpegs + pngs + raws):
+            path = os.path.join(directory, f'{index:05}{ext}')
+            shutil.copyfile(raw_sample, path)
+            with open(os.path.join(directory, f'{index:05}.xmp'), 'w') as file:
+                file.write(SIDECAR)
+            paths.append(path)
+    return paths
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+@click.command()
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--jpegs', type=int, default=100, show_default=True)
+@click.option('--pngs', type=int, default=0, show_default=True)
+@click.option('--resolution', default='3000x2000', show_default=True, help='The resolution of generated images.')
+@click.option('--raw-sample', type=click.Path(exists=True, dir_okay=False), help='A RAW file to copy.')
+@click.option('--raws', type=int, default=0, show_default=True, help='The number of copies of the RAW sample.')
+def main(directory: str, jpegs: int, pngs: int, resolution: str, raw_sample: Optional[str], raws: int):
+    paths = generate(directory, jpegs, pngs, parse_resolution(resolution), raw_sample, raws)
+    click.echo(f'Generated {len(paths)} images in {directory}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,24 +2,19 @@
 __init__.py
 
 The module's initialization file responsible for setting up loggers, holding a couple extension and path constants,
-as well as setting up environment variables for the Google Cloud Vision API.
+as well as setting up logging output for the CLI.
+
+Nothing heavy is imported (or read from disk) here, so that importing phototag stays cheap; the configuration is read
+on first access, and Rich is only imported once a command sets up logging.
 """
 
 import logging
 import os
 
-from rich.logging import RichHandler
-
 from . import config
 # noinspection PyArgumentList
 from .exceptions import EmptyConfigurationValueError, InvalidConfigurationError
 
-logging.basicConfig(
-    format='[bold deep_pink2]%(threadName)s[/bold deep_pink2] %(message)s',
-    level=logging.ERROR,
-    handlers=[RichHandler(markup=True, rich_tracebacks=True)]
-)
-
 for loggerName in ['__init__', 'app', 'cli', 'config', 'helpers', 'process', 'xmp']:
     logger = logging.getLogger(loggerName)
     logger.setLevel(logging.DEBUG)
@@ -34,5 +29,15 @@ OUTPUT_PATH = os.path.join(CWD, "output")
 CONFIG_PATH = os.path.join(SCRIPT_ROOT, "config")
 logger.info("Path constants built successfully...")
 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(CONFIG_PATH, config.config["google"]["credentials"])
 
+def setup_logging() -> None:
+    """
+    Sends log records through Rich's handler, with markup & rich tracebacks.
+    """
+    from rich.logging import RichHandler
+
+    logging.basicConfig(
+        format='[bold deep_pink2]%(threadName)s[/bold deep_pink2] %(message)s',
+        level=logging.ERROR,
+        handlers=[RichHandler(markup=True, rich_tracebacks=True)]
+    )
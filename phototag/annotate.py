@@ -0,0 +1,615 @@
+"""
+annotate.py
+
+Helpers & clients for requesting labels from the Google Vision API, including a fake client for testing purposes,
+a batching client that packs images from many FileProcessors into multi-image requests, and adaptive clients that
+limit the requests in flight & retry throttled requests.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from threading import Condition, Lock, Thread
+from typing import List, Tuple, Callable, Optional
+
+from google.api_core import exceptions
+from google.cloud import vision
+
+from phototag.config import apply_credentials
+from phototag.constants import MAX_BATCH_IMAGES
+from phototag.exceptions import AnnotationError
+from phototag.helpers import random_characters
+from phototag.limiter import AdaptiveLimiter, AsyncAdaptiveLimiter, HedgeBudget, LatencyTracker, \
+    THROTTLING_ERRORS, backoff
+from phototag.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Vision API limits: 16 images per request (MAX_BATCH_IMAGES), and 10 MB per (JSON) request. Images are base64 encoded
+# in JSON requests, inflating them by a third, so the raw byte budget is kept comfortably beneath 10 MB.
+MAX_BATCH_BYTES: int = 7 * 1024 ** 2
+
+
+def create_client(asynchronous: bool = False):
+    """
+    Creates a Vision API client, authenticated with the configured credentials (see the auth command).
+
+    :param asynchronous: Whether to create an ImageAnnotatorAsyncClient, which must happen inside an event loop.
+    """
+    apply_credentials()
+    return vision.ImageAnnotatorAsyncClient() if asynchronous else vision.ImageAnnotatorClient()
+
+
+def label_request(content: bytes) -> vision.AnnotateImageRequest:
+    """
+    :param content: The encoded image to label.
+    :return: A label detection request for the image.
+    """
+    return vision.AnnotateImageRequest(
+        image=vision.Image(content=content),
+        features=[vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION)]
+    )
+
+
+def labels_from_response(response: vision.AnnotateImageResponse) -> List[str]:
+    """
+    :param response: The response to a label detection request.
+    :return: The descriptions of the labels identified.
+    :except AnnotationError: when the Vision API reported an error for the image.
+    """
+    if response.error.message:
+        raise AnnotationError(f"The Vision API could not label the image: {response.error.message}")
+    return [label.description for label in response.label_annotations]
+
+
+async def label_async(client, content: bytes) -> List[str]:
+    """
+    Labels an image using an ImageAnnotatorAsyncClient (or stand-in).
+
+    :param client: The asynchronous client used to query the Vision API.
+    :param content: The encoded image to label.
+    :return: The descriptions of the labels identified.
+    """
+    response = await client.batch_annotate_images(requests=[label_request(content)])
+    return labels_from_response(response.responses[0])
+
+
+def random_labels(content: bytes) -> List[str]:
+    """
+    Generates fake labels for an image, regardless of its content.
+    """
+    return [random_characters(8) for _ in range(random.randint(4, 20))]
+
+
+class FakeImageAnnotatorClient(object):
+    """
+    Stands in for vision.ImageAnnotatorClient without querying the Vision API, generating fake labels instead.
+    """
+
+    def __init__(self, latency: Tuple[float, float] = (0.0, 0.0),
+                 labeler: Callable[[bytes], List[str]] = random_labels, capacity: Optional[int] = None,
+                 error_rate: float = 0.0, stall_rate: float = 0.0, stall: float = 30.0):
+        """
+        :param latency: The range of the (uniformly random) time each request takes, in seconds.
+        :param labeler: Generates the labels for an image from its content.
+        :param capacity: The number of requests in flight beyond which requests fail with ResourceExhausted.
+        :param error_rate: The fraction of requests failing with ServiceUnavailable, at random.
+        :param stall_rate: The fraction of requests that stall, taking `stall` seconds instead.
+        :param stall: The time stalled requests take, in seconds.
+        """
+        self.latency, self.labeler = latency, labeler
+        self.capacity, self.error_rate = capacity, error_rate
+        self.stall_rate, self.stall = stall_rate, stall
+        self.requests, self.images, self.throttled = 0, 0, 0
+        self.in_flight, self.peak_in_flight = 0, 0
+        self.lock = Lock()
+
+    def batch_annotate_images(self, requests: List[vision.AnnotateImageRequest], timeout: Optional[float] = None,
+                              **kwargs) -> vision.BatchAnnotateImagesResponse:
+        """
+        Mimics ImageAnnotatorClient.batch_annotate_images.
+        """
+        self._enter()
+        try:
+            delay = self._delay()
+            time.sleep(delay if timeout is None else min(delay, timeout))
+        finally:
+            self._exit()
+        return self._respond(requests, delay, timeout)
+
+    def _delay(self) -> float:
+        """
+        :return: The time the next request takes.
+        """
+        return self.stall if random.random() < self.stall_rate else random.uniform(*self.latency)
+
+    def _enter(self) -> None:
+        """
+        Counts a request in flight, failing it if the fake is over capacity (or at random).
+        """
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            if self.capacity is not None and self.in_flight > self.capacity:
+                error = exceptions.ResourceExhausted("Quota exceeded.")
+            elif random.random() < self.error_rate:
+                error = exceptions.ServiceUnavailable("The service is currently unavailable.")
+            else:
+                return
+            self.in_flight -= 1
+            self.throttled += 1
+        raise error
+
+    def _exit(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def _respond(self, requests: List[vision.AnnotateImageRequest], delay: float = 0.0,
+                 timeout: Optional[float] = None) -> vision.BatchAnnotateImagesResponse:
+        """
+        Counts a request and generates its response, unless it took longer than its timeout.
+        """
+        if timeout is not None and delay > timeout:
+            raise exceptions.DeadlineExceeded("Deadline exceeded.")
+        with self.lock:
+            self.requests += 1
+            self.images += len(requests)
+
+        return vision.BatchAnnotateImagesResponse(responses=[
+            vision.AnnotateImageResponse(label_annotations=[
+                vision.EntityAnnotation(description=label) for label in self.labeler(request.image.content)
+            ])
+            for request in requests
+        ])
+
+    def label_detection(self, image: vision.Image, timeout: Optional[float] = None,
+                        **kwargs) -> vision.AnnotateImageResponse:
+        """
+        Mimics ImageAnnotatorClient.label_detection.
+        """
+        return self.batch_annotate_images([label_request(image.content)], timeout=timeout).responses[0]
+
+
+class FakeImageAnnotatorAsyncClient(FakeImageAnnotatorClient):
+    """
+    Stands in for vision.ImageAnnotatorAsyncClient without querying the Vision API, generating fake labels instead.
+    """
+
+    async def batch_annotate_images(self, requests: List[vision.AnnotateImageRequest],
+                                    timeout: Optional[float] = None, **kwargs) -> vision.BatchAnnotateImagesResponse:
+        """
+        Mimics ImageAnnotatorAsyncClient.batch_annotate_images.
+        """
+        self._enter()
+        try:
+            delay = self._delay()
+            await asyncio.sleep(delay if timeout is None else min(delay, timeout))
+        finally:
+            self._exit()
+        return self._respond(requests, delay, timeout)
+
+
+class AdaptiveAnnotator(object):
+    """
+    Sends requests through another client while an AdaptiveLimiter allows, retrying throttled requests after a
+    jittered, exponentially growing delay. Provides label_detection & batch_annotate_images, so it can be used in place
+    of an ImageAnnotatorClient (or wrapped by a BatchAnnotator).
+
+    A request's timeout covers every attempt, along with the time spent waiting on the limiter & backing off.
+    """
+
+    def __init__(self, client, limiter: Optional[AdaptiveLimiter] = None, retries: int = 5):
+        """
+        :param client: The ImageAnnotatorClient (or stand-in) requests are sent with.
+        :param limiter: The limiter adapting the number of requests in flight.
+        :param retries: The number of times a throttled request is retried before its error is raised.
+        """
+        self.client = client
+        self.limiter = limiter if limiter is not None else AdaptiveLimiter()
+        self.retries = retries
+        self.retried = 0
+        self.latencies = LatencyTracker()  # Of the requests themselves, excluding waits on the limiter & backoff
+
+    def _call(self, method: str, *args, **kwargs):
+        timeout = kwargs.get("timeout")
+        expires = time.monotonic() + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            started = self.limiter.acquire(timeout=None if expires is None else max(0.0, expires - time.monotonic()))
+            if started is None:
+                raise exceptions.DeadlineExceeded("Deadline passed while waiting to send the request.")
+            if expires is not None:
+                kwargs["timeout"] = max(0.0, expires - started)
+            try:
+                result = getattr(self.client, method)(*args, **kwargs)
+            except THROTTLING_ERRORS as error:
+                self.limiter.release(started, throttled=True)
+                attempt += 1
+                delay = backoff(attempt)
+                if attempt > self.retries or (expires is not None and time.monotonic() + delay >= expires):
+                    raise
+                logger.debug(f'Request throttled ({type(error).__name__}), retrying in {delay:.2f}s.')
+                self.retried += 1
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.limiter.release(started)
+                raise
+            self.limiter.release(started)
+            self.latencies.record(time.monotonic() - started)
+            return result
+
+    def batch_annotate_images(self, *args, **kwargs) -> vision.BatchAnnotateImagesResponse:
+        return self._call("batch_annotate_images", *args, **kwargs)
+
+    def label_detection(self, *args, **kwargs) -> vision.AnnotateImageResponse:
+        return self._call("label_detection", *args, **kwargs)
+
+
+class AsyncAdaptiveAnnotator(object):
+    """
+    An AdaptiveAnnotator for the asynchronous client, waiting on the event loop instead of blocking a thread.
+
+    If no client is given, an ImageAnnotatorAsyncClient is created on first use, inside the running event loop.
+    """
+
+    def __init__(self, client=None, limiter: Optional[AsyncAdaptiveLimiter] = None, retries: int = 5):
+        self.client = client
+        self.limiter = limiter if limiter is not None else AsyncAdaptiveLimiter()
+        self.retries = retries
+        self.retried = 0
+        self.latencies = LatencyTracker()
+
+    async def batch_annotate_images(self, *args, **kwargs) -> vision.BatchAnnotateImagesResponse:
+        if self.client is None:
+            self.client = create_client(asynchronous=True)
+
+        timeout = kwargs.get("timeout")
+        expires = time.monotonic() + timeout if timeout is not None else None
+        attempt = 0
+        while True:
+            started = await self.limiter.acquire(
+                timeout=None if expires is None else max(0.0, expires - time.monotonic()))
+            if started is None:
+                raise exceptions.DeadlineExceeded("Deadline passed while waiting to send the request.")
+            if expires is not None:
+                kwargs["timeout"] = max(0.0, expires - started)
+            try:
+                result = await self.client.batch_annotate_images(*args, **kwargs)
+            except THROTTLING_ERRORS as error:
+                await self.limiter.release(started, throttled=True)
+                attempt += 1
+                delay = backoff(attempt)
+                if attempt > self.retries or (expires is not None and time.monotonic() + delay >= expires):
+                    raise
+                logger.debug(f'Request throttled ({type(error).__name__}), retrying in {delay:.2f}s.')
+                self.retried += 1
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                await self.limiter.release(started)
+                raise
+            await self.limiter.release(started)
+            self.latencies.record(time.monotonic() - started)
+            return result
+
+
+class BatchAnnotator(object):
+    """
+    Collects images submitted from many threads into batch_annotate_images requests, fanning each response back out
+    to the thread that submitted the image.
+
+    A batch is sent once it reaches max_images or max_bytes, or once its oldest image has waited max_delay seconds.
+    Provides label_detection, so it can be used in place of an ImageAnnotatorClient.
+    """
+
+    def __init__(self, client, max_images: int = MAX_BATCH_IMAGES, max_bytes: int = MAX_BATCH_BYTES,
+                 max_delay: float = 0.1, concurrency: int = 4, timeout: Optional[float] = 300.0):
+        """
+        :param client: The ImageAnnotatorClient (or stand-in) batches are sent with.
+        :param max_images: The maximum number of images in a single request.
+        :param max_bytes: The maximum total size of the images in a single request.
+        :param max_delay: The maximum time an image waits for its batch to fill up, in seconds.
+        :param concurrency: The maximum number of batch requests in flight at once.
+        :param timeout: The time label_detection waits on an image's batch unless told otherwise, in seconds.
+        """
+        self.client = client
+        self.max_images, self.max_bytes, self.max_delay = max_images, max_bytes, max_delay
+        self.timeout = timeout
+
+        self.pending: List[Tuple[float, bytes, Future]] = []
+        self.pending_bytes = 0
+        self.closed = False
+        self.condition = Condition()
+
+        self.requests, self.images = 0, 0
+        self.senders = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='Batch')
+        self.thread = Thread(name='BatchAnnotator', target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def efficiency(self) -> float:
+        """
+        :return: The average number of images sent per request.
+        """
+        return self.images / self.requests if self.requests else 0.0
+
+    def submit(self, content: bytes) -> Future:
+        """
+        Queues an image to be labeled in the next batch.
+
+        :param content: The encoded image to label.
+        :return: A Future resolving to the image's AnnotateImageResponse.
+        """
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Cannot submit images to a closed BatchAnnotator.")
+            self.pending.append((time.monotonic(), content, future))
+            self.pending_bytes += len(content)
+            self.condition.notify()
+        return future
+
+    def label_detection(self, image: vision.Image, timeout: Optional[float] = None,
+                        **kwargs) -> vision.AnnotateImageResponse:
+        """
+        Mimics ImageAnnotatorClient.label_detection, blocking until the image's batch has been answered.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        try:
+            return self.submit(image.content).result(timeout)
+        except FutureTimeoutError:
+            raise exceptions.DeadlineExceeded(f"The image's batch was not answered within {timeout}s.")
+
+    def _ready(self) -> bool:
+        """
+        :return: Whether a batch should be sent right away. Must be called with the condition held.
+        """
+        return self.closed or len(self.pending) >= self.max_images or self.pending_bytes >= self.max_bytes
+
+    def _take(self) -> List[Tuple[float, bytes, Future]]:
+        """
+        Removes the next batch from the pending images, respecting the image count & size limits.
+        Must be called with the condition held.
+        """
+        batch, size = [], 0
+        for item in self.pending:
+            if len(batch) >= self.max_images or (batch and size + len(item[1]) > self.max_bytes):
+                break
+            batch.append(item)
+            size += len(item[1])
+
+        del self.pending[:len(batch)]
+        self.pending_bytes -= size
+        return batch
+
+    def _run(self) -> None:
+        """
+        Gathers pending images into batches until closed, handing each batch off to be sent.
+        """
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+
+                # Wait for the batch to fill up, or for the oldest image to reach the delay
+                deadline = self.pending[0][0] + self.max_delay
+                while not self._ready() and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+
+                batch = self._take()
+                self.requests += 1
+                self.images += len(batch)
+
+            self.senders.submit(self._send, batch)
+
+    def _send(self, batch: List[Tuple[float, bytes, Future]]) -> None:
+        """
+        Sends a batch, resolving the Future of each image with its own response.
+        """
+        logger.debug(f'Sending batch of {len(batch)} images.')
+        try:
+            response = self.client.batch_annotate_images(requests=[label_request(content) for _, content, _ in batch])
+        except Exception as error:
+            for _, _, future in batch:
+                future.set_exception(error)
+            return
+
+        for (_, _, future), image_response in zip(batch, response.responses):
+            future.set_result(image_response)
+        # Images left without a response (the response being short) are failed, rather than waited on forever
+        for _, _, future in batch[len(response.responses):]:
+            future.set_exception(AnnotationError(f"The Vision API answered {len(response.responses)} of the "
+                                                 f"{len(batch)} images sent."))
+
+    def close(self) -> None:
+        """
+        Sends any images still pending, then waits for all requests to complete.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.senders.shutdown()
+
+
+class HedgedAnnotator(object):
+    """
+    Sends requests through another client with a deadline, optionally hedging them: once a request has taken longer
+    than the recent 95th percentile latency, a duplicate is sent (within a budget) and whichever answers first wins.
+    Provides label_detection & batch_annotate_images, so it can be used in place of an ImageAnnotatorClient.
+
+    The deadline covers the request from end to end, hedge included. When the client is an AdaptiveAnnotator, the
+    latencies hedging is based on are those it measures around the requests themselves, excluding its waits on the
+    limiter & backoff, so that congestion does not pass for slow responses.
+    """
+
+    def __init__(self, client, deadline: Optional[float] = None, hedging: bool = True, percentile: float = 0.95,
+                 budget: Optional[HedgeBudget] = None, metrics: Optional[Metrics] = None, concurrency: int = 64):
+        """
+        :param client: The ImageAnnotatorClient (or stand-in) requests are sent with.
+        :param deadline: The time each request is given before failing with DeadlineExceeded, in seconds.
+        :param hedging: Whether slow requests are hedged.
+        :param percentile: The latency percentile after which a request is hedged.
+        :param budget: Limits the fraction of requests hedged.
+        :param metrics: An optional registry hedges & deadlines are counted in.
+        :param concurrency: The most requests (including hedges) in flight at once, when hedging.
+        """
+        self.client, self.deadline, self.hedging, self.percentile = client, deadline, hedging, percentile
+        self.budget = budget if budget is not None else HedgeBudget()
+        self.measured = getattr(client, "latencies", None) is None  # Whether latencies are measured here
+        self.latencies = LatencyTracker() if self.measured else client.latencies
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.describe("hedges_issued_total", "Duplicate requests sent for slow requests.")
+        self.metrics.describe("hedges_won_total", "Hedged requests answered before the original request.")
+        self.metrics.describe("deadlines_exceeded_total", "Requests that failed to answer within their deadline.")
+        self.hedged, self.won, self.exceeded = 0, 0, 0
+        self.lock = Lock()  # Guards the counters, updated from every thread sending requests
+        self.senders = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='Hedge') if hedging else None
+
+    def _count(self, counter: str, metric: str) -> None:
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        self.metrics.increment(metric)
+
+    def _send(self, method: str, *args, **kwargs):
+        """
+        Sends a single request, recording its latency.
+        """
+        start = time.monotonic()
+        result = getattr(self.client, method)(*args, **kwargs)
+        if self.measured:
+            self.latencies.record(time.monotonic() - start)
+        return result
+
+    def _call(self, method: str, *args, **kwargs):
+        """
+        Sends a request, hedged if slow, counting it once if it misses its deadline. Requests given up on (losing
+        hedges) are not counted, whatever becomes of them.
+        """
+        try:
+            return self._request(method, *args, **kwargs)
+        except exceptions.DeadlineExceeded:
+            self._count("exceeded", "deadlines_exceeded_total")
+            raise
+
+    def _request(self, method: str, *args, **kwargs):
+        if self.deadline is not None:
+            kwargs.setdefault("timeout", self.deadline)
+        self.budget.earn()
+        delay = self.latencies.percentile(self.percentile) if self.hedging else None
+        if delay is None:
+            return self._send(method, *args, **kwargs)
+
+        timeout = kwargs.get("timeout")
+        expires = time.monotonic() + timeout if timeout is not None else None
+        primary = self.senders.submit(self._send, method, *args, **kwargs)
+        pending = {primary}
+        done, _ = wait(pending, timeout=delay)
+        if not done and self.budget.spend():
+            logger.debug(f'Request has taken over {delay:.2f}s, hedging.')
+            self._count("hedged", "hedges_issued_total")
+            if expires is not None:
+                kwargs["timeout"] = max(0.0, expires - time.monotonic())  # The hedge only gets what time is left
+            pending.add(self.senders.submit(self._send, method, *args, **kwargs))
+
+        # The first request to answer successfully wins; the other is left to finish (or time out) on its own
+        error = None
+        while pending:
+            remaining = None if expires is None else max(0.0, expires - time.monotonic())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                raise exceptions.DeadlineExceeded(f"No answer within the {timeout}s deadline.")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("won", "hedges_won_total")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def batch_annotate_images(self, *args, **kwargs) -> vision.BatchAnnotateImagesResponse:
+        return self._call("batch_annotate_images", *args, **kwargs)
+
+    def label_detection(self, *args, **kwargs) -> vision.AnnotateImageResponse:
+        return self._call("label_detection", *args, **kwargs)
+
+    def close(self) -> None:
+        """
+        Stops accepting requests, without waiting on the losers of hedged requests.
+        """
+        if self.senders is not None:
+            self.senders.shutdown(wait=False)
+
+
+class AsyncHedgedAnnotator(HedgedAnnotator):
+    """
+    A HedgedAnnotator for the asynchronous client. Losing requests are cancelled, rather than left to finish.
+
+    If no client is given, an ImageAnnotatorAsyncClient is created on first use, inside the running event loop.
+    """
+
+    def __init__(self, client=None, deadline: Optional[float] = None, hedging: bool = True, percentile: float = 0.95,
+                 budget: Optional[HedgeBudget] = None, metrics: Optional[Metrics] = None):
+        super().__init__(client, deadline, hedging=False, percentile=percentile, budget=budget, metrics=metrics)
+        self.hedging = hedging
+
+    async def _send_async(self, *args, **kwargs) -> vision.BatchAnnotateImagesResponse:
+        start = time.monotonic()
+        result = await self.client.batch_annotate_images(*args, **kwargs)
+        if self.measured:
+            self.latencies.record(time.monotonic() - start)
+        return result
+
+    async def batch_annotate_images(self, *args, **kwargs) -> vision.BatchAnnotateImagesResponse:
+        try:
+            return await self._request_async(*args, **kwargs)
+        except exceptions.DeadlineExceeded:
+            self._count("exceeded", "deadlines_exceeded_total")
+            raise
+
+    async def _request_async(self, *args, **kwargs) -> vision.BatchAnnotateImagesResponse:
+        if self.client is None:
+            self.client = create_client(asynchronous=True)
+        if self.deadline is not None:
+            kwargs.setdefault("timeout", self.deadline)
+        self.budget.earn()
+        delay = self.latencies.percentile(self.percentile) if self.hedging else None
+        if delay is None:
+            return await self._send_async(*args, **kwargs)
+
+        timeout = kwargs.get("timeout")
+        expires = time.monotonic() + timeout if timeout is not None else None
+        primary = asyncio.ensure_future(self._send_async(*args, **kwargs))
+        pending = {primary}
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and self.budget.spend():
+            self._count("hedged", "hedges_issued_total")
+            if expires is not None:
+                kwargs["timeout"] = max(0.0, expires - time.monotonic())
+            pending.add(asyncio.ensure_future(self._send_async(*args, **kwargs)))
+
+        error = None
+        try:
+            while pending:
+                remaining = None if expires is None else max(0.0, expires - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise exceptions.DeadlineExceeded(f"No answer within the {timeout}s deadline.")
+                for future in done:
+                    if future.exception() is None:
+                        if future is not primary:
+                            self._count("won", "hedges_won_total")
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        pass
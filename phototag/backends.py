@@ -0,0 +1,217 @@
+"""
+backends.py
+
+Decode backends for lossy images, each able to decode straight to (about) thumbnail size rather than decoding at full
+resolution and shrinking afterwards. Pillow is always available; TurboJPEG & libvips are used when installed.
+"""
+
+import functools
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from phototag.constants import DECODE_BACKENDS, JPEG_EXTS
+from phototag.exceptions import InvalidConfigurationError
+
+try:
+    import turbojpeg
+except ImportError:
+    turbojpeg = None
+
+try:
+    import pyvips
+except (ImportError, OSError):  # OSError is raised when the libvips shared library is missing
+    pyvips = None
+
+logger = logging.getLogger(__name__)
+
+# The modes Image.reduce supports; other images are converted to RGB first, as they would be for encoding anyway
+REDUCIBLE_MODES: Tuple[str, ...] = ("L", "LA", "RGB", "RGBA", "RGBX", "CMYK", "I", "F")
+
+# The transpositions undoing each EXIF orientation, for backends that decode without Pillow
+ORIENTATIONS: Dict[int, List[Image.Transpose]] = {
+    2: [Image.Transpose.FLIP_LEFT_RIGHT],
+    3: [Image.Transpose.ROTATE_180],
+    4: [Image.Transpose.FLIP_TOP_BOTTOM],
+    5: [Image.Transpose.TRANSPOSE],
+    6: [Image.Transpose.ROTATE_270],
+    7: [Image.Transpose.TRANSVERSE],
+    8: [Image.Transpose.ROTATE_90],
+}
+
+
+def target_size(width: int, height: int, size: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    :param width: The width of the full image.
+    :param height: The height of the full image.
+    :param size: The box the thumbnail must fit in.
+    :return: The dimensions of the thumbnail, keeping the image's aspect ratio (and never enlarging it).
+    """
+    scale = min(1.0, size[0] / width, size[1] / height)
+    return max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+
+
+class DecodeBackend(object):
+    """
+    A base class for decode backends.
+    """
+
+    name: str = ""
+    extensions: Optional[List[str]] = None  # The extensions supported, or None for every lossy extension
+
+    @classmethod
+    def available(cls) -> bool:
+        """
+        :return: Whether the libraries the backend needs are installed.
+        """
+        return True
+
+    def supports(self, extension: str) -> bool:
+        return self.extensions is None or extension.lower() in self.extensions
+
+    def open(self, path: str, size: Tuple[int, int]) -> Image.Image:
+        """
+        Decodes an image at no less than the size of its thumbnail, correcting its orientation.
+
+        :param path: The path of the image.
+        :param size: The box the thumbnail will fit in.
+        :return: The decoded image, which may still need shrinking to fit the box exactly.
+        """
+        raise NotImplementedError()
+
+
+class PillowBackend(DecodeBackend):
+    """
+    Decodes JPEGs with DCT scaling (at 1/2, 1/4 or 1/8 scale) through Pillow's draft mode, and shrinks other formats
+    by an integer factor with Image.reduce before any resampling happens.
+    """
+
+    name = "pillow"
+
+    def open(self, path: str, size: Tuple[int, int]) -> Image.Image:
+        image = Image.open(path)
+        target = target_size(*image.size, size)
+        if image.format == "JPEG":
+            image.draft(None, target)  # Never scales beneath the target
+        else:
+            factor = min(image.width // target[0], image.height // target[1])
+            if factor >= 2:
+                if image.mode not in REDUCIBLE_MODES:
+                    converted = image.convert("RGB")
+                    image.close()
+                    image = converted
+                reduced = image.reduce(factor)
+                image.close()
+                image = reduced
+        return ImageOps.exif_transpose(image)
+
+
+class TurboJPEGBackend(DecodeBackend):
+    """
+    Decodes JPEGs through libjpeg-turbo (PyTurboJPEG) with DCT scaling.
+    """
+
+    name = "turbojpeg"
+    extensions = JPEG_EXTS
+
+    def __init__(self):
+        self.decoder = turbojpeg.TurboJPEG()
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)  # Checked once per process, as it loads the shared library
+    def available(cls) -> bool:
+        if turbojpeg is None:
+            return False
+        try:
+            turbojpeg.TurboJPEG()  # Fails when the libturbojpeg shared library is missing
+            return True
+        except (OSError, RuntimeError):
+            return False
+
+    def open(self, path: str, size: Tuple[int, int]) -> Image.Image:
+        with open(path, "rb") as file:
+            data = file.read()
+        width, height, _, _ = self.decoder.decode_header(data)
+        target = target_size(width, height, size)
+
+        # The smallest scaling factor still at least as large as the target
+        factor = min((factor for factor in self.decoder.scaling_factors
+                      if width * factor[0] / factor[1] >= target[0] and height * factor[0] / factor[1] >= target[1]),
+                     key=lambda factor: factor[0] / factor[1], default=(1, 1))
+        image = Image.fromarray(self.decoder.decode(data, pixel_format=turbojpeg.TJPF_RGB, scaling_factor=factor))
+
+        # The orientation is read from the header alone
+        with Image.open(path) as header:
+            orientation = header.getexif().get(0x0112)
+        for method in ORIENTATIONS.get(orientation, []):
+            image = image.transpose(method)
+        return image
+
+
+class VipsBackend(DecodeBackend):
+    """
+    Thumbnails through libvips, which shrinks on load for JPEG, PNG, WebP and others.
+    """
+
+    name = "vips"
+
+    @classmethod
+    def available(cls) -> bool:
+        return pyvips is not None
+
+    def open(self, path: str, size: Tuple[int, int]) -> Image.Image:
+        image = pyvips.Image.thumbnail(path, size[0], height=size[1], size="down")  # Also corrects orientation
+        if image.interpretation not in ("srgb", "b-w"):
+            image = image.colourspace("srgb")
+        if image.format != "uchar":
+            image = image.cast("uchar")
+        mode = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}[image.bands]
+        return Image.frombytes(mode, (image.width, image.height), image.write_to_memory())
+
+
+# In order of preference, fastest first
+BACKENDS: List[type] = [VipsBackend, TurboJPEGBackend, PillowBackend]
+BACKEND_NAMES: List[str] = DECODE_BACKENDS
+
+_instances: Dict[str, DecodeBackend] = {}
+
+
+def get_backend(name: str) -> DecodeBackend:
+    """
+    :param name: The name of a backend.
+    :return: The backend, created once per process.
+    :except InvalidConfigurationError: when the backend is unknown, or its libraries are not installed.
+    """
+    if name not in _instances:
+        backend = next((backend for backend in BACKENDS if backend.name == name), None)
+        if backend is None:
+            raise InvalidConfigurationError(f"Unknown decode backend '{name}', expected one of {BACKEND_NAMES}.")
+        if not backend.available():
+            raise InvalidConfigurationError(f"The '{name}' decode backend is not installed.")
+        _instances[name] = backend()
+    return _instances[name]
+
+
+def select_backend(extension: str, name: str = "auto") -> DecodeBackend:
+    """
+    :param extension: The extension of the image to decode.
+    :param name: The name of the backend to use, or 'auto' for the fastest installed backend supporting the format.
+    :return: The backend to decode the image with. Formats the named backend does not support fall back to Pillow.
+    """
+    if name != "auto":
+        backend = get_backend(name)
+        return backend if backend.supports(extension) else get_backend(PillowBackend.name)
+
+    for backend in BACKENDS:
+        if backend.available() and get_backend(backend.name).supports(extension):
+            return get_backend(backend.name)
+    return get_backend(PillowBackend.name)
+
+
+def available_backends() -> List[str]:
+    """
+    :return: The names of the backends installed.
+    """
+    return [backend.name for backend in BACKENDS if backend.available()]
@@ -0,0 +1,151 @@
+"""
+cache.py
+
+A persistent, content-addressed cache of the labels received from the Google Vision API, stored in SQLite.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import List, Optional
+
+from phototag.config import CONFIG_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(CONFIG_DIR, "labels.sqlite")
+CHUNK_SIZE = 1024 ** 2  # Files are hashed 1 MiB at a time
+
+
+def file_digest(path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    Hashes the contents of a file without reading it into memory all at once.
+
+    :param path: The path of the file to hash.
+    :param chunk_size: The number of bytes read per iteration.
+    :return: The hex digest of the file's contents.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as file:
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+
+class LabelCache(object):
+    """
+    Maps file content digests to the labels previously identified for them.
+
+    Entries older than max_age are dropped, and the least recently used entries are evicted while the total size of
+    the stored labels exceeds max_size.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size: int = 64 * 1024 ** 2,
+                 max_age: float = 180 * 24 * 60 * 60, write_only: bool = False):
+        """
+        Opens (or creates) a label cache.
+
+        :param path: The path of the SQLite database file.
+        :param max_size: The maximum number of bytes the cached labels may take up.
+        :param max_age: The maximum age of an entry, in seconds.
+        :param write_only: If true, lookups always miss but new labels are still stored. Used by --forget.
+        """
+        self.path, self.max_size, self.max_age = path, max_size, max_age
+        self.write_only = write_only
+        self.hits, self.misses = 0, 0
+
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS labels (
+                digest TEXT PRIMARY KEY,
+                labels TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS labels_accessed ON labels (accessed);
+        """)
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM labels").fetchone()[0]
+        self.evict()
+
+    def get(self, digest: str) -> Optional[List[str]]:
+        """
+        :param digest: The content digest of the file, as given by file_digest.
+        :return: The labels stored for the digest, or None if there are none (or they have expired).
+        """
+        if self.write_only:
+            self.misses += 1
+            return None
+
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT labels FROM labels WHERE digest = ? AND created >= ?", (digest, now - self.max_age)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.connection.execute("UPDATE labels SET accessed = ? WHERE digest = ?", (now, digest))
+            self.connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, digest: str, labels: List[str]) -> None:
+        """
+        Stores the labels identified for a digest, replacing any previous entry.
+
+        :param digest: The content digest of the file, as given by file_digest.
+        :param labels: The labels identified.
+        """
+        encoded = json.dumps(labels)
+        size = len(digest) + len(encoded)
+        now = time.time()
+        with self.lock:
+            previous = self.connection.execute("SELECT size FROM labels WHERE digest = ?", (digest,)).fetchone()
+            self.connection.execute("INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?, ?)",
+                                    (digest, encoded, size, now, now))
+            self.connection.commit()
+            self.size += size - (previous[0] if previous else 0)
+
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Drops expired entries, then the least recently used entries until the cache fits within max_size.
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM labels WHERE created < ?", (time.time() - self.max_age,))
+            self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM labels").fetchone()[0]
+
+            # Evict down to 90% of the limit so that eviction is not repeated on every single insert
+            target = self.max_size * 0.9
+            if self.size > self.max_size:
+                cursor = self.connection.execute("SELECT digest, size FROM labels ORDER BY accessed")
+                evicted = []
+                for digest, size in cursor:
+                    if self.size <= target:
+                        break
+                    evicted.append((digest,))
+                    self.size -= size
+                self.connection.executemany("DELETE FROM labels WHERE digest = ?", evicted)
+                logger.debug(f'Evicted {len(evicted)} labels from the cache.')
+            self.connection.commit()
+
+    def close(self) -> None:
+        """
+        Closes the underlying database connection.
+        """
+        with self.lock:
+            self.connection.close()
@@ -2,21 +2,22 @@
 cli.py
 
 The file responsible for providing commandline functionality to the user.
+
+Modules pulling in heavy dependencies (the Vision API client, rawpy, Pillow, Rich) are imported inside the commands
+needing them, so that `--help`, `auth` and the like start quickly.
 """
 import logging
 import os
-import re
 import shutil
 from pathlib import Path
-from typing import Tuple, List
+from typing import Optional, Tuple, List
 
 import click
-from google.cloud import vision
-from rich.progress import Progress, BarColumn
 
-from phototag import config, TEMP_PATH
-from phototag.helpers import select_files, convert_to_bytes, walk, path_to_match_mode
-from phototag.process import MasterFileProcessor
+from phototag import config, setup_logging, TEMP_PATH
+from phototag.constants import DECODE_BACKENDS, MAX_BATCH_IMAGES, RAW_MODES, REUSE_DISTANCE
+from phototag.helpers import select_paths, convert_to_bytes, format_bytes, shard_of, ScanEntry
+from phototag.journal import RunJournal, JOURNAL_NAME
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -25,7 +26,52 @@ logger.setLevel(logging.DEBUG)
 @click.group()
 def cli():
     """Base CLI command group"""
-    pass
+    setup_logging()
+
+
+def parse_shard(context: click.Context, parameter: click.Parameter, value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Parses a shard given as 'i/n' into a 0-based index & a count.
+    """
+    if value is None:
+        return None
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise click.BadParameter('Shards are given as \'i/n\', e.g. \'2/3\'.')
+    if not 1 <= index <= count:
+        raise click.BadParameter(f'The shard must be from 1/{count} to {count}/{count}.')
+    return index - 1, count
+
+
+def resolve_limits(max_threads: Optional[str], max_buffer: Optional[str], files: Optional[List[ScanEntry]],
+                   raw_mode: str, decoder: str, cpus: Optional[int]) -> Tuple[int, int, bool]:
+    """
+    Reads the image count & buffer size limits from the flags given, falling back to the [limits] configuration, and
+    tunes those set to 'auto' (calibrating on the files, if they are known up front).
+
+    :return: The image count, buffer size & single override to use.
+    """
+    from phototag.tuning import AUTO, calibrate, tune
+
+    # Flags take precedence over the [limits] configuration
+    max_threads = max_threads or config.config.get('limits', 'image_count', fallback='16')
+    max_buffer = max_buffer or config.config.get('limits', 'buffer_size', fallback='256 MB')
+    single_override = config.config.getboolean('limits', 'single_override', fallback=True)
+    auto_threads, auto_buffer = max_threads.strip().lower() == AUTO, max_buffer.strip().lower() == AUTO
+    if auto_threads or auto_buffer:
+        calibration = calibrate(files, raw_mode=raw_mode, decoder=decoder) if files is not None else None
+        if calibration is not None:
+            logger.debug(f'Calibrated on {calibration.files} files: {calibration.seconds * 1000:.0f} ms & '
+                         f'{format_bytes(calibration.memory)} per file.')
+        limits = tune(calibration, cpus=cpus)
+    try:
+        image_count = limits.image_count if auto_threads else int(max_threads)
+        buffer_size = limits.buffer_size if auto_buffer else convert_to_bytes(max_buffer)
+    except (ValueError, AttributeError):
+        raise click.UsageError('Limits must be \'auto\', a number of threads or a size such as \'256 MB\'.')
+    logger.info(f'Processing up to {image_count} files, {format_bytes(buffer_size)} at once.')
+    return image_count, buffer_size, single_override
 
 
 @cli.command('run', short_help='Run the tagging service.')
@@ -37,94 +83,452 @@ def cli():
 @click.option('-r', '--recursive', help='Recursively search for files in the current directory', is_flag=True)
 @click.option('--depth', type=int, help='The depth to search for files in the current directory', default=-1)
 @click.option('-g', '--glob', 'glob_pattern', help='Use Glob (UNIX-style file pattern matching) to match files.')
-@click.option('--max-threads', type=int, help='The maximum number of threads that can be running at any point')
+@click.option('--max-threads', help='The maximum number of threads that can be running at any point, or \'auto\' to '
+                                    'pick it from the CPUs available and a calibration on a few of the files.')
 @click.option('--max-buffer-size', 'max_buffer',
-              help='Keep the total size of the files in memory at or below this point')
+              help='Keep the total size of the files in memory at or below this point, or \'auto\' to pick it from '
+                   'the memory available and a calibration on a few of the files.')
 @click.option('--forget', is_flag=True, help='Don\'t utilize labels received from the Vision API previously.')
 @click.option('--overwrite', is_flag=True, help='Instead of adding tags, clear and overwrite them')
 @click.option('-d', '--dry-run', is_flag=True, help='Dry-run mode: Don\'t actually write to or modify files.')
 @click.option('-t', '--test', is_flag=True,
               help='Don\'t actually query the Vision API, just generate fake tags for testing purposes.')
+@click.option('-P', '--process-pool', is_flag=True, help='Decode & thumbnail images in a pool of worker processes.')
+@click.option('--pool-size', type=int, help='The number of decoding processes to use. Defaults to the CPU count.')
+@click.option('--raw-mode', type=click.Choice(RAW_MODES, case_sensitive=False), default='full',
+              help='Decode RAW files fully, or from their embedded preview (falling back to a half-size decode).')
+@click.option('--decoder', type=click.Choice(DECODE_BACKENDS, case_sensitive=False), default='auto', show_default=True,
+              help='The library decoding JPEGs & PNGs; \'auto\' picks the fastest installed.')
+@click.option('--max-upload-size', 'max_upload',
+              help='Lower thumbnail quality (and if need be, size) until each fits in this size, e.g. \'48 KB\'.')
+@click.option('--optimize-huffman/--no-optimize-huffman', default=None,
+              help='Spend a second encoding pass on a few percent smaller thumbnails (on by default).')
+@click.option('-B', '--batch', is_flag=True, help='Combine images from many files into multi-image API requests.')
+@click.option('--batch-size', type=click.IntRange(1, MAX_BATCH_IMAGES), default=MAX_BATCH_IMAGES,
+              help='The maximum number of images in a single batched request.')
+@click.option('--adaptive/--no-adaptive', default=True, show_default=True,
+              help='Adapt the number of API requests in flight to latency & throttling, retrying throttled requests.')
+@click.option('--max-requests', type=click.IntRange(1), default=32, show_default=True,
+              help='The most API requests in flight at once, when adaptive.')
+@click.option('--deadline', type=click.FloatRange(0, min_open=True), default=60, show_default=True,
+              help='Seconds each API request is given before it fails.')
+@click.option('--hedge', is_flag=True,
+              help='Send a duplicate of API requests slower than the recent 95th percentile, taking the first answer.')
+@click.option('--hedge-budget', type=click.FloatRange(0, 1), default=0.05, show_default=True,
+              help='The fraction of API requests that may be hedged.')
+@click.option('--reuse-similar', is_flag=True,
+              help='Reuse the labels of near-duplicate images (e.g. the frames of a burst) instead of sending each.')
+@click.option('--similarity', type=click.IntRange(0, 32), default=REUSE_DISTANCE, show_default=True,
+              help='The most bits the perceptual hashes of near-duplicate images may differ by, out of 64.')
+@click.option('--engine', type=click.Choice(['threads', 'asyncio'], case_sensitive=False), default='threads',
+              help='Process files in a thread each, or as tasks on a single asyncio event loop.')
+@click.option('-s', '--stream', is_flag=True, help='Start processing files while the rest are still being found.')
+@click.option('--window', type=click.IntRange(1), default=256,
+              help='When streaming, the number of files queued (and ordered by size) at once.')
+@click.option('--shard', callback=parse_shard,
+              help='Only process the i-th of n shards of the files (e.g. \'2/3\'), split by a hash of their paths.')
+@click.option('--queue', 'queue_path', type=click.Path(dir_okay=False),
+              help='Share the files with other runs through this work queue, e.g. on the library\'s own storage.')
+@click.option('--lease', type=click.FloatRange(1), default=120, show_default=True,
+              help='Seconds before files claimed from the work queue by a run that stopped responding are reclaimed.')
+@click.option('--claim-size', type=click.IntRange(1), default=16, show_default=True,
+              help='The number of files claimed from the work queue at once.')
+@click.option('--resume', is_flag=True, help='Skip files a previous run finished, unless they have changed since.')
+@click.option('--journal', 'journal_path', type=click.Path(dir_okay=False),
+              help=f'The journal finished files are recorded in, for --resume. Kept in {JOURNAL_NAME} if only --resume '
+                   f'is given, and off under --test.')
+@click.option('--index/--no-index', 'use_index', default=True, show_default=True,
+              help='Record the tags written in the library index searched by `phototag query`. Off under --test.')
+@click.option('--metrics-json', type=click.Path(dir_okay=False), help='Write run metrics to this JSON file at exit.')
+@click.option('--metrics-textfile', type=click.Path(dir_okay=False),
+              help='Periodically write run metrics to this Prometheus textfile, for node_exporter to collect.')
+@click.option('--metrics-interval', type=click.FloatRange(0.1), default=15, show_default=True,
+              help='Seconds between writes of the Prometheus textfile.')
+@click.option('--debug-temp', is_flag=True, help='Also write each uploaded thumbnail to a \'temp\' directory.')
 def run(files: Tuple[str], all: bool = False, regex: str = None, recursive: bool = None, depth: int = None,
         glob_pattern: str = None, regex_mode: str = None,
-        max_threads: int = None,
+        max_threads: str = None,
         max_buffer: str = None, forget: bool = False, overwrite: bool = False, dry_run: bool = False,
-        test: bool = False):
+        test: bool = False, process_pool: bool = False, pool_size: int = None, raw_mode: str = 'full',
+        decoder: str = 'auto', max_upload: str = None, optimize_huffman: bool = None, batch: bool = False,
+        batch_size: int = MAX_BATCH_IMAGES, adaptive: bool = True,
+        max_requests: int = 32,
+        deadline: float = 60, hedge: bool = False, hedge_budget: float = 0.05, reuse_similar: bool = False,
+        similarity: int = REUSE_DISTANCE, engine: str = 'threads',
+        stream: bool = False,
+        window: int = 256, shard: Optional[Tuple[int, int]] = None, queue_path: str = None, lease: float = 120,
+        claim_size: int = 16, resume: bool = False, journal_path: Optional[str] = None, use_index: bool = True,
+        metrics_json: str = None,
+        metrics_textfile: str = None, metrics_interval: float = 15, debug_temp: bool = False):
     """
     Run tagging on FILES.
 
     Files can also be selected using --all, --regex and --glob.
     --max-threads, --max-buffer-size and --forget will inherit their settings from the global config.
+
+    Several runs (e.g. on several hosts) can tag a shared library together, started from its root: split it up front
+    with --shard, or pass them the same --queue to balance the files between them as they go.
     """
-    print(files)
-    files: List[Path] = [Path(file) for file in files]
-
-    cwd = Path.cwd()
-    if glob_pattern:
-        logger.debug('Using glob pattern: {}'.format(glob_pattern))
-        files.extend(cwd.rglob(glob_pattern) if recursive else cwd.glob(glob_pattern))
-    elif all:
-        # Default behavior: Select all in CWD, if recursive, walk with optional depth (default -1, infinite)
-        if recursive:
-            logger.debug('Using recursive search with depth: {}'.format(depth))
-            files.extend(path for path in walk(cwd, depth=depth))
-        else:
-            logger.debug('Pulling all files from current directory.')
-            files.extend([item for item in cwd.iterdir() if item.is_file()])
+    from rich.progress import Progress, BarColumn
+
+    from phototag.annotate import FakeImageAnnotatorClient, FakeImageAnnotatorAsyncClient, BatchAnnotator, \
+        AdaptiveAnnotator, AsyncAdaptiveAnnotator, HedgedAnnotator, AsyncHedgedAnnotator, create_client
+    from phototag.backends import available_backends
+    from phototag.cache import DEFAULT_CACHE_PATH, LabelCache
+    from phototag.decode import create_pool
+    from phototag.engine import AsyncMasterFileProcessor
+    from phototag.index import TagIndex
+    from phototag.limiter import AdaptiveLimiter, AsyncAdaptiveLimiter, HedgeBudget
+    from phototag.metrics import Metrics, PrometheusExporter
+    from phototag.process import MasterFileProcessor, FileProcessor
+    from phototag.similar import LabelReuse
+
+    if decoder != 'auto' and decoder not in available_backends():
+        raise click.UsageError(f'The \'{decoder}\' decoder is not installed.')
+    logger.debug(f'Decode backends installed: {", ".join(available_backends())}.')
+
+    max_upload = max_upload or config.config.get('upload', 'max_size', fallback='')
+    max_bytes = convert_to_bytes(max_upload) if max_upload else None
+    if optimize_huffman is None:
+        optimize_huffman = config.config.getboolean('upload', 'optimize_huffman', fallback=True)
 
-    # Regex is applied as a 'filter' to each file selected.
-    if regex:
-        logger.debug('Applying RegEx pattern: {}'.format(regex))
-        compiled_regex = re.compile(regex)
-        files = [file for file in files if
-                 compiled_regex.match(path_to_match_mode(file, regex_mode, root=cwd))]
+    selected = select_paths(files, all=all, regex=regex, regex_mode=regex_mode, recursive=recursive, depth=depth,
+                            glob_pattern=glob_pattern)
 
-    if len(files) < 1:
-        logger.error('No files selected for processing. Cannot proceed.')
-        return
+    if shard is not None:
+        shard_index, shard_count = shard
+        selected = (entry for entry in selected if shard_of(entry.path, shard_count) == shard_index)
 
-    logger.debug('{} files selected for processing.'.format(len(files)))
+    # Files given fake labels are not recorded, lest a later real run skip them
+    journal = RunJournal(journal_path or JOURNAL_NAME) if (resume or journal_path) and not test else None
+    if resume and journal is None:
+        logger.warning('Nothing to resume from under --test; every file selected is processed.')
+    elif resume:
+        logger.debug(f'Resuming, {len(journal.entries)} files were finished previously.')
+        selected = (entry for entry in selected if not journal.finished(entry))
 
-    client = vision.ImageAnnotatorClient()
-    logger.debug("Vision API Client created.")
+    work = None
+    if queue_path:
+        from phototag.workqueue import WorkQueue
+
+        work = WorkQueue(queue_path, lease=lease, claim_size=claim_size)
+        logger.info(f'Added {work.add(selected)} files to the work queue as {work.worker}: '
+                    + ', '.join(f'{count} {state}' for state, count in work.stats().items()) + '.')
+        # Files are claimed as the processor pulls them, so only a claim's worth are queued ahead of processing
+        selected, stream, window = work.files(), True, min(window, claim_size)
+
+    def finished(fp: FileProcessor) -> None:
+        """Records successfully tagged files (as they are after tagging) in the journal & the work queue."""
+        if fp.succeeded and journal is not None:
+            journal.record(ScanEntry.from_path(fp.file_path))
+        if work is not None:
+            work.complete(fp.file_path, fp.succeeded)
+
+    def skipped(path: Path) -> None:
+        """Completes files that could not be processed as failed, so that they are not claimed over & over."""
+        if work is not None:
+            work.complete(path, succeeded=False)
+
+    if stream:
+        logger.debug(f'Streaming files to the processor as they are found (window of {window}).')
+        files = selected
+    else:
+        files: List[ScanEntry] = list(selected)
+        if len(files) < 1:
+            logger.error('No files selected for processing. Cannot proceed.')
+            if journal is not None:
+                journal.close()
+            return
+
+        logger.debug('{} files selected for processing.'.format(len(files)))
+
+    image_count, buffer_size, single_override = resolve_limits(max_threads, max_buffer, None if stream else files,
+                                                               raw_mode, decoder, pool_size if process_pool else None)
+
+    metrics = Metrics()
+    if engine == 'asyncio':
+        if batch:
+            raise click.UsageError('Batching is not supported by the asyncio engine.')
+        # The asynchronous Vision API client is created by the engine, inside of its event loop.
+        client = FakeImageAnnotatorAsyncClient(latency=(0, 3)) if test else None
+        if adaptive:
+            client = AsyncAdaptiveAnnotator(client, AsyncAdaptiveLimiter(maximum=max_requests))
+        adaptive_client = client if adaptive else None
+        client = hedged = AsyncHedgedAnnotator(client, deadline=deadline, hedging=hedge,
+                                               budget=HedgeBudget(hedge_budget), metrics=metrics)
+        processor_class = AsyncMasterFileProcessor
+    else:
+        client = FakeImageAnnotatorClient(latency=(0, 3)) if test else create_client()
+        if adaptive:
+            client = AdaptiveAnnotator(client, AdaptiveLimiter(maximum=max_requests))
+        adaptive_client = client if adaptive else None
+        client = hedged = HedgedAnnotator(client, deadline=deadline, hedging=hedge, budget=HedgeBudget(hedge_budget),
+                                          metrics=metrics)
+        processor_class = MasterFileProcessor
+        logger.debug("Vision API Client created.")
+
+    if batch:
+        client = BatchAnnotator(client, max_images=batch_size)
+
+    executor = create_pool(pool_size) if process_pool else None
+    # Fake labels are kept out of the persistent cache, lest later real runs reuse them
+    cache = LabelCache(path=':memory:' if test else DEFAULT_CACHE_PATH,
+                       max_size=convert_to_bytes(config.config.get('cache', 'max_size', fallback='64 MB')),
+                       max_age=config.config.getfloat('cache', 'max_age', fallback=180) * 24 * 60 * 60,
+                       write_only=forget)
+    index = TagIndex() if use_index and not test else None  # Fake labels are never indexed
+    reuse = LabelReuse(similarity) if reuse_similar else None
+
+    exporter = PrometheusExporter(metrics, metrics_textfile, metrics_interval) if metrics_textfile else None
 
     try:
-        # Create the 'temp' directory
-        if not os.path.exists(TEMP_PATH):
+        # Create the 'temp' directory, only used for debugging thumbnails
+        if debug_temp and not os.path.exists(TEMP_PATH):
             logger.info("Creating temporary processing directory")
             os.makedirs(TEMP_PATH)
 
         with Progress("[progress.description]{task.description}", BarColumn(bar_width=None),
                       "{task.completed}/{task.total} [progress.percentage]{task.percentage:>3.0f}%") as progress:
-            mp = MasterFileProcessor(files, 10, convert_to_bytes("2 MB"), True, client=client, progress=progress)
+            mp = processor_class(files, image_count, buffer_size, single_override, client=client, progress=progress,
+                                 executor=executor, raw_mode=raw_mode, decoder=decoder, max_bytes=max_bytes,
+                                 optimize_huffman=optimize_huffman, debug_temp=debug_temp, cache=cache,
+                                 index=index, reuse=reuse, stream=stream, window=window, on_finished=finished,
+                                 metrics=metrics, on_skipped=skipped)
             mp.load()
             logger.info('Finished loading/starting initial threads.')
             mp.join()
             logger.info('Finished joining threads, now quitting.')
+
+        for line in mp.report.summary():
+            logger.info(f'Decoded {line}')
+        logger.info(f'Label cache: {cache.hits} hits, {cache.misses} misses.')
+        if reuse is not None:
+            logger.info(reuse.summary())
+        if batch:
+            logger.info(f'Sent {client.images} images in {client.requests} batched requests.')
+        if adaptive_client is not None:
+            limiter = adaptive_client.limiter
+            logger.info(f'Request limit settled at {limiter.limit:.1f} ({limiter.throttled} throttled, '
+                        f'{limiter.slow} slow, {adaptive_client.retried} retried).')
+        if hedge:
+            logger.info(f'Hedged {hedged.hedged} requests, {hedged.won} of which answered first.')
+        if hedged.exceeded:
+            logger.warning(f'{hedged.exceeded} requests exceeded their {deadline}s deadline.')
     except Exception as error:
         logger.exception(str(error))
     finally:
-        # If the temporary path was created, remove it.
-        if os.path.exists(TEMP_PATH):
-            os.rmdir(TEMP_PATH)
-        logger.debug("Temporary directory removed.")
+        if executor is not None:
+            executor.shutdown()
+        if batch:
+            client.close()
+        hedged.close()
+        cache.close()
+        if journal is not None:
+            journal.close()
+        if index is not None:
+            index.close()
+        if work is not None:
+            logger.info(f'Claimed {work.claimed} files from the work queue ({work.reclaimed} reclaimed from runs that '
+                        f'stopped), completing {work.completed}.')
+            work.close()
+
+        if exporter is not None:
+            exporter.close()
+        if metrics_json:
+            metrics.write_json(metrics_json)
+
+        # If the temporary path was created, remove it (unless thumbnails of failed files were left behind).
+        if debug_temp and os.path.exists(TEMP_PATH):
+            if os.listdir(TEMP_PATH):
+                logger.warning(f'Thumbnails of failed files were kept in "{TEMP_PATH}".')
+            else:
+                os.rmdir(TEMP_PATH)
+                logger.debug("Temporary directory removed.")
+
+
+@cli.command('watch', short_help='Tag images as they land in a folder.')
+@click.argument('directory', default='.', type=click.Path(exists=True, file_okay=False))
+@click.option('-r', '--recursive', is_flag=True, help='Also watch subdirectories.')
+@click.option('--depth', type=int, default=-1, help='The number of directory levels watched when recursive.')
+@click.option('--interval', type=click.FloatRange(0.1), default=1.0, show_default=True,
+              help='Seconds between scans of the folder.')
+@click.option('--settle', type=click.FloatRange(0), default=2.0, show_default=True,
+              help='Seconds a file must go unchanged (e.g. once copied or uploaded) before it is tagged.')
+@click.option('--skip-existing', is_flag=True, help='Leave the images already in the folder alone unless they change.')
+@click.option('-t', '--test', is_flag=True,
+              help='Don\'t actually query the Vision API, just generate fake tags for testing purposes.')
+@click.option('-P', '--process-pool', is_flag=True, help='Decode & thumbnail images in a pool of worker processes.')
+@click.option('--pool-size', type=int, help='The number of decoding processes to use. Defaults to the CPU count.')
+@click.option('--raw-mode', type=click.Choice(RAW_MODES, case_sensitive=False), default='full',
+              help='Decode RAW files fully, or from their embedded preview (falling back to a half-size decode).')
+@click.option('--decoder', type=click.Choice(DECODE_BACKENDS, case_sensitive=False), default='auto', show_default=True,
+              help='The library decoding JPEGs & PNGs; \'auto\' picks the fastest installed.')
+@click.option('--max-threads', help='The maximum number of threads that can be running at any point, or \'auto\'.')
+@click.option('--max-buffer-size', 'max_buffer',
+              help='Keep the total size of the files in memory at or below this point, or \'auto\'.')
+@click.option('--reuse-similar', is_flag=True,
+              help='Reuse the labels of near-duplicate images (e.g. the frames of a burst) instead of sending each.')
+@click.option('--index/--no-index', 'use_index', default=True, show_default=True,
+              help='Record the tags written in the library index searched by `phototag query`. Off under --test.')
+@click.option('--journal', 'journal_path', type=click.Path(dir_okay=False), default=JOURNAL_NAME, show_default=True,
+              help='The journal tagged files are recorded in; files it holds are not tagged again after a restart. '
+                   'Off under --test.')
+def watch(directory: str, recursive: bool = False, depth: int = -1, interval: float = 1.0, settle: float = 2.0,
+          skip_existing: bool = False, test: bool = False, process_pool: bool = False, pool_size: int = None,
+          raw_mode: str = 'full', decoder: str = 'auto', max_threads: str = None, max_buffer: str = None,
+          reuse_similar: bool = False, use_index: bool = True, journal_path: str = JOURNAL_NAME):
+    """
+    Watch DIRECTORY (the current directory by default), tagging images as they land in it until interrupted.
+
+    A single Vision API client, decode pool & label cache are kept for as long as it runs. Images are tagged once
+    they stop changing, RAW files once their XMP sidecar arrives, and images changed later are tagged again.
+    """
+    from phototag.annotate import FakeImageAnnotatorClient, AdaptiveAnnotator, create_client
+    from phototag.cache import DEFAULT_CACHE_PATH, LabelCache
+    from phototag.decode import create_pool, warm_pool
+    from phototag.index import TagIndex
+    from phototag.limiter import AdaptiveLimiter
+    from phototag.process import MasterFileProcessor, FileProcessor
+    from phototag.similar import LabelReuse
+    from phototag.tuning import cpu_count
+    from phototag.watch import Watcher
+
+    image_count, buffer_size, single_override = resolve_limits(max_threads, max_buffer, None, raw_mode, decoder,
+                                                               pool_size if process_pool else None)
+    journal = RunJournal(journal_path) if not test else None  # Files given fake labels are not recorded
+    watcher = Watcher(Path(directory), depth=depth if recursive else 1, interval=interval, settle=settle,
+                      skip_existing=skip_existing, handled=journal.finished if journal is not None else None)
+
+    def finished(fp: FileProcessor) -> None:
+        """Records tagged files (as they are after tagging) in the journal, and with the watcher."""
+        if fp.succeeded and journal is not None:
+            journal.record(ScanEntry.from_path(fp.file_path))
+        watcher.done(fp.file_path, fp.succeeded)
+
+    client = AdaptiveAnnotator(FakeImageAnnotatorClient(latency=(0, 3)) if test else create_client(),
+                               AdaptiveLimiter())
+    executor = None
+    if process_pool:
+        pool_size = pool_size or cpu_count()
+        executor = create_pool(pool_size)
+        warm_pool(executor, pool_size)
+    cache = LabelCache(path=':memory:' if test else DEFAULT_CACHE_PATH,
+                       max_size=convert_to_bytes(config.config.get('cache', 'max_size', fallback='64 MB')),
+                       max_age=config.config.getfloat('cache', 'max_age', fallback=180) * 24 * 60 * 60)
+    index = TagIndex() if use_index and not test else None  # Fake labels are never indexed
+    reuse = LabelReuse() if reuse_similar else None
+
+    mp = MasterFileProcessor(watcher.files(), image_count, buffer_size, single_override, client=client,
+                             executor=executor, raw_mode=raw_mode, decoder=decoder, cache=cache, index=index,
+                             reuse=reuse, stream=True, on_finished=finished,
+                             on_skipped=lambda path: watcher.done(path, succeeded=False))
+    logger.info(f'Watching "{os.path.abspath(directory)}" for images, every {interval:g}s. Press Ctrl+C to stop.')
+    try:
+        mp.load()
+        mp.join()
+    except KeyboardInterrupt:
+        logger.info('Stopping; finishing the files being tagged.')
+        watcher.stop()
+        mp.join()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        cache.close()
+        if journal is not None:
+            journal.close()
+        if index is not None:
+            index.close()
+    logger.info(f'Tagged {mp.finished - mp.failed} files ({mp.failed} failed) over {watcher.scans} scans.')
+    if reuse is not None:
+        logger.info(reuse.summary())
 
 
 @cli.command('collect')
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
-@click.argument('output', type=click.File(mode="w"), required=False)
-@click.option('--level', default=0.25)
+@click.option('-o', '--output', type=click.File(mode='w'), default='-',
+              help='The file the tags are written to, one per line. Defaults to standard output.')
+@click.option('--level', type=click.FloatRange(0, 1), default=0.25, show_default=True,
+              help='The fraction of files a tag must be found in to be collected.')
 @click.option('-a', '--all', is_flag=True, help='Add all files in the current directory to be tagged.')
 @click.option('-r', '--regex', help='Use RegEx to match files in the current directory')
 @click.option('-g', '--glob', 'glob_pattern', help='Use Glob (UNIX-style file pattern matching) to match files.')
-def collect(files: Tuple[str], output=None, all: bool = False, regex: str = None, glob: str = None):
+@click.option('--recursive', is_flag=True, help='Recursively search for files in the current directory')
+@click.option('--depth', type=int, help='The depth to search for files in the current directory', default=-1)
+@click.option('--workers', type=click.IntRange(1), default=32, show_default=True,
+              help='The number of files read at once; reads are mostly waiting on storage, so use many.')
+def collect(files: Tuple[str], output, level: float = 0.25, all: bool = False, regex: str = None,
+            glob_pattern: str = None, recursive: bool = False, depth: int = -1, workers: int = 32):
     """
     Collects tags from selected images for compiling the average tags of an album.
 
-    Input is selected with FILES or using --all, --regex and --glob.
+    Input is selected with FILES or using --all, --regex and --glob. Only the metadata of each file is read: the IPTC
+    keywords of JPEGs and the XMP sidecars of RAW files.
     """
-    files = select_files(list(files), regex, glob)
-    pass
+    from phototag.collect import collect as collect_tags
+
+    selected = select_paths(files, all=all, regex=regex, recursive=recursive, depth=depth, glob_pattern=glob_pattern)
+    collection = collect_tags(selected, workers=workers)
+
+    tags = collection.frequent(level)
+    for tag, _ in tags:
+        output.write(f'{tag}\n')
+    # Kept off standard output, which the tags may be written to
+    click.echo(f'Read the tags of {collection.files} files ({collection.failed} failed): {len(tags)} of '
+               f'{len(collection.counts)} tags were found in at least {level:.0%} of them.', err=True)
+
+
+@cli.command('index')
+@click.argument('files', nargs=-1, type=click.Path(exists=True))
+@click.option('-a', '--all', is_flag=True, help='Add all files in the current directory to the index.')
+@click.option('-r', '--regex', help='Use RegEx to match files in the current directory')
+@click.option('-g', '--glob', 'glob_pattern', help='Use Glob (UNIX-style file pattern matching) to match files.')
+@click.option('--recursive', is_flag=True, help='Recursively search for files in the current directory')
+@click.option('--depth', type=int, help='The depth to search for files in the current directory', default=-1)
+@click.option('--workers', type=click.IntRange(1), default=32, show_default=True,
+              help='The number of files stat\'ed & read at once; mostly waiting on storage, so use many.')
+def index(files: Tuple[str], all: bool = False, regex: str = None, glob_pattern: str = None, recursive: bool = False,
+          depth: int = -1, workers: int = 32):
+    """
+    Adds the tags of selected images to the library index searched by `phototag query`.
+
+    Input is selected with FILES or using --all, --regex and --glob. Files already indexed are only read again if
+    their tags' file (the image, or a RAW file's XMP sidecar) changed since, and indexed files in the current directory
+    that no longer exist are dropped.
+    """
+    from phototag.index import TagIndex
+
+    selected = select_paths(files, all=all, regex=regex, recursive=recursive, depth=depth, glob_pattern=glob_pattern)
+    tag_index = TagIndex()
+    try:
+        stats = tag_index.refresh(selected, workers=workers, prune=Path.cwd())
+    finally:
+        tag_index.close()
+    logger.info(f'Indexed {stats.added} new & {stats.changed} changed files, {stats.unchanged} were unchanged, '
+                f'{stats.removed} removed & {stats.failed} failed.')
+
+
+@cli.command('query')
+@click.argument('tags', nargs=-1, required=True)
+@click.option('--any', 'match_any', is_flag=True, help='Find files carrying any of the tags, instead of all of them.')
+@click.option('-c', '--count', is_flag=True, help='Only print the number of files found.')
+@click.option('-n', '--limit', type=click.IntRange(1), help='The most files printed.')
+def query(tags: Tuple[str], match_any: bool = False, count: bool = False, limit: int = None):
+    """
+    Prints the files carrying TAGS, one per line, from the library index built by `phototag run` & `phototag index`.
+
+    Tags are matched case-insensitively; files must carry every tag unless --any is given.
+    """
+    from phototag.index import TagIndex
+
+    tag_index = TagIndex()
+    try:
+        if count:
+            click.echo(tag_index.count(list(tags), any=match_any))
+        else:
+            for path in tag_index.query(list(tags), any=match_any, limit=limit):
+                click.echo(path)
+    finally:
+        tag_index.close()
 
 
 @cli.command('auth')
@@ -0,0 +1,96 @@
+"""
+collect.py
+
+Aggregates the tags already written to many files (e.g. an album), reading only the metadata of each: the IPTC
+segment at the head of a JPEG or the dc:subject bag of a RAW file's XMP sidecar, never the image data itself.
+"""
+
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+from phototag import iptc, xmp
+from phototag.constants import JPEG_EXTS, RAW_EXTS
+from phototag.exceptions import MetadataError
+from phototag.helpers import ScanEntry, bounded_map, get_extension
+
+logger = logging.getLogger(__name__)
+
+# Reads are latency bound on network storage, so many more run at once than there are CPUs
+COLLECT_WORKERS: int = 32
+
+
+def tag_source(path: Path) -> Path:
+    """
+    :param path: The path of an image.
+    :return: The file the image's tags are written to: its XMP sidecar for RAW files, the image itself otherwise.
+    """
+    if get_extension(path.name).lower() in RAW_EXTS:
+        return path.with_suffix(".xmp")
+    return path
+
+
+def read_tags(path: Path) -> List[str]:
+    """
+    Reads the tags of a file from its metadata alone.
+
+    :param path: The path of an image.
+    :return: The tags of the image; empty for formats phototag does not write tags into (e.g. PNG).
+    :except MetadataError: when the file's metadata cannot be parsed.
+    """
+    extension = get_extension(path.name).lower()
+    if extension in RAW_EXTS:
+        try:
+            return xmp.read_keywords(str(tag_source(path)))
+        except FileNotFoundError:
+            return []
+    if extension in JPEG_EXTS:
+        return iptc.read_keywords(str(path))
+    return []
+
+
+class TagCollection(object):
+    """
+    Tag frequencies over a set of files, aggregated as each file is read.
+    """
+
+    def __init__(self):
+        self.counts: Counter = Counter()  # The number of files carrying each tag
+        self.files = 0  # The number of files read
+        self.failed = 0  # The number of files whose metadata could not be read
+
+    def add(self, tags: Iterable[str]) -> None:
+        self.counts.update(set(tags))  # A tag repeated within a file counts once
+        self.files += 1
+
+    def frequent(self, level: float = 0.0) -> List[Tuple[str, int]]:
+        """
+        :param level: The fraction of files a tag must be found in, from 0 to 1.
+        :return: The tags found in at least that fraction of the files, with their counts, most frequent first.
+        """
+        threshold = level * self.files
+        return sorted(((tag, count) for tag, count in self.counts.items() if count >= threshold),
+                      key=lambda item: (-item[1], item[0]))
+
+
+def collect(files: Iterable[Union[Path, ScanEntry]], workers: int = COLLECT_WORKERS,
+            collection: Optional[TagCollection] = None) -> TagCollection:
+    """
+    Reads the tags of every file in a thread pool, consuming the files lazily and aggregating tags as reads finish,
+    so that neither paths nor tags pile up in memory.
+
+    :param files: The files (or ScanEntry objects) to read.
+    :param workers: The number of files read at once.
+    :param collection: The collection to add to; a new one is created if not given.
+    :return: The collection of tags read.
+    """
+    collection = collection if collection is not None else TagCollection()
+    paths = (item.path if isinstance(item, ScanEntry) else Path(item) for item in files)
+    for path, future in bounded_map(read_tags, paths, workers, 'Collect'):
+        try:
+            collection.add(future.result())
+        except (MetadataError, OSError) as error:
+            collection.failed += 1
+            logger.warning(f'Could not read tags of "{path}": {error}')
+    return collection
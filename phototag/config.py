@@ -2,39 +2,82 @@
 config.py
 
 Assist with creating, accessing and saving to a configuration file located in the script installation folder.
+
+The file is only read (or created) once the configuration is first accessed as `config.config`, so that importing
+phototag never touches the disk.
 """
 
 import configparser
 import os
+from typing import Optional
 
 SCRIPT_ROOT = os.path.dirname(os.path.realpath(__file__))  # Script installation folder
 CONFIG_DIR = os.path.join(SCRIPT_ROOT, "config")  # Configuration file folder
 CONFIG_PATH = os.path.join(CONFIG_DIR, "config.ini")  # Configuration file
-config = configparser.ConfigParser()
+
+_config: Optional[configparser.ConfigParser] = None
+
+
+def load() -> configparser.ConfigParser:
+    """
+    Reads the configuration file, creating it with default values if it does not exist. Only done once.
+
+    :return: The configuration.
+    """
+    global _config
+    if _config is not None:
+        return _config
+
+    _config = configparser.ConfigParser()
+    # If file does not exist
+    if not os.path.exists(CONFIG_PATH):
+        # If folder does not exist
+        if not os.path.exists(CONFIG_DIR):
+            os.makedirs(CONFIG_DIR)
+
+        # Default configuration data
+        _config["google"] = {"credentials": ""}
+        _config["limits"] = {
+            "image_count": 16,  # 16 images in memory at any time ('auto' to tune it to the host)
+            "buffer_size": "256 MB",  # 256 MB of images in memory at any time ('auto' to tune it to the host)
+            "single_override": True  # disregard previous filters to keep at least 1 image in rotation
+        }
+        _config["cache"] = {
+            "max_size": "64 MB",  # labels stored before least recently used entries are evicted
+            "max_age": 180  # days before labels are considered stale
+        }
+        _config["upload"] = {
+            "max_size": "",  # largest thumbnail uploaded (e.g. 48 KB), lowering quality to fit; empty for no limit
+            "optimize_huffman": True  # spend a second encoding pass on a few percent smaller thumbnails
+        }
+
+        quicksave()
+    else:
+        # File exists, so just read
+        with open(CONFIG_PATH, "r") as file:
+            _config.read_file(file)
+    return _config
 
 
 def quicksave():
     """Simple function for saving current configuration state to file"""
+    config = load()
     with open(CONFIG_PATH, "w+") as file:
         config.write(file)
 
 
-# If file does not exist
-if not os.path.exists(CONFIG_PATH):
-    # If folder does not exist
-    if not os.path.exists(CONFIG_DIR):
-        os.makedirs(CONFIG_DIR)
-
-    # Default configuration data
-    config["google"] = {"credentials": ""}
-    config["limits"] = {
-        "image_count": 16,  # 16 images in memory at any time
-        "buffer_size": "256 MB",  # 256 MB of images in memory at any time,
-        "single_override": True  # disregard previous filters to keep at least 1 image in rotation
-    }
-
-    quicksave()
-else:
-    # File exists, so just read
-    with open(CONFIG_PATH, "r") as file:
-        config.read_file(file)
+def apply_credentials() -> None:
+    """
+    Points the Google Cloud client libraries at the configured credentials file, if one was configured.
+    Must be called before a Vision API client is created.
+    """
+    credentials = load().get("google", "credentials", fallback="")
+    if credentials:
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(CONFIG_DIR, credentials)
+
+
+def __getattr__(name: str):
+    # Loads the configuration on first access of `config.config`
+    if name == "config":
+        return load()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -8,3 +8,13 @@ RAW_EXTS = ["3fr", "ari", "arw", "bay", "braw", "crw", "cr2", "cr3", "cap", "dat
             "erf", "fff", "gpr", "iiq", "k25", "kdc", "mdc", "mef", "mos", "mrw", "nef", "nrw", "obm", "orf", "pef",
             "ptx", "pxn", "r3d", "raf", "raw", "rwl", "rw2", "rwz", "sr2", "srf", "srw", "tif", "x3f", ]
 LOSSY_EXTS = ["jpeg", "jpg", "jpe", "png"]
+JPEG_EXTS = ["jpeg", "jpg", "jpe"]
+
+# Option values, kept here so that the CLI can be built without importing the modules behind them
+# RAW decoding modes: 'full' demosaics at native resolution, 'preview' tries the embedded JPEG preview first and
+# falls back to a half-size demosaic.
+RAW_MODES = ["full", "preview"]
+DECODE_BACKENDS = ["auto", "vips", "turbojpeg", "pillow"]  # See backends.BACKENDS
+MAX_BATCH_IMAGES = 16  # The most images the Vision API accepts in a single batch request
+# Bits the perceptual hashes of near-duplicates may differ by; burst frames are typically within a few of each other
+REUSE_DISTANCE = 6
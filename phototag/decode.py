@@ -0,0 +1,316 @@
+"""
+decode.py
+
+Decodes RAW and lossy images into small, encoded JPEG thumbnails suitable for upload to the Google Vision API.
+
+Every function here is safe to run inside the worker processes of a ProcessPoolExecutor; only paths go in and
+only the (small) encoded thumbnail comes back out, keeping the CPU-bound demosaicing & encoding off the GIL.
+"""
+
+import io
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Dict, Optional, Tuple, NamedTuple, List
+
+import rawpy
+from PIL import Image, ImageOps
+
+from phototag.backends import select_backend
+from phototag.constants import RAW_EXTS, RAW_MODES
+from phototag.helpers import get_extension, format_bytes
+from phototag.similar import perceptual_hash
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE: Tuple[int, int] = (512, 512)
+THUMBNAIL_QUALITY: int = 85
+
+# Bounds of the search for a thumbnail fitting a byte budget
+MIN_QUALITY: int = 40
+MIN_DIMENSION: int = 256  # The shortest side thumbnails are shrunk to, at most
+QUALITY_STEP: int = 5  # The search stops once quality is known to within this many points
+MAX_ENCODES: int = 10
+
+# Rough ratio of decoded memory to compressed file size, used when an image's dimensions cannot be read
+MEMORY_PER_BYTE: int = 12
+
+# Decode paths that can be reported
+SOURCE_LOSSY = "lossy"
+SOURCE_FULL = "full"
+SOURCE_PREVIEW = "preview"
+SOURCE_HALF = "half-size"
+
+
+class Thumbnail(NamedTuple):
+    """An encoded thumbnail along with the decode path that produced it, and the time taken by each step."""
+    content: bytes
+    source: str
+    decode_seconds: float = 0.0  # Opening, decoding & downscaling
+    encode_seconds: float = 0.0
+    encodes: int = 1  # The number of encodes it took to fit the byte budget
+    phash: Optional[int] = None  # The perceptual hash of the thumbnail, if requested
+
+
+def _open_preview(raw: rawpy.RawPy, size: Tuple[int, int]) -> Optional[Image.Image]:
+    """
+    Extracts the embedded preview of a RAW file, if it has one at least as large as the requested thumbnail.
+
+    :param raw: An opened (but not necessarily unpacked) RAW file.
+    :param size: The width and height of the thumbnail the preview will be shrunk to.
+    :return: The preview as a PIL Image, or None if no usable preview exists.
+    """
+    try:
+        thumb = raw.extract_thumb()
+    except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+        return None
+
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        image = Image.open(io.BytesIO(thumb.data))
+        image.draft("RGB", size)
+        image = ImageOps.exif_transpose(image)
+    else:
+        image = Image.fromarray(thumb.data)
+
+    # Tiny previews (e.g. 160x120 EXIF thumbnails) are not worth labeling
+    if image.width < size[0] and image.height < size[1]:
+        image.close()
+        return None
+    return image
+
+
+def open_image(path: str, raw_mode: str = "full", size: Tuple[int, int] = THUMBNAIL_SIZE,
+               backend: str = "auto") -> Tuple[Image.Image, str]:
+    """
+    Opens an image as a PIL Image, decoding it first if it is a RAW file.
+
+    :param path: The path of the image to open.
+    :param raw_mode: The RAW decoding mode, one of RAW_MODES.
+    :param size: The size of the thumbnail that will be made, used to judge whether a RAW preview is large enough
+                 and how far lossy images can be downscaled while decoding.
+    :param backend: The decode backend used for lossy images, one of backends.BACKEND_NAMES.
+    :return: An opened PIL Image & the decode path that was taken.
+    """
+    extension = get_extension(path)
+    if extension not in RAW_EXTS:
+        return select_backend(extension, backend).open(path, size), SOURCE_LOSSY
+
+    with rawpy.imread(path) as raw:
+        if raw_mode == "preview":
+            image = _open_preview(raw, size)
+            if image is not None:
+                return image, SOURCE_PREVIEW
+            return Image.fromarray(raw.postprocess(half_size=True, use_camera_wb=True)), SOURCE_HALF
+        return Image.fromarray(raw.postprocess()), SOURCE_FULL
+
+
+def encode(image: Image.Image, quality: int = THUMBNAIL_QUALITY, optimize: bool = True) -> bytes:
+    """
+    Encodes a PIL Image as a JPEG, in memory.
+
+    :param image: The image to encode.
+    :param quality: The quality of the JPEG generated, from 0 to 100.
+    :param optimize: Whether to compute optimal Huffman tables, a few percent smaller at the cost of a second pass.
+    :return: The encoded JPEG's bytes.
+    """
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="jpeg", optimize=optimize, quality=quality)
+    return buffer.getvalue()
+
+
+def encode_to_budget(image: Image.Image, max_bytes: int, quality: int = THUMBNAIL_QUALITY,
+                     optimize: bool = True) -> Tuple[bytes, int]:
+    """
+    Encodes a PIL Image as a JPEG no larger than max_bytes, keeping as much quality, then resolution, as possible.
+
+    Quality is binary searched between MIN_QUALITY and the quality given. Only when even MIN_QUALITY does not fit is
+    the image shrunk, by the area the overshoot suggests (JPEG size grows about linearly with pixel count), and
+    searched again. At most MAX_ENCODES encodes are made; if the budget still cannot be met, the smallest encoding
+    found is returned.
+
+    :param image: The image to encode.
+    :param max_bytes: The largest the encoded JPEG should be.
+    :param quality: The highest quality tried, from 0 to 100.
+    :param optimize: Whether to compute optimal Huffman tables.
+    :return: The encoded JPEG's bytes & the number of encodes made.
+    """
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")  # Converted once, rather than on every encode
+
+    encodes, smallest = 0, None
+
+    def attempt(image: Image.Image, quality: int) -> bytes:
+        nonlocal encodes, smallest
+        encodes += 1
+        content = encode(image, quality=quality, optimize=optimize)
+        if smallest is None or len(content) < len(smallest):
+            smallest = content
+        return content
+
+    content = attempt(image, quality)
+    if len(content) <= max_bytes:
+        return content, encodes
+
+    while True:
+        lowest = attempt(image, MIN_QUALITY)
+        if len(lowest) <= max_bytes:
+            # The lowest quality fits & the highest (likely) does not; narrow the gap between them
+            low, high, best = MIN_QUALITY, quality, lowest
+            while high - low > QUALITY_STEP and encodes < MAX_ENCODES:
+                middle = (low + high) // 2
+                content = attempt(image, middle)
+                if len(content) <= max_bytes:
+                    low, best = middle, content
+                else:
+                    high = middle
+            return best, encodes
+
+        shortest = min(image.size)
+        if encodes >= MAX_ENCODES or shortest <= MIN_DIMENSION:
+            break
+        scale = max(0.5, min(0.9, (max_bytes / len(lowest)) ** 0.5), MIN_DIMENSION / shortest)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             resample=Image.LANCZOS)
+
+    logger.debug(f'Could not encode within {max_bytes} bytes, the smallest encode was {len(smallest)} bytes.')
+    return smallest, encodes
+
+
+def thumbnail(path: str, size: Tuple[int, int] = THUMBNAIL_SIZE, quality: int = THUMBNAIL_QUALITY,
+              raw_mode: str = "full", backend: str = "auto", max_bytes: Optional[int] = None,
+              optimize: bool = True, hash_size: Optional[int] = None) -> Thumbnail:
+    """
+    Decodes, downscales and encodes an image into a JPEG thumbnail. No intermediate files are written.
+
+    :param path: The path of the RAW or lossy image to thumbnail.
+    :param size: The maximum width and height of the thumbnail generated.
+    :param quality: The quality of the thumbnail generated, from 0 to 100.
+    :param raw_mode: The RAW decoding mode, one of RAW_MODES.
+    :param backend: The decode backend used for lossy images, one of backends.BACKEND_NAMES.
+    :param max_bytes: If given, the thumbnail's quality (and if need be, size) is lowered until it fits.
+    :param optimize: Whether to compute optimal Huffman tables when encoding.
+    :param hash_size: If given, the thumbnail's perceptual hash is computed, this many bits wide & high.
+    :return: The encoded thumbnail & the decode path taken.
+    """
+    start = time.perf_counter()
+    image, source = open_image(path, raw_mode=raw_mode, size=size, backend=backend)
+    try:
+        image.thumbnail(size, resample=Image.LANCZOS)  # Drafted JPEGs are only decoded here
+        phash = perceptual_hash(image, hash_size) if hash_size is not None else None
+        decoded = time.perf_counter()
+        if max_bytes is None:
+            content, encodes = encode(image, quality=quality, optimize=optimize), 1
+        else:
+            content, encodes = encode_to_budget(image, max_bytes, quality=quality, optimize=optimize)
+        return Thumbnail(content, source, decoded - start, time.perf_counter() - decoded, encodes, phash)
+    finally:
+        image.close()
+
+
+def estimate_memory(path: str, raw_mode: str = "full", size: Optional[int] = None) -> int:
+    """
+    Estimates the peak memory decoding an image will take, from the dimensions in its header alone.
+
+    :param path: The path of the image.
+    :param raw_mode: The RAW decoding mode that will be used, one of RAW_MODES.
+    :param size: The size of the file, if already known.
+    :return: The estimated number of bytes the decoded image will occupy.
+    """
+    try:
+        if get_extension(path) in RAW_EXTS:
+            raw = rawpy.RawPy()
+            try:
+                raw.open_file(path)  # Parses metadata only; nothing is unpacked
+                sizes = raw.sizes
+            finally:
+                raw.close()
+
+            # 16-bit sensor data, plus the 8-bit RGB array & the PIL image (4 bytes per pixel) built from it
+            pixels = sizes.width * sizes.height
+            if raw_mode == "preview":
+                pixels //= 4  # A half-size decode is the most expensive path preview mode can take
+            return sizes.raw_width * sizes.raw_height * 2 + pixels * (3 + 4)
+
+        with Image.open(path) as image:
+            # Pillow stores multi-band images at 4 bytes per pixel
+            return image.width * image.height * (1 if len(image.getbands()) == 1 else 4)
+    except Exception as error:
+        logger.debug(f'Could not read dimensions of "{path}", estimating from file size: {error}')
+        return (size if size is not None else os.path.getsize(path)) * MEMORY_PER_BYTE
+
+
+def create_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Creates a process pool for decoding images outside of the main interpreter.
+
+    :param workers: The number of worker processes to create. Defaults to the number of CPUs available.
+    :return: A ProcessPoolExecutor ready to accept decoding jobs.
+    """
+    workers = workers or os.cpu_count() or 1
+    logger.debug(f'Creating decode process pool with {workers} workers.')
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _warm() -> int:
+    return os.getpid()
+
+
+def warm_pool(pool: ProcessPoolExecutor, workers: int) -> None:
+    """
+    Starts every worker process of a pool up front (importing this module, rawpy & Pillow in each), so that the first
+    files decoded do not pay for it.
+
+    :param pool: A pool created by create_pool().
+    :param workers: The number of workers the pool was created with.
+    """
+    futures = [pool.submit(_warm) for _ in range(workers)]
+    logger.debug(f'Decode pool warmed, {len({future.result() for future in futures})} workers started.')
+
+
+class DecodeReport(object):
+    """
+    Tallies which decode path was taken for each file format over the course of a run, and the size of the
+    thumbnails produced.
+    """
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.sizes: Dict[str, List[int]] = {}
+        self.lock = Lock()
+
+    def record(self, extension: str, source: str, size: Optional[int] = None) -> None:
+        """
+        Records a single decode.
+
+        :param extension: The extension (format) of the file decoded.
+        :param source: The decode path taken, as given by Thumbnail.source.
+        :param size: The size of the encoded thumbnail, in bytes.
+        """
+        with self.lock:
+            self.counts[(extension.lower(), source)] += 1
+            if size is not None:
+                self.sizes.setdefault(extension.lower(), []).append(size)
+
+    def summary(self) -> List[str]:
+        """
+        :return: One human readable line per file format, describing the decode paths taken.
+        """
+        formats = sorted({extension for extension, _ in self.counts})
+        return [
+            "{}: {}{}".format(extension.upper(), ", ".join(
+                f"{count} {source}" for (ext, source), count in sorted(self.counts.items()) if ext == extension
+            ), self._sizes(extension))
+            for extension in formats
+        ]
+
+    def _sizes(self, extension: str) -> str:
+        sizes = self.sizes.get(extension)
+        if not sizes:
+            return ""
+        return f" ({format_bytes(sum(sizes) / len(sizes))} per thumbnail, {format_bytes(max(sizes))} at most)"
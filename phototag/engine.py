@@ -0,0 +1,146 @@
+"""
+engine.py
+
+Holds an asyncio based alternative to the threaded MasterFileProcessor, driving the Google Vision API through the
+asynchronous client so that every in-flight request shares a single event loop.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from phototag.annotate import create_client, label_async
+from phototag.process import MasterFileProcessor, FileProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMasterFileProcessor(MasterFileProcessor):
+    """
+    Processes FileProcessor objects as tasks on an asyncio event loop, instead of in a thread each.
+
+    Decoding, thumbnailing and tag writing are pushed to executors, while Vision API requests are awaited directly.
+    The same image count & buffer size limits apply, and the same progress is reported.
+    """
+
+    def _create_client(self):
+        """
+        The asynchronous client is bound to the event loop it was created in, so it is created once the loop runs.
+        """
+        return None
+
+    def load(self) -> None:
+        """
+        Files are admitted by the event loop as limits allow, once join() is called.
+        """
+        if self.discovery is not None and self.discovery.ident is None:
+            self.discovery.start()
+        self._update_tasks()
+
+    def join(self) -> None:
+        """
+        Runs the event loop until every file has been processed.
+        """
+        asyncio.run(self._run())
+
+    async def _run(self) -> None:
+        """
+        Starts a task for each waiting FileProcessor as soon as the configured limits allow it.
+        """
+        if self.client is None:
+            self.client = create_client(asynchronous=True)
+
+        condition = asyncio.Condition()
+        tasks = set()
+        while True:
+            async with condition:
+                admitted = self._admit(condition)
+                while admitted is None and not self.done:
+                    # Discovery runs in its own thread, so while it runs, new files are polled for
+                    try:
+                        await asyncio.wait_for(condition.wait(), 0.05 if self.discovering else None)
+                    except asyncio.TimeoutError:
+                        pass
+                    admitted = self._admit(condition)
+
+                if admitted is None:
+                    break
+                key, task = admitted
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            self._update_tasks()
+
+        await asyncio.gather(*tasks)
+
+    def _admit(self, condition: asyncio.Condition) -> Optional[Tuple[int, asyncio.Future]]:
+        """
+        Starts a task for the next FileProcessor that fits within the configured limits, if any.
+
+        :param condition: The condition the task notifies once finished.
+        :return: The FileProcessor's key & task, or None if nothing could be admitted.
+        """
+        with self.lock:
+            admitted = self.waiting.pop()
+            if admitted is None:
+                return None
+
+            key, fp = admitted
+            task = asyncio.ensure_future(self._process(key, fp, condition))
+            self.running[key] = (fp, task)
+            self.space.notify_all()
+            return key, task
+
+    async def _process(self, key: int, fp: FileProcessor, condition: asyncio.Condition) -> None:
+        """
+        Optimizes, labels and tags a single file.
+
+        :param key: The FileProcessor's integer key in the running dict.
+        :param fp: The FileProcessor to process.
+        :param condition: Notified once the file has finished, so that waiting files can be admitted.
+        """
+        loop = asyncio.get_running_loop()
+        succeeded = False
+        try:
+            digest, labels = None, None
+            if self.cache is not None:
+                with fp.timed("lookup"):
+                    digest, labels = await loop.run_in_executor(None, fp.lookup, self.cache)
+
+            if labels is None:
+                # The default executor's thread blocks on the process pool (if any), never the event loop
+                with fp.timed("optimize"):
+                    content = await loop.run_in_executor(None, fp.optimize, self.executor)
+                with fp.timed("annotate"):
+                    if self.reuse is not None and fp.phash is not None:
+                        labels, fp.reused = await self.reuse.labels_async(
+                            fp.phash, lambda: label_async(self.client, content))
+                    else:
+                        labels = await label_async(self.client, content)
+                if self.cache is not None:
+                    await loop.run_in_executor(None, self.cache.put, digest, labels)
+
+            with fp.timed("write"):
+                await loop.run_in_executor(None, fp.write, labels, self.cache, self.index)
+            succeeded = True
+        except Exception as error:
+            logger.exception(f'FileProcessor {key} ("{fp.file_path}") failed: {error}')
+        finally:
+            fp.finish(succeeded)
+            async with condition:
+                self._finished(key)
+                condition.notify_all()
+
+    def _finished(self, key: int) -> None:
+        """
+        Called when a FileProcessor's task has finished.
+
+        :param int key: The FileProcessor's integer key in the running dict.
+        """
+        with self.lock:
+            fp, task = self.running.pop(key)
+            self.waiting.release(fp)
+            self.finished += 1
+            self.failed += not fp.succeeded
+        self._record(fp)
+        logger.info(f'FileProcessor {key} ("{fp.file_path}") has finished.')
+        self._update_tasks()
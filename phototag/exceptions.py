@@ -35,3 +35,13 @@ class NoSidecarFileError(PhototagException):
     Most RAW files processed by Adobe are accompanied by a .xmp file with the same name.
     """
     pass
+
+
+class AnnotationError(PhototagException):
+    """The Google Vision API could not identify labels for an image."""
+    pass
+
+
+class MetadataError(PhototagException):
+    """An image's embedded metadata could not be read or written."""
+    pass
@@ -3,14 +3,17 @@ helpers.py
 
 Simple helper functions and constants separated from the primary application functionality.
 """
+import hashlib
+import itertools
 import logging
 import os
 import random
 import re
 import string
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from glob import glob
 from pathlib import Path
-from typing import List, Optional, Tuple, Generator
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Generator, Iterator, NamedTuple
 
 from phototag import CWD
 from phototag.constants import LOSSY_EXTS, RAW_EXTS
@@ -100,6 +103,19 @@ def convert_to_bytes(size_string: str) -> int:
     return int(match.group(1)) * byte_magnitudes.get(match.group(2), 0)
 
 
+def format_bytes(size: float) -> str:
+    """
+    Converts a number of bytes into a human readable string, the inverse of convert_to_bytes.
+
+    :param size: A number of bytes.
+    :return: The size in the largest (binary) unit keeping it at or above 1, e.g. '41.5 KB'.
+    """
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if abs(size) < 1024 or unit == "TB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
 def walk(root: Path, current: Optional[Path] = None, depth: Optional[int] = None) -> Generator[
     Path, None, None]:
     """
@@ -117,11 +133,135 @@ def walk(root: Path, current: Optional[Path] = None, depth: Optional[int] = None
             continue
 
         # Recursive handling
-        cur_depth: int = len(item.resolve().parents) - root_abs_depth - 1
+        cur_depth: int = len(item.resolve().parents) - root_abs_depth
         if depth is None or cur_depth < depth:
             yield from walk(root, current=item, depth=depth)
 
 
+class ScanEntry(NamedTuple):
+    """A file found while scanning, along with the stat information gathered for it."""
+    path: Path
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def from_path(cls, path: Path) -> 'ScanEntry':
+        """
+        :param path: The path of a file.
+        :return: A ScanEntry for the file, using a single stat call.
+        """
+        stat = os.stat(path)
+        return cls(path, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def _scan_directory(directory: str) -> Tuple[List[ScanEntry], List[str]]:
+    """
+    Lists a single directory using os.scandir, reusing the file type information it provides.
+
+    :param directory: The directory to list.
+    :return: The files found (with their stat information) & the subdirectories found.
+    """
+    files, directories = [], []
+    try:
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files.append(ScanEntry(Path(entry.path), stat.st_size, stat.st_mtime_ns, stat.st_ino))
+                    elif entry.is_dir():
+                        directories.append(entry.path)
+                except FileNotFoundError:
+                    continue  # Deleted (or moved away) since the directory was listed
+                except OSError as error:
+                    logger.warning(f'Could not scan "{entry.path}": {error}')
+    except OSError as error:
+        logger.warning(f'Could not scan "{directory}": {error}')
+    return files, directories
+
+
+def scan(root: Path, depth: Optional[int] = None, workers: int = 8) -> Generator[ScanEntry, None, None]:
+    """
+    Walks a directory using os.scandir, listing subdirectories concurrently, and yields all files found along with
+    their stat information, so that nothing needs to stat them again.
+
+    Files are yielded in no particular order.
+
+    :param root: The directory to walk.
+    :param depth: The number of directory levels to walk, the root being the first. Infinite if None or negative.
+    :param workers: The maximum number of directories listed at once.
+    :return: A generator of the files found.
+    """
+    if depth is not None and depth < 0:
+        depth = None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Scan') as pool:
+        pending = {pool.submit(_scan_directory, str(root.resolve())): 1}
+        while pending:
+            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                level = pending.pop(future)
+                files, directories = future.result()
+                if depth is None or level < depth:
+                    for directory in directories:
+                        pending[pool.submit(_scan_directory, directory)] = level + 1
+                yield from files
+
+
+def bounded_map(function: Callable[[Any], Any], items: Iterable[Any], workers: int,
+                name: str = 'Worker') -> Generator[Tuple[Any, Future], None, None]:
+    """
+    Runs a function over items in a thread pool, pulling items lazily so that no more than twice as many calls as
+    there are workers are pending at once, whatever the number of items.
+
+    :param function: The function each item is passed to.
+    :param items: The items, consumed as the pool has room for them.
+    :param workers: The number of threads calling the function.
+    :param name: The prefix of the threads' names.
+    :return: A generator of each item along with its completed future, in order of completion.
+    """
+    items, end = iter(items), object()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        pending: Dict[Future, Any] = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < workers * 2:
+                item = next(items, end)
+                if item is end:
+                    exhausted = True
+                else:
+                    pending[pool.submit(function, item)] = item
+            if not pending:
+                return
+
+            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                yield pending.pop(future), future
+
+
+def library_key(path: Path) -> str:
+    """
+    :param path: The path of a file within the library (the current directory).
+    :return: The file's path relative to the library, with forward slashes, so that hosts mounting the library at
+             different places (or on different operating systems) name it the same.
+    """
+    return Path(os.path.relpath(os.path.join(CWD, path), CWD)).as_posix()
+
+
+def shard_of(path: Path, count: int) -> int:
+    """
+    Assigns a file to one of `count` shards by a stable hash of its library key, so that every host running with the
+    same count agrees on the split without coordinating.
+
+    :param path: The path of a file within the library.
+    :param count: The number of shards.
+    :return: The index of the file's shard, from 0 to count - 1.
+    """
+    digest = hashlib.blake2b(library_key(path).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
 def path_to_match_mode(path: Path, match_mode: str, root: Optional[Path] = None) -> str:
     """
     Converts a path to a string based on the match mode.
@@ -178,3 +318,46 @@ def select_files(files: List[str], regex: Optional[str], glob_pattern: Optional[
         logger.info(f'Found {len(select)} valid images out of {len(files)} files selected.')
 
     return files
+
+
+def select_paths(files: Tuple[str], all: bool = False, regex: str = None, regex_mode: str = 'filename',
+                 recursive: bool = None, depth: int = None, glob_pattern: str = None) -> Iterator[ScanEntry]:
+    """
+    Lazily selects the image files to be processed, yielding each one as soon as it is found.
+
+    :param files: Specific files chosen by the user.
+    :param all: Whether to select all files in the current directory (recursively, if specified).
+    :param regex: A RegEx pattern every selected file must match.
+    :param regex_mode: Selects the behavior of the RegEx's input string.
+    :param recursive: Whether --all & --glob search subdirectories.
+    :param depth: The maximum depth of a recursive --all search.
+    :param glob_pattern: A Glob pattern to select files with.
+    :return: A generator of the selected images, along with their stat information.
+    """
+    selected: Iterator[ScanEntry] = (ScanEntry.from_path(Path(file)) for file in files)
+
+    cwd = Path.cwd()
+    if glob_pattern:
+        logger.debug('Using glob pattern: {}'.format(glob_pattern))
+        matches = cwd.rglob(glob_pattern) if recursive else cwd.glob(glob_pattern)
+        selected = itertools.chain(selected, (ScanEntry.from_path(path) for path in matches if path.is_file()))
+    elif all:
+        # Default behavior: Select all in CWD, if recursive, walk with optional depth (default -1, infinite)
+        if recursive:
+            logger.debug('Using recursive search with depth: {}'.format(depth))
+            selected = itertools.chain(selected, scan(cwd, depth=depth))
+        else:
+            logger.debug('Pulling all files from current directory.')
+            selected = itertools.chain(selected, scan(cwd, depth=1))
+
+    # Only images can be processed, sidecars & other files are skipped
+    selected = (entry for entry in selected if valid_extension(get_extension(entry.path.name)))
+
+    # Regex is applied as a 'filter' to each file selected.
+    if regex:
+        logger.debug('Applying RegEx pattern: {}'.format(regex))
+        compiled_regex = re.compile(regex)
+        selected = (entry for entry in selected
+                    if compiled_regex.match(path_to_match_mode(entry.path, regex_mode, root=cwd)))
+
+    return selected
@@ -0,0 +1,304 @@
+"""
+index.py
+
+A persistent, inverted index of the tags written to a photo library, stored in SQLite: tag → files to answer queries,
+file → tags (with the size & modification time of the file holding them) to refresh only what changed.
+"""
+
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from phototag.collect import COLLECT_WORKERS, read_tags, tag_source
+from phototag.config import CONFIG_DIR
+from phototag.exceptions import MetadataError
+from phototag.helpers import ScanEntry, bounded_map
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.path.join(CONFIG_DIR, "index.sqlite")
+# Stands in for the size & modification time of a sidecar that does not exist (yet)
+MISSING: Tuple[int, int] = (-1, -1)
+COMMIT_EVERY = 1000  # Changes made during a refresh before they are committed
+
+Stat = Tuple[int, int]
+
+
+class RefreshStats(NamedTuple):
+    """What a refresh found."""
+    added: int
+    changed: int
+    unchanged: int
+    removed: int
+    failed: int
+
+
+def source_stat(path: Path, entry: Optional[ScanEntry] = None) -> Stat:
+    """
+    :param path: The path of an image.
+    :param entry: The image's stat information, if already known.
+    :return: The size & modification time of the file holding the image's tags.
+    """
+    source = tag_source(path)
+    if source == path and entry is not None:
+        return entry.size, entry.mtime_ns
+    try:
+        stat = os.stat(source)
+    except FileNotFoundError:
+        return MISSING
+    return stat.st_size, stat.st_mtime_ns
+
+
+class TagIndex(object):
+    """
+    Maps tags to the files carrying them, and files to their tags.
+
+    Postings are keyed (tag, file) so a tag's files are a single range scan, and conjunctions probe the postings of
+    the rarer tags' files against the rest. Each tag's number of files is kept alongside it to order those probes.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        """
+        Opens (or creates) a tag index.
+
+        :param path: The path of the SQLite database file.
+        """
+        self.path = path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                scanned INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS tags (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL COLLATE NOCASE,
+                files INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                tag INTEGER NOT NULL,
+                file INTEGER NOT NULL,
+                PRIMARY KEY (tag, file)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_file ON postings (file);
+        """)
+
+    @staticmethod
+    def _key(path: Union[str, Path]) -> str:
+        return str(Path(path).resolve())
+
+    def stat(self, path: Union[str, Path]) -> Optional[Stat]:
+        """
+        :return: The size & modification time recorded for the file's tags, or None if the file is not indexed.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT size, mtime_ns FROM files WHERE path = ?",
+                                          (self._key(path),)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def tags(self, path: Union[str, Path]) -> List[str]:
+        """
+        :return: The tags indexed for a file.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT tags.name FROM files JOIN postings ON postings.file = files.id "
+                "JOIN tags ON tags.id = postings.tag WHERE files.path = ? ORDER BY tags.name", (self._key(path),))
+            return [name for name, in rows]
+
+    def update(self, path: Union[str, Path], tags: Iterable[str], stat: Optional[Stat] = None,
+               commit: bool = True) -> None:
+        """
+        Replaces the tags indexed for a file.
+
+        :param path: The path of the image.
+        :param tags: The image's tags.
+        :param stat: The size & modification time of the file holding the tags; read from disk if not given.
+        :param commit: Whether to commit immediately. Refreshes commit in batches instead.
+        """
+        key = self._key(path)
+        size, mtime_ns = stat if stat is not None else source_stat(Path(key))
+        with self.lock:
+            cursor = self.connection.cursor()
+            row = cursor.execute("SELECT id FROM files WHERE path = ?", (key,)).fetchone()
+            if row is None:
+                file = cursor.execute("INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                                      (key, size, mtime_ns)).lastrowid
+            else:
+                file = row[0]
+                cursor.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?", (size, mtime_ns, file))
+                self._unlink(cursor, file)
+
+            unique = {}
+            for tag in tags:
+                unique.setdefault(tag.casefold(), tag)  # Tags differing only by case are indexed once, as first spelt
+            tags = list(unique.values())
+            cursor.executemany("INSERT INTO tags (name) VALUES (?) ON CONFLICT (name) DO NOTHING",
+                               [(tag,) for tag in tags])
+            ids = [cursor.execute("SELECT id FROM tags WHERE name = ?", (tag,)).fetchone()[0] for tag in tags]
+            cursor.executemany("INSERT INTO postings VALUES (?, ?)", [(tag, file) for tag in ids])
+            cursor.executemany("UPDATE tags SET files = files + 1 WHERE id = ?", [(tag,) for tag in ids])
+            if commit:
+                self.connection.commit()
+
+    @staticmethod
+    def _unlink(cursor: sqlite3.Cursor, file: int) -> None:
+        """
+        Drops a file's postings, keeping the tag counts in step.
+        """
+        cursor.execute("UPDATE tags SET files = files - 1 WHERE id IN (SELECT tag FROM postings WHERE file = ?)",
+                       (file,))
+        cursor.execute("DELETE FROM postings WHERE file = ?", (file,))
+
+    def remove(self, path: Union[str, Path], commit: bool = True) -> None:
+        """
+        Drops a file from the index.
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            row = cursor.execute("SELECT id FROM files WHERE path = ?", (self._key(path),)).fetchone()
+            if row is not None:
+                self._unlink(cursor, row[0])
+                cursor.execute("DELETE FROM files WHERE id = ?", (row[0],))
+            if commit:
+                self.connection.commit()
+
+    def _match(self, tags: List[str], any: bool) -> Optional[Tuple[str, List[int]]]:
+        """
+        Builds the query selecting the paths of files carrying the tags, with its parameters.
+
+        :return: None when no file can match.
+        """
+        found = [self.connection.execute("SELECT id, files FROM tags WHERE name = ?", (tag,)).fetchone()
+                 for tag in tags]
+        if any:
+            ids = [row[0] for row in found if row is not None]
+            sql = (f"SELECT DISTINCT files.path FROM postings JOIN files ON files.id = postings.file "
+                   f"WHERE postings.tag IN ({', '.join('?' * len(ids))})")
+        else:
+            if None in found:
+                return None
+            # Walk the rarest tag's postings, probing each file against the other tags' postings
+            ids = [row[0] for row in sorted(found, key=lambda row: row[1])]
+            sql = ("SELECT files.path FROM postings AS first JOIN files ON files.id = first.file "
+                   "WHERE first.tag = ?" + " AND EXISTS (SELECT 1 FROM postings WHERE tag = ? AND file = first.file)"
+                   * (len(ids) - 1))
+        return (sql, ids) if ids else None
+
+    def query(self, tags: List[str], any: bool = False, limit: Optional[int] = None) -> List[str]:
+        """
+        Finds the files carrying the given tags.
+
+        :param tags: The tags to look for, matched case-insensitively.
+        :param any: If true, files carrying any of the tags are found (a disjunction); otherwise only files carrying
+                    every tag are (a conjunction).
+        :param limit: The most files returned.
+        :return: The paths of the files found, sorted.
+        """
+        with self.lock:
+            match = self._match(tags, any)
+            if match is None:
+                return []
+            sql, ids = match
+            sql += " ORDER BY files.path" + (f" LIMIT {int(limit)}" if limit is not None else "")
+            return [path for path, in self.connection.execute(sql, ids)]
+
+    def count(self, tags: List[str], any: bool = False) -> int:
+        """
+        :return: The number of files query() would find, without fetching their paths.
+        """
+        with self.lock:
+            match = self._match(tags, any)
+            if match is None:
+                return 0
+            sql, ids = match
+            return self.connection.execute(f"SELECT COUNT(*) FROM ({sql})", ids).fetchone()[0]
+
+    def counts(self, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        :return: Every tag indexed with its number of files, most frequent first.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT name, files FROM tags WHERE files > 0 ORDER BY files DESC, name LIMIT ?",
+                (limit if limit is not None else -1,)).fetchall()
+
+    def refresh(self, files: Iterable[Union[Path, ScanEntry]], workers: int = COLLECT_WORKERS,
+                prune: Optional[Path] = None) -> RefreshStats:
+        """
+        Brings the index up to date with the files given, only reading the tags of files new to the index or whose
+        tags' file changed size or modification time since.
+
+        :param files: The files (or ScanEntry objects) to index.
+        :param workers: The number of files stat'ed & read at once.
+        :param prune: If given, indexed files within this directory that were not among the files given and no longer
+                      exist are dropped.
+        :return: The number of files added, changed, unchanged, removed & failed.
+        """
+        with self.lock:
+            generation = self.connection.execute("SELECT COALESCE(MAX(scanned), 0) + 1 FROM files").fetchone()[0]
+
+        def check(item: Union[Path, ScanEntry]) -> Tuple[Path, Optional[Stat], Optional[Stat], Optional[List[str]]]:
+            # Runs in the pool: stats (and if changed, reads) a single file
+            entry = item if isinstance(item, ScanEntry) else None
+            path = Path(entry.path if entry is not None else item).resolve()
+            stored, stat = self.stat(path), source_stat(path, entry)
+            return path, stored, stat, read_tags(path) if stat != stored else None
+
+        added, changed, unchanged, failed, pending = 0, 0, 0, 0, 0
+        for item, future in bounded_map(check, files, workers, 'Index'):
+            try:
+                path, stored, stat, tags = future.result()
+            except (MetadataError, OSError) as error:
+                failed += 1
+                logger.warning(f'Could not index "{item}": {error}')
+                continue
+
+            if tags is not None:
+                self.update(path, tags, stat, commit=False)
+                added, changed = (added + 1, changed) if stored is None else (added, changed + 1)
+            else:
+                unchanged += 1
+            with self.lock:
+                self.connection.execute("UPDATE files SET scanned = ? WHERE path = ?", (generation, str(path)))
+                pending += 1
+                if pending >= COMMIT_EVERY:
+                    self.connection.commit()
+                    pending = 0
+
+        removed = self._prune(prune, generation) if prune is not None else 0
+        with self.lock:
+            self.connection.commit()
+        return RefreshStats(added, changed, unchanged, removed, failed)
+
+    def _prune(self, directory: Path, generation: int) -> int:
+        """
+        Drops indexed files within the directory, unseen by the refresh of the given generation, that no longer exist.
+        """
+        prefix = os.path.join(str(directory.resolve()), "")
+        with self.lock:
+            unseen = self.connection.execute(
+                "SELECT path FROM files WHERE scanned < ? AND path >= ? AND path < ?",
+                (generation, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))).fetchall()
+        removed = 0
+        for path, in unseen:
+            if not os.path.exists(path):
+                self.remove(path, commit=False)
+                removed += 1
+        return removed
+
+    def close(self) -> None:
+        """
+        Closes the underlying database connection.
+        """
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
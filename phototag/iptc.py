@@ -0,0 +1,350 @@
+"""
+iptc.py
+
+Reads & writes IPTC keywords in JPEG files directly, touching only the marker segments ahead of the image data.
+
+IPTC data lives in a JPEG's APP13 segment(s), as the 0x0404 resource of a Photoshop 'image resource block' (IRB).
+Only the segments before the start of scan are parsed; the compressed image data that follows is never read into
+Python, and is left untouched entirely whenever the rewritten header is the same length as the original.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import tempfile
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Tuple
+
+from phototag.exceptions import MetadataError
+
+logger = logging.getLogger(__name__)
+
+SOI = b"\xff\xd8"
+SOS = 0xDA
+APP13 = 0xED
+STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))  # TEM & RSTn carry no length
+MAX_SEGMENT_DATA = 0xFFFF - 2  # A segment's length field counts itself
+
+PHOTOSHOP_SIGNATURE = b"Photoshop 3.0\x00"
+RESOURCE_SIGNATURE = b"8BIM"
+IPTC_RESOURCE = 0x0404
+IPTC_DIGEST_RESOURCE = 0x0425  # MD5 of the IPTC resource, used by Photoshop to detect outside edits
+
+TAG_MARKER = 0x1C
+CHARSET = (1, 90)
+RECORD_VERSION = (2, 0)
+KEYWORDS = (2, 25)
+UTF8_CHARSET = b"\x1b%G"
+
+Dataset = Tuple[int, int, bytes]  # (record, dataset, data)
+
+
+class Segment(NamedTuple):
+    """A marker segment in a JPEG's header."""
+    offset: int  # The offset of the segment's marker
+    marker: int
+    data: Optional[bytes]  # Only read for APP13 segments
+
+
+class Resource(NamedTuple):
+    """An image resource from a Photoshop IRB."""
+    id: int
+    name: bytes  # The padded pascal string, kept as-is
+    data: bytes
+
+
+def read_header(file: BinaryIO) -> Tuple[List[Segment], int]:
+    """
+    Reads the marker segments preceding the image data, seeking past all but the APP13 segments.
+
+    :param file: The JPEG file, opened in binary mode at its start.
+    :return: The segments found, and the offset at which the start of scan (and everything after it) begins.
+    :except MetadataError: when the file is not a JPEG, or is truncated before the image data.
+    """
+    if file.read(2) != SOI:
+        raise MetadataError(f"{getattr(file, 'name', 'File')} is not a JPEG.")
+
+    segments: List[Segment] = []
+    while True:
+        offset = file.tell()
+        prefix = file.read(2)
+        if len(prefix) < 2 or prefix[0] != 0xFF:
+            raise MetadataError(f"Invalid JPEG marker at offset {offset}.")
+
+        marker = prefix[1]
+        while marker == 0xFF:  # Fill bytes may pad markers
+            byte = file.read(1)
+            if not byte:
+                raise MetadataError("JPEG ends before its image data.")
+            marker = byte[0]
+        if marker == SOS:
+            return segments, offset
+        if marker in STANDALONE_MARKERS:
+            continue
+
+        raw_length = file.read(2)
+        length, = struct.unpack(">H", raw_length) if len(raw_length) == 2 else (0,)
+        if length < 2:
+            raise MetadataError(f"Invalid JPEG segment length at offset {offset}.")
+        if marker == APP13:
+            data = file.read(length - 2)
+            if len(data) < length - 2:
+                raise MetadataError(f"JPEG segment at offset {offset} is truncated.")
+            segments.append(Segment(offset, marker, data))
+        else:
+            file.seek(length - 2, os.SEEK_CUR)
+            segments.append(Segment(offset, marker, None))
+
+
+def parse_resources(data: bytes) -> List[Resource]:
+    """
+    :param data: A Photoshop IRB, without its signature.
+    :return: The resources held.
+    """
+    resources, position = [], 0
+    while position + 12 <= len(data) and data[position:position + 4] == RESOURCE_SIGNATURE:
+        resource_id, = struct.unpack_from(">H", data, position + 4)
+        name_length = 1 + data[position + 6]
+        name_length += name_length % 2  # Padded to an even length
+        name = data[position + 6:position + 6 + name_length]
+        size, = struct.unpack_from(">I", data, position + 6 + name_length)
+        start = position + 10 + name_length
+        resources.append(Resource(resource_id, name, data[start:start + size]))
+        position = start + size + size % 2
+    return resources
+
+
+def pack_resources(resources: Iterable[Resource]) -> bytes:
+    """
+    :param resources: The resources to pack.
+    :return: A Photoshop IRB, without its signature.
+    """
+    parts = []
+    for resource in resources:
+        parts.append(RESOURCE_SIGNATURE + struct.pack(">H", resource.id) + resource.name)
+        parts.append(struct.pack(">I", len(resource.data)) + resource.data + b"\x00" * (len(resource.data) % 2))
+    return b"".join(parts)
+
+
+def parse_datasets(data: bytes) -> List[Dataset]:
+    """
+    :param data: An IPTC IIM block.
+    :return: The datasets held, in order.
+    """
+    datasets, position = [], 0
+    while position + 5 <= len(data) and data[position] == TAG_MARKER:
+        record, dataset, size = struct.unpack_from(">BBH", data, position + 1)
+        position += 5
+        if size & 0x8000:  # Extended datasets give the length of their length instead
+            count = size & 0x7FFF
+            size = int.from_bytes(data[position:position + count], "big")
+            position += count
+        datasets.append((record, dataset, data[position:position + size]))
+        position += size
+    return datasets
+
+
+def pack_datasets(datasets: Iterable[Dataset]) -> bytes:
+    """
+    :param datasets: The datasets to pack, in order.
+    :return: An IPTC IIM block.
+    """
+    parts = []
+    for record, dataset, data in datasets:
+        if len(data) < 0x8000:
+            parts.append(struct.pack(">BBBH", TAG_MARKER, record, dataset, len(data)))
+        else:
+            parts.append(struct.pack(">BBBHI", TAG_MARKER, record, dataset, 0x8004, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def decode(value: bytes) -> str:
+    """
+    Decodes a text dataset. Files lacking a character set are most often Latin-1, when not plain ASCII.
+    """
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+def _is_utf8(value: bytes) -> bool:
+    try:
+        value.decode("utf-8")
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _read_resources(segments: List[Segment]) -> Optional[List[Resource]]:
+    """
+    :return: The resources of the Photoshop IRB spread across the APP13 segments given, or None if there is none.
+    """
+    blocks = [segment.data[len(PHOTOSHOP_SIGNATURE):] for segment in segments
+              if segment.marker == APP13 and segment.data.startswith(PHOTOSHOP_SIGNATURE)]
+    return parse_resources(b"".join(blocks)) if blocks else None
+
+
+def read_keywords(path: str) -> List[str]:
+    """
+    :param path: The path of a JPEG file.
+    :return: The IPTC keywords of the image, in order.
+    """
+    with open(path, "rb") as file:
+        segments, _ = read_header(file)
+
+    for resource in _read_resources(segments) or []:
+        if resource.id == IPTC_RESOURCE:
+            return [decode(data) for record, dataset, data in parse_datasets(resource.data)
+                    if (record, dataset) == KEYWORDS]
+    return []
+
+
+def replace_keywords(datasets: List[Dataset], keywords: List[str]) -> List[Dataset]:
+    """
+    Replaces the keywords amongst a list of datasets, keeping every other dataset (and the ordering by record &
+    dataset number the IIM specifies).
+
+    :param datasets: The existing datasets, possibly empty.
+    :param keywords: The keywords to write.
+    :return: The new datasets.
+    """
+    datasets = [item for item in datasets if item[:2] != KEYWORDS]
+    if not datasets:
+        datasets = [(*RECORD_VERSION, b"\x00\x04")]
+    # Keywords are written as UTF-8, which is declared unless existing text would then be misread
+    if not any(item[:2] == CHARSET for item in datasets) and all(_is_utf8(data) for _, _, data in datasets):
+        datasets.insert(0, (*CHARSET, UTF8_CHARSET))
+
+    index = next((i for i, item in enumerate(datasets) if item[:2] > KEYWORDS), len(datasets))
+    datasets[index:index] = [(*KEYWORDS, keyword.encode("utf-8")) for keyword in keywords]
+    return datasets
+
+
+def build_segments(resources: List[Resource]) -> bytes:
+    """
+    :param resources: The resources of a Photoshop IRB.
+    :return: The IRB, as complete APP13 segments (split across several when too large for one).
+    """
+    block = pack_resources(resources)
+    size = MAX_SEGMENT_DATA - len(PHOTOSHOP_SIGNATURE)
+    parts = []
+    for start in range(0, max(len(block), 1), size):
+        data = PHOTOSHOP_SIGNATURE + block[start:start + size]
+        parts.append(b"\xff" + bytes([APP13]) + struct.pack(">H", len(data) + 2) + data)
+    return b"".join(parts)
+
+
+def write_keywords(path: str, keywords: Iterable[str]) -> bool:
+    """
+    Sets the IPTC keywords of a JPEG file. Existing keywords that are kept retain their order, new ones follow.
+
+    The file is only written when the set of keywords changes. If the new header is the same length as the old, it is
+    patched in place; otherwise the header is rewritten into a temporary file, the image data is copied over behind it,
+    and the temporary file replaces the original atomically.
+
+    :param path: The path of the JPEG file.
+    :param keywords: The keywords to write.
+    :return: Whether the file was written.
+    """
+    with open(path, "rb") as file:
+        segments, scan_offset = read_header(file)
+        file.seek(0)
+        header = file.read(scan_offset)
+
+    resources = _read_resources(segments) or []
+    iptc = next((resource for resource in resources if resource.id == IPTC_RESOURCE), None)
+    datasets = parse_datasets(iptc.data) if iptc else []
+
+    existing = [decode(data) for record, dataset, data in datasets if (record, dataset) == KEYWORDS]
+    keywords = list(dict.fromkeys(keywords))
+    if set(existing) == set(keywords) and len(existing) == len(keywords):
+        logger.debug(f'IPTC keywords of "{path}" are unchanged, skipping write.')
+        return False
+
+    wanted = set(keywords)
+    ordered = [keyword for keyword in dict.fromkeys(existing) if keyword in wanted]
+    kept = set(ordered)
+    ordered += [keyword for keyword in keywords if keyword not in kept]
+    data = pack_datasets(replace_keywords(datasets, ordered))
+
+    if iptc is None:
+        resources.append(Resource(IPTC_RESOURCE, b"\x00\x00", data))
+    digest = hashlib.md5(data).digest()
+    resources = [
+        resource._replace(data=data) if resource.id == IPTC_RESOURCE else
+        resource._replace(data=digest) if resource.id == IPTC_DIGEST_RESOURCE else resource
+        for resource in resources
+    ]
+
+    # Splice the new APP13 segment(s) in where the first was, or ahead of the first segment that is not APPn
+    photoshop = [segment for segment in segments
+                 if segment.marker == APP13 and segment.data.startswith(PHOTOSHOP_SIGNATURE)]
+    if photoshop:
+        insert_at = photoshop[0].offset
+    else:
+        insert_at = next((segment.offset for segment in segments if not 0xE0 <= segment.marker <= 0xEF), scan_offset)
+
+    parts, position = [], 0
+    for segment in photoshop:
+        parts.append(header[position:segment.offset])
+        if segment is photoshop[0]:
+            parts.append(build_segments(resources))
+        position = segment.offset + 4 + len(segment.data)
+    if not photoshop:
+        parts += [header[:insert_at], build_segments(resources)]
+        position = insert_at
+    parts.append(header[position:])
+    new_header = b"".join(parts)
+
+    if len(new_header) == len(header):
+        with open(path, "r+b") as file:
+            file.seek(insert_at)
+            file.write(new_header[insert_at:])
+        logger.debug(f'Patched IPTC keywords of "{path}" in place.')
+    else:
+        _rewrite(path, new_header, scan_offset)
+    return True
+
+
+def _rewrite(path: str, header: bytes, offset: int) -> None:
+    """
+    Replaces a file's content up to an offset, keeping the rest, through a temporary file.
+
+    :param path: The file to rewrite.
+    :param header: The new content preceding the kept data.
+    :param offset: The offset of the data kept.
+    """
+    head, tail = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{tail}.", suffix=".tmp", dir=head or None)
+    try:
+        with open(path, "rb") as source, os.fdopen(fd, "wb") as destination:
+            destination.write(header)
+            destination.flush()
+            source.seek(offset)
+            _copy(source, destination, offset)
+        shutil.copystat(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _copy(source: BinaryIO, destination: BinaryIO, offset: int) -> None:
+    """
+    Copies the rest of a file (from an offset onwards) to the end of another, within the kernel where possible.
+    """
+    start = destination.tell()
+    if hasattr(os, "copy_file_range"):
+        try:
+            while os.copy_file_range(source.fileno(), destination.fileno(), 1 << 30):
+                pass
+            return
+        except OSError:
+            # Unsupported by some filesystems, so start over through userspace
+            source.seek(offset)
+            destination.seek(start)
+            destination.truncate()
+    shutil.copyfileobj(source, destination, 1024 ** 2)
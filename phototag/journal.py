@@ -0,0 +1,138 @@
+"""
+journal.py
+
+An append-only journal of the files a run has finished, allowing interrupted runs to be resumed without processing
+(and tagging) the same files twice.
+"""
+
+import json
+import logging
+import os
+from threading import Lock
+from typing import Dict, Tuple, TextIO
+
+from phototag.helpers import ScanEntry
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = ".phototag-journal"
+
+
+class RunJournal(object):
+    """
+    Records each finished file (with its size & modification time) as a line of JSON, appended and flushed as soon as
+    the file finishes, so that a crash loses at most the line being written.
+
+    The journal is compacted (rewritten with one line per file) once superseded lines make up most of it.
+    """
+
+    def __init__(self, path: str, sync_every: int = 64, compact_min: int = 4096):
+        """
+        Opens (or creates) a journal, reading the entries it already holds.
+
+        :param path: The path of the journal file.
+        :param sync_every: The number of records appended between each fsync.
+        :param compact_min: The minimum number of lines before the journal is considered for compaction.
+        """
+        self.path, self.sync_every, self.compact_min = path, sync_every, compact_min
+        self.entries: Dict[str, Tuple[int, int]] = {}
+        self.lines, self.unsynced = 0, 0
+        self.lock = Lock()
+
+        self._read()
+        if self._bloated():
+            self.compact()
+        self.file: TextIO = open(self.path, "a", encoding="utf-8")
+
+    @staticmethod
+    def key(entry: ScanEntry) -> str:
+        """
+        :return: The journal key of a file, an absolute path built without touching the filesystem.
+        """
+        return os.path.abspath(entry.path)
+
+    def _read(self) -> None:
+        """
+        Reads the existing journal, if any. A partially written final line (from a crash) is ignored.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        terminated = True
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                terminated = line.endswith("\n")
+                if not terminated:
+                    break
+                try:
+                    path, size, mtime_ns = json.loads(line)
+                except ValueError:
+                    continue
+                self.entries[path] = (size, mtime_ns)
+                self.lines += 1
+
+        # Terminate a partial line, so that the next record appended starts on a line of its own
+        if not terminated:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write("\n")
+        logger.debug(f'Read {len(self.entries)} journal entries from {self.lines} lines.')
+
+    def _bloated(self) -> bool:
+        """
+        :return: Whether superseded lines make up most of the journal.
+        """
+        return self.lines >= self.compact_min and self.lines > 2 * len(self.entries)
+
+    def finished(self, entry: ScanEntry) -> bool:
+        """
+        :param entry: A file, along with its current stat information.
+        :return: Whether the file was finished by a previous run & has not changed since.
+        """
+        return self.entries.get(self.key(entry)) == (entry.size, entry.mtime_ns)
+
+    def record(self, entry: ScanEntry) -> None:
+        """
+        Records a file as finished.
+
+        :param entry: The file, along with its stat information after it was tagged.
+        """
+        key = self.key(entry)
+        with self.lock:
+            self.entries[key] = (entry.size, entry.mtime_ns)
+            self.file.write(json.dumps([key, entry.size, entry.mtime_ns]) + "\n")
+            self.file.flush()
+            self.lines += 1
+
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+            if self._bloated():
+                self.file.close()
+                self.compact()
+                self.file = open(self.path, "a", encoding="utf-8")
+
+    def compact(self) -> None:
+        """
+        Atomically rewrites the journal with a single line per file.
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for path, (size, mtime_ns) in self.entries.items():
+                file.write(json.dumps([path, size, mtime_ns]) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+        logger.debug(f'Compacted journal from {self.lines} to {len(self.entries)} lines.')
+        self.lines, self.unsynced = len(self.entries), 0
+
+    def close(self) -> None:
+        """
+        Syncs & closes the journal.
+        """
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
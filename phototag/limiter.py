@@ -0,0 +1,215 @@
+"""
+limiter.py
+
+Holds an AIMD (additive increase, multiplicative decrease) concurrency limiter for Vision API requests, adapting the
+number of requests in flight to the latency observed and to throttling errors, along with jittered retry delays and
+the latency tracking & budget behind hedged requests.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from threading import Condition, Lock
+from typing import Deque, Optional, Tuple, Type
+
+from google.api_core import exceptions
+
+logger = logging.getLogger(__name__)
+
+# Errors the Vision API raises when a request should be retried later, with fewer requests in flight
+THROTTLING_ERRORS: Tuple[Type[Exception], ...] = (
+    exceptions.ResourceExhausted, exceptions.TooManyRequests, exceptions.ServiceUnavailable
+)
+
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    :param attempt: The number of attempts that have failed so far, starting at 1.
+    :param base: The delay ceiling after the first failed attempt, in seconds.
+    :param cap: The maximum delay ceiling, in seconds.
+    :return: A 'full jitter' delay: uniformly random beneath an exponentially growing ceiling.
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits the number of requests in flight, adapting the limit AIMD style:
+
+    - Every success raises the limit by 1 / limit (about one per round trip).
+    - A sustained rise in latency shrinks it by latency_factor, throttling errors by throttle_factor.
+
+    Latency is judged by comparing a short-term moving average of recent latencies against a long-term one, so that
+    ordinary jitter between requests averages out and only a lasting rise (i.e. the service queueing requests) counts
+    as slow. Requests started before the last decrease do not decrease the limit again, so a single burst of errors
+    only halves it once.
+    """
+
+    def __init__(self, initial: float = 4, minimum: float = 1, maximum: float = 64, tolerance: float = 2.0,
+                 latency_factor: float = 0.9, throttle_factor: float = 0.5, short_weight: float = 0.1,
+                 long_weight: float = 0.01, warmup: int = 20):
+        """
+        :param initial: The starting limit.
+        :param minimum: The lowest the limit can go.
+        :param maximum: The highest the limit can go.
+        :param tolerance: The multiple of the long-term latency beyond which the short-term latency is slow.
+        :param latency_factor: The factor the limit is multiplied by while latency is slow.
+        :param throttle_factor: The factor the limit is multiplied by after a throttling error.
+        :param short_weight: The weight of each latency in the short-term (exponential) moving average.
+        :param long_weight: The weight of each latency in the long-term (exponential) moving average.
+        :param warmup: The number of latencies seen before latency can decrease the limit.
+        """
+        self.limit, self.minimum, self.maximum = float(initial), minimum, maximum
+        self.tolerance, self.latency_factor, self.throttle_factor = tolerance, latency_factor, throttle_factor
+        self.short_weight, self.long_weight, self.warmup = short_weight, long_weight, warmup
+        self.short: Optional[float] = None  # Moving averages of the latency, in seconds
+        self.long: Optional[float] = None
+        self.samples = 0
+        self.in_flight = 0
+        self.last_decrease = float("-inf")
+        self.throttled, self.slow = 0, 0
+        self.condition = Condition()
+
+    def _has_room(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[float]:
+        """
+        Waits until another request may be sent.
+
+        :param timeout: The most seconds waited, forever if None.
+        :return: The time the request started, to be passed back once it completes. None if the timeout passed first.
+        """
+        with self.condition:
+            if not self.condition.wait_for(self._has_room, timeout):
+                return None
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started: float, throttled: bool = False) -> None:
+        """
+        Records a completed request and adapts the limit.
+
+        :param started: The time the request started, as returned by acquire().
+        :param throttled: Whether the request failed with a throttling error.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self._adapt(started, time.monotonic() - started, throttled)
+            self.condition.notify_all()
+
+    def _adapt(self, started: float, latency: float, throttled: bool) -> None:
+        if throttled:
+            self.throttled += 1
+            self._decrease(started, self.throttle_factor)
+            return
+
+        if self.short is None:
+            self.short = self.long = latency
+        else:
+            self.short += (latency - self.short) * self.short_weight
+            self.long += (latency - self.long) * self.long_weight
+        self.samples += 1
+
+        if self.samples > self.warmup and self.short > self.long * self.tolerance:
+            self.slow += 1
+            self._decrease(started, self.latency_factor)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def _decrease(self, started: float, factor: float) -> None:
+        if started < self.last_decrease:
+            return  # Already reacted to the conditions this request saw
+        self.limit = max(self.minimum, self.limit * factor)
+        self.last_decrease = time.monotonic()
+        logger.debug(f'Decreased the request limit to {self.limit:.1f}.')
+
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """
+    An AdaptiveLimiter whose requests wait on an asyncio event loop, instead of blocking a thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.async_condition: Optional[asyncio.Condition] = None
+
+    async def acquire(self, timeout: Optional[float] = None) -> Optional[float]:
+        if self.async_condition is None:
+            # Created lazily, as it must be bound to the running event loop
+            self.async_condition = asyncio.Condition()
+        async with self.async_condition:
+            try:
+                await asyncio.wait_for(self.async_condition.wait_for(self._has_room), timeout)
+            except asyncio.TimeoutError:
+                return None
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started: float, throttled: bool = False) -> None:
+        async with self.async_condition:
+            self.in_flight -= 1
+            self._adapt(started, time.monotonic() - started, throttled)
+            self.async_condition.notify_all()
+
+
+class LatencyTracker(object):
+    """
+    Keeps the latencies of the most recent requests, to derive percentiles from.
+    """
+
+    def __init__(self, window: int = 256, min_samples: int = 20):
+        """
+        :param window: The number of recent latencies kept.
+        :param min_samples: The number of latencies needed before percentiles are reported.
+        """
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = Lock()
+
+    def record(self, latency: float) -> None:
+        with self.lock:
+            self.samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        :param q: The percentile, from 0 to 1.
+        :return: The latency at the given percentile, or None until enough latencies are known.
+        """
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class HedgeBudget(object):
+    """
+    A token bucket limiting hedged requests to a fraction of all requests: every request earns `ratio` tokens,
+    every hedge spends one.
+    """
+
+    def __init__(self, ratio: float = 0.05, burst: float = 10):
+        """
+        :param ratio: The fraction of requests that may be hedged, over time.
+        :param burst: The most tokens that can be saved up, bounding bursts of hedges.
+        """
+        self.ratio, self.burst = ratio, burst
+        self.tokens = 0.0
+        self.lock = Lock()
+
+    def earn(self) -> None:
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        """
+        :return: Whether a hedge may be sent, spending a token if so.
+        """
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
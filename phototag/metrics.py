@@ -0,0 +1,190 @@
+"""
+metrics.py
+
+Holds a small, thread-safe registry of counters, gauges & histograms describing a run, along with exporters writing
+them out as JSON or as a Prometheus textfile (for node_exporter's textfile collector to scrape).
+"""
+
+import bisect
+import json
+import logging
+import os
+from threading import Event, Lock, Thread
+from typing import Dict, List, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "phototag_"
+
+# Upper bounds of the histogram buckets, in seconds (or bytes for size histograms)
+TIME_BUCKETS: List[float] = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+BYTE_BUCKETS: List[float] = [1024 * 2 ** power for power in range(11)]  # 1 KB to 1 MB
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram(object):
+    """
+    Counts observations into cumulative buckets, Prometheus style.
+    """
+
+    def __init__(self, buckets: List[float] = TIME_BUCKETS):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)  # Not cumulative; observations above the last bucket go in +Inf only
+        self.count, self.sum = 0, 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        :return: Each bucket's upper bound (formatted) and the number of observations at or beneath it.
+        """
+        result, total = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((f"{bound:g}", total))
+        result.append(("+Inf", self.count))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        :return: An estimate of the given quantile: the upper bound of the bucket it falls in.
+        """
+        if not self.count:
+            return None
+        target, total = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics(object):
+    """
+    A registry of named metrics, each optionally split by labels (e.g. stage="decode").
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+        self.lock = Lock()
+
+    def describe(self, name: str, text: str) -> None:
+        """
+        Sets the help text exported for a metric.
+        """
+        self.help[name] = text
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = tuple(sorted(labels.items()))
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        with self.lock:
+            self.gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, buckets: List[float] = TIME_BUCKETS, **labels: str) -> None:
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            key = tuple(sorted(labels.items()))
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def to_dict(self) -> Dict:
+        """
+        :return: Every metric as plain data, ready to be serialized as JSON.
+        """
+        with self.lock:
+            return {
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                             for name, series in self.counters.items()},
+                "gauges": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                           for name, series in self.gauges.items()},
+                "histograms": {name: [{
+                    "labels": dict(key), "count": histogram.count, "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99), "buckets": dict(histogram.cumulative()),
+                } for key, histogram in series.items()] for name, series in self.histograms.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for kind, metrics in [("counter", self.counters), ("gauge", self.gauges)]:
+                for name, series in sorted(metrics.items()):
+                    lines += self._header(name, kind)
+                    lines += [f"{PREFIX}{name}{_labels(key)} {value:g}" for key, value in series.items()]
+
+            for name, series in sorted(self.histograms.items()):
+                lines += self._header(name, "histogram")
+                for key, histogram in series.items():
+                    for bound, count in histogram.cumulative():
+                        lines.append(f"{PREFIX}{name}_bucket{_labels(key + (('le', bound),))} {count}")
+                    lines.append(f"{PREFIX}{name}_sum{_labels(key)} {histogram.sum:g}")
+                    lines.append(f"{PREFIX}{name}_count{_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str, kind: str) -> List[str]:
+        header = [f"# HELP {PREFIX}{name} {self.help[name]}"] if name in self.help else []
+        return header + [f"# TYPE {PREFIX}{name} {kind}"]
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Writes a Prometheus textfile atomically, so the collector never reads a partially written file.
+        """
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+
+def _labels(key: Labels) -> str:
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+class PrometheusExporter(object):
+    """
+    Writes a Prometheus textfile on an interval from a background thread, and once more when closed.
+    """
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = 15.0):
+        self.metrics, self.path, self.interval = metrics, path, interval
+        self.stopped = Event()
+        self.thread = Thread(name="PrometheusExporter", target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self._write()
+
+    def _write(self) -> None:
+        try:
+            self.metrics.write_prometheus(self.path)
+        except OSError as error:
+            logger.warning(f'Could not write metrics to "{self.path}": {error}')
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self._write()
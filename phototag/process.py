@@ -5,88 +5,207 @@ Holds the majority of the file processing logic, including processing for indivi
 logic for queued threading for dozens of files in parallel.
 """
 
-import io
+import heapq
 import logging
 import os
-import random
-import shutil
 import time
+from contextlib import contextmanager
+from concurrent.futures import Executor
 from pathlib import Path
-from threading import Thread, Lock
-from typing import Tuple, AnyStr, Optional, List, Dict, Callable
+from threading import Thread, Lock, Condition
+from typing import Tuple, Optional, List, Dict, Callable, Iterator, Iterable, Union
 
-import imageio
-import iptcinfo3
-import rawpy
-from PIL import Image
 from google.cloud import vision
 from rich.progress import Progress
 
 from phototag import TEMP_PATH, CWD
-from phototag.constants import RAW_EXTS
-from phototag.exceptions import InvalidConfigurationError, NoSidecarFileError
-from phototag.helpers import random_characters
-from phototag.xmp import XMPParser
+from phototag.annotate import create_client, labels_from_response
+from phototag.cache import LabelCache, file_digest
+from phototag.index import TagIndex
+from phototag.similar import HASH_SIZE, LabelReuse
+from phototag.constants import JPEG_EXTS, RAW_EXTS
+from phototag.decode import thumbnail, estimate_memory, DecodeReport
+from phototag.exceptions import PhototagException, InvalidConfigurationError, NoSidecarFileError
+from phototag.helpers import ScanEntry
+from phototag.metrics import Metrics, BYTE_BUCKETS
+from phototag.tags import IPTCTagger, XMPTagger
 
 logger = logging.getLogger(__name__)
 
+# The stages a file passes through, in order. Files with cached labels skip optimizing & annotating.
+STAGES: List[str] = ["queue", "lookup", "optimize", "annotate", "write", "cleanup"]
+# The steps of the optimize stage, timed within the process decoding the file
+OPTIMIZE_STAGES: List[str] = ["decode", "encode"]
+
+
+class AdmissionQueue(object):
+    """
+    Holds waiting FileProcessors in a heap ordered by their estimated decoded memory, admitting the smallest first
+    while keeping count of the files & memory currently admitted.
+    """
+
+    def __init__(self, image_count: int, buffer_size: int, single_override: bool):
+        """
+        :param image_count: The number of files allowed to be running at any time.
+        :param buffer_size: The maximum total decoded memory allowed to be running at any time.
+        :param single_override: If true, one file is always admitted when none are running, regardless of limits.
+        """
+        self.image_count, self.buffer_size, self.single_override = image_count, buffer_size, single_override
+        self.heap: List[Tuple[int, int, FileProcessor]] = []
+        self.running_count, self.running_memory = 0, 0
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def __iter__(self) -> Iterator['FileProcessor']:
+        return (fp for _, _, fp in self.heap)
+
+    def push(self, key: int, fp: 'FileProcessor') -> None:
+        """
+        Adds a FileProcessor to the queue.
+
+        :param key: The FileProcessor's unique integer key, breaking ties between equal estimates.
+        :param fp: The FileProcessor to queue.
+        """
+        heapq.heappush(self.heap, (fp.memory, key, fp))
+        fp.queued = time.perf_counter()
+
+    def pop(self) -> Optional[Tuple[int, 'FileProcessor']]:
+        """
+        Removes the smallest FileProcessor if it fits within the limits, counting it as running.
+
+        :return: The key & FileProcessor admitted, or None if nothing can be admitted right now.
+        """
+        if not self.heap:
+            return None
+
+        memory, key, fp = self.heap[0]
+        fits = self.running_count < self.image_count and self.running_memory + memory <= self.buffer_size
+        if not fits and not (self.single_override and self.running_count == 0):
+            # The smallest file does not fit, so none of the larger ones will either
+            return None
+
+        heapq.heappop(self.heap)
+        self.running_count += 1
+        self.running_memory += memory
+        fp.timings["queue"] = time.perf_counter() - fp.queued
+        return key, fp
+
+    def release(self, fp: 'FileProcessor') -> None:
+        """
+        Stops counting a previously admitted FileProcessor as running.
+
+        :param fp: The FileProcessor that has finished.
+        """
+        self.running_count -= 1
+        self.running_memory -= fp.memory
+
 
 class MasterFileProcessor(object):
     """
     Controls FileProcessor objects in the context of threading according to configuration options.
     """
 
-    def __init__(self, files: List[Path], image_count: int, buffer_size: int, single_override: bool, client=None,
-                 progress: Progress = None):
+    def __init__(self, files: Iterable[Union[Path, ScanEntry]], image_count: int, buffer_size: int,
+                 single_override: bool, client=None, progress: Progress = None, executor: Optional[Executor] = None,
+                 raw_mode: str = "full", decoder: str = "auto", max_bytes: Optional[int] = None,
+                 optimize_huffman: bool = True, debug_temp: bool = False, cache: Optional[LabelCache] = None,
+                 index: Optional[TagIndex] = None, reuse: Optional[LabelReuse] = None, stream: bool = False,
+                 window: int = 256, on_finished: Optional[Callable[['FileProcessor'], None]] = None,
+                 metrics: Optional[Metrics] = None, on_skipped: Optional[Callable[[Path], None]] = None):
         """
         Initializes a MasterFileProcessor object.
 
-        :param files: The files each FileProcessor object will shadow.
+        :param files: The files (or ScanEntry objects) each FileProcessor will shadow. May be lazy when streaming.
         :param image_count: The number of files allowed to be running at any time.
-        :param buffer_size: The maximum total size of the files allowed to be loaded/running at any time.
-        :param single_override: If true, the previous configuration values will disregarded in order to keep at least one FileProcessor running.
+        :param buffer_size: The maximum total (estimated) decoded memory of the files allowed to be running at any time.
+        :param single_override: If true, the previous configuration values will disregarded in order to keep at least
+                                one FileProcessor running.
+        :param executor: If provided, decoding & thumbnailing will be submitted to this (process) pool.
+        :param raw_mode: The decoding mode used for RAW files, one of decode.RAW_MODES.
+        :param decoder: The decode backend used for lossy files, one of backends.BACKEND_NAMES.
+        :param max_bytes: If given, the most bytes each uploaded thumbnail may take up.
+        :param optimize_huffman: Whether thumbnails are encoded with optimal Huffman tables.
+        :param debug_temp: If true, uploaded thumbnails are also written to TEMP_PATH for inspection.
+        :param cache: An optional label cache, consulted before decoding or querying the Vision API.
+        :param index: An optional tag index, updated with each file's tags as they are written.
+        :param reuse: If given, files whose thumbnails are near-duplicates of another's reuse its labels.
+        :param stream: If true, files are pulled from the iterable in a background thread while processing runs.
+        :param window: When streaming, the maximum number of files waiting (and being ordered by size) at once.
+        :param on_finished: Called with each FileProcessor once it has finished, successfully or not.
+        :param metrics: The registry stage timings, file counts & queue state are recorded in.
+        :param on_skipped: Called with the path of each file skipped while streaming, as it could not be processed.
         """
-        self.files, self.image_count = files, image_count
+        self.files, self.image_count = files if stream else list(files), image_count
         self.buffer_size, self.single_override = buffer_size, single_override
-        self.client = client if client is not None else vision.ImageAnnotatorClient()
-
-        self.waiting: Dict[int, FileProcessor] = {}  # FileProcessors that are ready to process, but are not.
+        self.client = client if client is not None else self._create_client()
+        self.executor, self.cache, self.index, self.reuse = executor, cache, index, reuse
+        self.raw_mode, self.decoder, self.debug_temp = raw_mode, decoder, debug_temp
+        self.max_bytes, self.optimize_huffman = max_bytes, optimize_huffman
+        self.on_finished, self.on_skipped = on_finished, on_skipped
+        self.report = DecodeReport()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.describe("stage_seconds", "Time spent by files in each stage of processing.")
+        self.metrics.describe("files_total", "Files finished, by result.")
+        self.metrics.describe("files_active", "Files currently being processed.")
+        self.metrics.describe("files_waiting", "Files waiting to be admitted.")
+        self.metrics.describe("buffered_bytes", "Estimated decoded memory of the files being processed.")
+        self.metrics.describe("thumbnail_bytes", "Size of the thumbnails uploaded.")
+        self.metrics.describe("thumbnail_encodes_total", "Encodes made to fit thumbnails in the byte budget.")
+        self.metrics.describe("labels_reused_total", "Files given a near-duplicate's labels instead of an API call.")
+
+        # FileProcessors that are ready to process, but are not.
+        self.waiting = AdmissionQueue(image_count, buffer_size, single_override)
         self.running: Dict[int, Tuple[FileProcessor, Thread]] = {}  # FPs that are currently being processed in threads.
-        self.finished: Dict[int, FileProcessor] = {}  # FileProcessors that have finished processing.
+        # The number of files that have finished processing, and of those that failed; the FileProcessors themselves
+        # are handed to on_finished rather than kept, so that long-running (watching) processors do not grow.
+        self.finished, self.failed = 0, 0
 
         self.lock = Lock()
+        self.space = Condition(self.lock)  # Notified whenever a file leaves the waiting queue
+
+        # When streaming, files are discovered in the background & the total is not known up front
+        self.window = window
+        self.discovered = 0 if stream else len(self.files)
+        self.discovering = stream
+        self.discovery = Thread(name='Discovery', target=self._discover, daemon=True) if stream else None
 
         self.progress = progress
         self.tasks = [
-            progress.add_task("[blue]Waiting", total=len(self.files), completed=len(self.files)),
-            progress.add_task("[red]Running", total=len(self.files)),
-            progress.add_task("[green]Finished", total=len(self.files))
+            progress.add_task("[blue]Waiting", total=self.discovered, completed=self.discovered),
+            progress.add_task("[red]Running", total=self.discovered),
+            progress.add_task("[green]Finished", total=self.discovered)
         ] if self.progress else None
-        self.previous_state = [len(self.files), 0, 0]
+        self.previous_state = [self.discovered, 0, 0]
         if self.progress:
             logger.debug(f'Progress tasks created. Task IDs: {self.tasks}')
 
-        processors = [FileProcessor(path) for path in files]
-        processors.sort(key=lambda processor: processor.size)
-
-        for index, fp in enumerate(processors):
-            self.waiting[index] = fp
-        logger.debug('FileProcessors created & sorted, index keys assigned.')
+        if not stream:
+            for index, path in enumerate(self.files):
+                self.waiting.push(index, self._create_processor(path))
+            logger.debug('FileProcessors created & queued, index keys assigned.')
 
         self._precheck()
         logger.debug('Precheck passed.')
 
+    def _create_client(self):
+        """
+        Creates the client used when none was provided.
+        """
+        return create_client()
+
     def _precheck(self) -> None:
         """
         Checks that the MasterFileProcessor can successfully process all files with the current configuration options.
 
-        :except InvalidConfigurationError: when the current configuration will be unable to complete based on the current parameters.
+        :except InvalidConfigurationError: when the current configuration will be unable to complete based on the
+                                           current parameters.
         """
         # single_override ensures that the application will always complete, even if slowly, one-by-one
         if not self.single_override:
             # Check that all files are under the set buffer limit
-            for key, fp in self.waiting.keys():
-                if fp.size > self.buffer_size:
+            for fp in self.waiting:
+                if fp.memory > self.buffer_size:
                     raise InvalidConfigurationError(
                         "Invalid Configuration - the buffer size is too low. Please raise the buffer size "
                         "or enable single_override.")
@@ -97,16 +216,66 @@ class MasterFileProcessor(object):
                     "Invalid Configuration - the image_count is too low. Please set it to a positive "
                     "non-zero integer or enable single_override.")
 
-    def _start(self, key: int) -> None:
+    def _create_processor(self, item: Union[Path, ScanEntry]) -> 'FileProcessor':
+        """
+        :param item: The path of a file, or a ScanEntry carrying the file's stat information along with it.
+        :return: A FileProcessor shadowing the file.
+        """
+        if isinstance(item, ScanEntry):
+            item, stat = item.path, item
+        else:
+            stat = None
+        return FileProcessor(item, raw_mode=self.raw_mode, decoder=self.decoder, max_bytes=self.max_bytes,
+                             optimize_huffman=self.optimize_huffman, debug_temp=self.debug_temp, stat=stat,
+                             hash_size=HASH_SIZE if self.reuse is not None else None)
+
+    def _discover(self) -> None:
+        """
+        Pulls files from the (lazy) files iterable into the waiting queue, blocking while the window is full.
+        """
+        try:
+            for path in self.files:
+                try:
+                    fp = self._create_processor(path)
+                    if not self.single_override and fp.memory > self.buffer_size:
+                        raise InvalidConfigurationError(f'"{path}" will not fit in the buffer size.')
+                except PhototagException as error:
+                    logger.warning(f'Skipping "{path}": {error}')
+                    self.metrics.increment("files_total", result="skipped")
+                    if self.on_skipped is not None:
+                        self.on_skipped(path.path if isinstance(path, ScanEntry) else path)
+                    continue
+
+                with self.lock:
+                    while len(self.waiting) >= self.window:
+                        self.space.wait()
+                    self.waiting.push(self.discovered, fp)
+                    self.discovered += 1
+                self.load()
+        finally:
+            with self.lock:
+                self.discovering = False
+            logger.debug(f'Discovery finished, {self.discovered} files found.')
+            self._update_tasks()
+
+    @property
+    def done(self) -> bool:
+        """
+        :return: Whether every file has been discovered and processed.
+        """
+        return not self.discovering and len(self.running) == 0 and len(self.waiting) == 0
+
+    def _start(self, key: int, fp: 'FileProcessor') -> None:
         """
-        Starts a new FileProcessor Thread, moving the FP and creating it's thread in the running dict.
+        Starts a new FileProcessor Thread, creating it's thread in the running dict.
 
         :param key: The integer key representing the FileProcessor being added.
+        :param fp: The FileProcessor admitted from the queue.
         """
-        fp = self.waiting.pop(key)
         logger.debug(f'Claimed FileProcessor {key} from queue.')
         thread = Thread(name=f'FP-{key}', target=fp.run, args=(self.client,),
-                        kwargs={'callback': lambda: self._finished(key)})
+                        kwargs={'callback': lambda: self._finished(key), 'executor': self.executor,
+                                'cache': self.cache, 'index': self.index, 'reuse': self.reuse})
         self.running[key] = (fp, thread)
         thread.start()
         logger.info(f'FileProcessor {key}\'s Thread created and started.')
@@ -118,12 +287,35 @@ class MasterFileProcessor(object):
         :param int key: The FileProcessor's integer key in the running dict.
         """
         # Remove the FileProcessor and the Thread fom the running dict.
-        fp, thread = self.running.pop(key)
-        self.finished[key] = fp
+        with self.lock:
+            fp, thread = self.running.pop(key)
+            self.waiting.release(fp)
+            self.finished += 1
+            self.failed += not fp.succeeded
+        self._record(fp)
         logger.info(f'FileProcessor {key} ("{fp.file_path}") has finished.')
         # Load FileProcessors if possible
         self.load()
 
+    def _record(self, fp: 'FileProcessor') -> None:
+        """
+        Records a finished FileProcessor in the decode report & metrics, then hands it to the on_finished callback.
+
+        :param fp: The FileProcessor that has finished.
+        """
+        if fp.decode_source is not None:
+            self.report.record(fp.ext, fp.decode_source, fp.upload_bytes)
+        if fp.upload_bytes is not None:
+            self.metrics.observe("thumbnail_bytes", fp.upload_bytes, buckets=BYTE_BUCKETS)
+            self.metrics.increment("thumbnail_encodes_total", fp.encodes)
+        if fp.reused:
+            self.metrics.increment("labels_reused_total")
+        for stage, seconds in fp.timings.items():
+            self.metrics.observe("stage_seconds", seconds, stage=stage)
+        self.metrics.increment("files_total", result="succeeded" if fp.succeeded else "failed")
+        if self.on_finished is not None:
+            self.on_finished(fp)
+
     @property
     def total_active(self) -> int:
         """
@@ -131,49 +323,32 @@ class MasterFileProcessor(object):
 
         :return: a integer describing the number of threads currently processing files.
         """
-        return len(list(self.running.values()))
+        return self.waiting.running_count
 
     @property
     def total_size(self) -> int:
         """
-        Returns the sum of all currently running files in memory, in bytes.
+        Returns the estimated decoded memory of all currently running files, in bytes.
 
-        :return: the total number of bytes the images in the buffer take up on the disk.
+        :return: the total number of bytes the images being processed are estimated to take up in memory.
         """
-        return sum(processor.size for processor, thread in list(self.running.values()))
+        return self.waiting.running_memory
 
     def load(self) -> None:
         """
         Starts FileProcessor threads, loading zero or more threads simultaneously based on configuration options.
         """
-        self._update_tasks()
-
-        if not self.lock.acquire(False):
-            pass
-        else:
-            try:
-                available: List[int] = list(self.waiting.keys())
-                if len(available) == 0:
-                    return
-
-                logger.debug(f'Looking for FileProcessors to load ({len(available)} available)...')
-
-                # At least 1 FP in queue and # of
-                while len(available) > 0 and len(self.running) < self.image_count:
-                    logger.debug(f'Trying to claim FileProcessor {available[0]}')
-                    # check that the smallest FP can fit in the specified buffer
-                    if self.total_size + self.waiting[available[0]].size <= self.buffer_size:
-                        self._start(available.pop(0))
-                    else:
-                        # Could not fit under limit, thus all the subsequent items in the queue will not either.
-                        # Subsequent items will be added through the _finished() callback.
-                        break
-            finally:
-                self.lock.release()
-
-            # Ensure that at least 1 is in queue with single_override enabled
-            if self.single_override and len(available) != 0 and len(self.running) == 0:
-                self._start(available.pop(0))
+        if self.discovery is not None and self.discovery.ident is None:
+            self.discovery.start()
+
+        with self.lock:
+            # Admit the smallest FileProcessors until the next one no longer fits.
+            # Subsequent items will be added through the _finished() callback, or as they are discovered.
+            admitted = self.waiting.pop()
+            while admitted is not None:
+                self._start(*admitted)
+                admitted = self.waiting.pop()
+            self.space.notify_all()
 
         self._update_tasks()
 
@@ -182,28 +357,42 @@ class MasterFileProcessor(object):
         Joins running threads continuously until none are left.
         """
         while True:
-            threads = [thread for fp, thread in self.running.values()]
+            with self.lock:
+                threads = [thread for fp, thread in self.running.values()]
+                if self.done:
+                    break
+
             for thread in threads:
                 thread.join()
 
-            if len(self.running) == 0 and len(self.waiting) == 0:
-                break
+            # Nothing is running yet, but discovery may still be looking for files
+            if not threads and self.discovery is not None:
+                self.discovery.join(0.05)
 
     def _update_tasks(self) -> None:
         """
         If a rich.Progress[bar] was provided in __init__, the tasks in it will be updated accordingly.
+        Queue state is recorded in the metrics regardless.
         """
+        self.metrics.set("files_active", self.total_active)
+        self.metrics.set("files_waiting", len(self.waiting))
+        self.metrics.set("buffered_bytes", self.total_size)
+
         # Return immediately if progressbar was not supplied
         if not self.progress:
             return
 
+        if self.discovery is not None:
+            for task in self.tasks:
+                self.progress.update(task, total=self.discovered)
+
         # Update all tasks
         self.progress.update(self.tasks[0], advance=(len(self.waiting) - self.previous_state[0]))
         self.progress.update(self.tasks[1], advance=(len(self.running) - self.previous_state[1]))
-        self.progress.update(self.tasks[2], advance=(len(self.finished) - self.previous_state[2]))
+        self.progress.update(self.tasks[2], advance=(self.finished - self.previous_state[2]))
 
         # Update previous state variable accordingly
-        self.previous_state = [len(self.waiting), len(self.running), len(self.finished)]
+        self.previous_state = [len(self.waiting), len(self.running), self.finished]
 
 
 class FileProcessor(object):
@@ -214,132 +403,223 @@ class FileProcessor(object):
     Acts as a slave to the MasterFileProcessor, but can be controlled individually.
     """
 
-    def __init__(self, file_path: Path):
+    def __init__(self, file_path: Path, raw_mode: str = "full", decoder: str = "auto", max_bytes: Optional[int] = None,
+                 optimize_huffman: bool = True, debug_temp: bool = False, stat: Optional[ScanEntry] = None,
+                 hash_size: Optional[int] = None):
         """
         Initializes a FileProcessor object.
 
         :param file_path: The file that the FileProcessor object will shadow.
+        :param raw_mode: The decoding mode used for RAW files, one of decode.RAW_MODES.
+        :param decoder: The decode backend used for lossy files, one of backends.BACKEND_NAMES.
+        :param max_bytes: If given, the most bytes the uploaded thumbnail may take up.
+        :param optimize_huffman: Whether the thumbnail is encoded with optimal Huffman tables.
+        :param debug_temp: If true, the thumbnail uploaded is also written to TEMP_PATH for inspection.
+        :param stat: The stat information gathered when the file was found. If not provided, it is read lazily.
+        :param hash_size: If given, the perceptual hash of the thumbnail is computed (see similar.LabelReuse).
         """
 
         self.file_path = file_path
+        self.stat = stat
+        self.raw_mode = raw_mode
+        self.decoder = decoder
+        self.max_bytes, self.optimize_huffman = max_bytes, optimize_huffman
+        self.debug_temp, self.hash_size = debug_temp, hash_size
+        self.phash: Optional[int] = None  # The perceptual hash of the thumbnail, once optimized with a hash_size
+        self.reused = False  # Whether a near-duplicate's labels were reused
+        self.decode_source: Optional[str] = None  # The decode path taken, once optimized
+        self.upload_bytes: Optional[int] = None  # The size of the thumbnail, once optimized
+        self.encodes = 0  # The number of encodes made to fit the thumbnail in max_bytes
+        self.succeeded: Optional[bool] = None  # Whether the file was processed successfully, once finished
+        self.timings: Dict[str, float] = {}  # Seconds spent in each stage of processing
+        self.queued: Optional[float] = None  # When the file was queued for admission
+        self._memory: Optional[int] = None  # Estimated decoded memory, read lazily
         self.base, self.ext = os.path.splitext(self.file_path.name)
         self.ext = self.ext[1:]  # remove the prepended dot
 
-        # Path to temporary file that will be optimized for upload to Google
+        # Path the uploaded thumbnail is dumped to in debug mode
         self.temp_file_path = os.path.join(TEMP_PATH, self.base + ".jpeg")
 
         # Decide whether a XMP file is available
         self.xmp = None
         if self.ext.lower() in RAW_EXTS:  # if the extension is in the RAW extensions array, it might have an XMP (?)
             self.xmp = self.base + ".xmp"
-            self.input_xmp = os.path.join(CWD, self.xmp)
+            self.input_xmp = os.path.join(CWD, self.file_path.parent, self.xmp)  # Sidecars sit beside their image
             if not os.path.exists(self.input_xmp):
                 raise NoSidecarFileError("Sidecar file for '{}' does not exist.".format(self.xmp))
 
-    @staticmethod
-    def _optimize(file: AnyStr, size: Tuple[int, int] = (512, 512), quality: int = 85,
-                  copy: Optional[AnyStr] = None) -> None:
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """
+        Adds the time spent within the block to the given stage's timing.
+
+        :param stage: The stage of processing, one of STAGES or OPTIMIZE_STAGES.
         """
-        A special static method for optimizing a JPEG file using thumbnailing and quality reduction/compression.
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
 
-        :param file: The path of the original file you want to optimize.
-        :param size: The width and height of the image you want generated.
-        :param quality: The quality of the file you want generated, from 0 to 100.
-        :param copy:  The path you want to copy the optimized file to. If not specified, the original file will be overwritten.
+    def optimize(self, executor: Optional[Executor] = None) -> bytes:
         """
-        image = Image.open(file)
-        image.thumbnail(size, resample=Image.ANTIALIAS)  # Thumbnail the image
+        Optimize the file shadowed by this object, supporting RAW files as needed.
 
-        # Copy or overwrite the file while optimizing & applying new quality
-        if copy:
-            image.save(copy, format="jpeg", optimize=True, quality=quality)
+        :param executor: If provided, decoding & thumbnailing happen in this pool and only the thumbnail is returned.
+        :return: The encoded JPEG thumbnail, ready to be uploaded as-is.
+        """
+        path = os.path.join(CWD, self.file_path)
+        if executor is not None:
+            result = executor.submit(thumbnail, path, raw_mode=self.raw_mode, backend=self.decoder,
+                                     max_bytes=self.max_bytes, optimize=self.optimize_huffman,
+                                     hash_size=self.hash_size).result()
         else:
-            image.save(file, format="jpeg", optimize=True, quality=quality)
+            # CPU-Bound task, best paired with a process pool executor
+            result = thumbnail(path, raw_mode=self.raw_mode, backend=self.decoder, max_bytes=self.max_bytes,
+                               optimize=self.optimize_huffman, hash_size=self.hash_size)
+
+        self.decode_source, self.phash = result.source, result.phash
+        self.upload_bytes, self.encodes = len(result.content), result.encodes
+        self.timings["decode"], self.timings["encode"] = result.decode_seconds, result.encode_seconds
+        if self.debug_temp:
+            with open(self.temp_file_path, "wb") as file:
+                file.write(result.content)
+        return result.content
+
+    def lookup(self, cache: Optional[LabelCache] = None) -> Tuple[Optional[str], Optional[List[str]]]:
+        """
+        Looks up the labels previously identified for the file's contents.
 
-    def optimize(self) -> None:
+        :param cache: The label cache to consult. If not provided, nothing is looked up.
+        :return: The file's content digest & cached labels, either of which may be None.
         """
-        Optimize the file shadowed by this object, supporting RAW files as needed.
+        if cache is None:
+            return None, None
+
+        digest = file_digest(os.path.join(CWD, self.file_path))
+        labels = cache.get(digest)
+        if labels is not None:
+            logger.debug(f'Using cached labels for "{self.file_path}".')
+        return digest, labels
+
+    def write(self, labels: List[str], cache: Optional[LabelCache] = None, index: Optional[TagIndex] = None) -> None:
+        """
+        Writes the labels identified to the file's XMP sidecar, or to the image's IPTC keywords.
+
+        :param labels: The labels to write.
+        :param cache: An optional label cache, updated when tagging changes the file's contents.
+        :param index: An optional tag index, updated with every tag the file now carries.
         """
+        logger.info("{} Keywords Identified: {}".format(
+            len(labels), ", ".join([f'[cyan]{label}[/cyan]' for label in labels])
+        ))
+
+        # XMP sidecar file specified, write to it using XML module
         if self.xmp:
-            # CPU-Bound task, needs threading or async applied
-            rgb = rawpy.imread(os.path.join(CWD, self.file_path))
-            imageio.imsave(self.temp_file_path, rgb.postprocess())
-            rgb.close()
-            self._optimize(self.temp_file_path)
+            logger.debug(f"Writing {len(labels)} tags to output XMP.")
+            tagger = XMPTagger(Path(self.input_xmp))
+            tagger.extend(labels)
+            tagger.save()
+
+        # No XMP file is specified, using IPTC tagging
         else:
-            self._optimize(os.path.join(CWD, self.file_path), copy=self.temp_file_path)
+            logger.debug(f"Writing {len(labels)} tags to image IPTC")
+            tagger = IPTCTagger(Path(CWD, self.file_path))
+            tagger.extend(labels)
+            tagger.save()
+
+            # Tagging changed the file's contents, so remember the labels for the tagged version as well
+            if cache is not None and tagger.written:
+                cache.put(file_digest(os.path.join(CWD, self.file_path)), labels)
+
+        if index is not None:
+            index.update(Path(CWD, self.file_path), tagger.tags)
+
+        # Copy dry-run
+        # shutil.copy2(os.path.join(CWD, self.file_name), os.path.join(OUTPUT_PATH, self.file_name))
+        # os.rename(os.path.join(CWD, self.file_name), os.path.join(OUTPUT_PATH, self.file_name))
 
-    def run(self, client: vision.ImageAnnotatorClient, callback: Callable = None) -> None:
+    def finish(self, succeeded: bool) -> None:
+        """
+        Cleans up after the file has been processed.
+
+        :param succeeded: Whether the file was processed successfully.
+        """
+        self.succeeded = succeeded
+        # Debug thumbnails of files that failed are left behind for inspection
+        if self.debug_temp and succeeded:
+            with self.timed("cleanup"):
+                self._cleanup()
+
+    def run(self, client: vision.ImageAnnotatorClient, callback: Callable = None,
+            executor: Optional[Executor] = None, cache: Optional[LabelCache] = None,
+            index: Optional[TagIndex] = None, reuse: Optional[LabelReuse] = None) -> None:
         """
         Optimize, find labels for and tag the file.
 
-        :param client: The ImageAnnotatorClient to be used for interacting with the Google Vision API.
+        :param client: The ImageAnnotatorClient (or a BatchAnnotator) used for interacting with the Google Vision API.
         :param callback: Utility kwarg used for threading purposes.
+        :param executor: An optional (process) pool to run decoding & thumbnailing in.
+        :param cache: An optional label cache. On a hit, decoding and the Vision API are skipped entirely.
+        :param index: An optional tag index, updated once the file's tags are written.
+        :param reuse: If given, the labels of a near-duplicate file are reused instead of querying the Vision API.
         """
 
+        succeeded = False
         try:
-            self.optimize()  # Optimize the file first before sending to the Google Vision API
-
-            # Open the image, read as bytes, convert to types Image
-            image = Image.open(self.temp_file_path)
-            bytesIO = io.BytesIO()
-            image.save(bytesIO, format="jpeg")
-            image.close()
-            image = vision.types.Image(content=bytesIO.getvalue())
-
-            # Performs label detection on the image file
-            # response = client.label_detection(image=image)
-            # labels = [label.description for label in response.label_annotations]
-            time.sleep(random.random() * 3)
-            labels = [random_characters(8) for _ in range(random.randint(4, 20))]
-            logger.info("{} Keywords Identified: {}".format(
-                len(labels), ", ".join([f'[cyan]{label}[/cyan]' for label in labels])
-            ))
-
-            # XMP sidecar file specified, write to it using XML module
-            if self.xmp:
-                logger.debug(f"Writing {len(labels)} tags to output XMP.")
-                parser = XMPParser(self.input_xmp)
-                parser.add_keywords(labels)
-
-                # Generate a temporary XMP file name
-                head, tail = os.path.split(self.input_xmp)
-                name, ext = os.path.splitext(tail)
-                temp_name = os.path.join(head, f'{name} temp{ext}')
-
-                # Finish up processing XMP file
-                os.rename(self.input_xmp, temp_name)  # rename the original file
-                parser.save(self.input_xmp)  # save the new file
-                shutil.copystat(temp_name, self.input_xmp)  # copy file metadata over
-                os.remove(temp_name)  # remove the renamed original file
-                logger.debug("New XMP file saved with original file metadata. Old XMP file removed.")
-
-            # No XMP file is specified, using IPTC tagging
-            else:
-                logger.debug(f"Writing {len(labels)} tags to image IPTC")
-                info = iptcinfo3.IPTCInfo(os.path.join(CWD, self.file_path))
-                info["keywords"].extend(labels)
-                info.save()
-
-                # Remove the weird ghost file created by this iptc read/writer.
-                os.remove(os.path.join(CWD, self.file_path + "~"))
-
-            # Copy dry-run
-            # shutil.copy2(os.path.join(CWD, self.file_name), os.path.join(OUTPUT_PATH, self.file_name))
-            # os.rename(os.path.join(CWD, self.file_name), os.path.join(OUTPUT_PATH, self.file_name))
+            # Only JPEGs (and RAW files, through their sidecars) can carry the tags, so nothing else is worth labeling
+            if self.xmp is None and self.ext.lower() not in JPEG_EXTS:
+                logger.warning(f'Skipping "{self.file_path}": it cannot be tagged, only JPEGs carry IPTC keywords.')
+                return  # Counted as failed
+
+            with self.timed("lookup"):
+                digest, labels = self.lookup(cache)
+
+            if labels is None:
+                # Optimize the file first, the encoded thumbnail goes into the request without touching the disk
+                with self.timed("optimize"):
+                    image = vision.Image(content=self.optimize(executor))
+
+                # Performs label detection on the image file
+                def annotate() -> List[str]:
+                    return labels_from_response(client.label_detection(image=image))
+
+                with self.timed("annotate"):
+                    if reuse is not None and self.phash is not None:
+                        labels, self.reused = reuse.labels(self.phash, annotate)
+                    else:
+                        labels = annotate()
+                if cache is not None:
+                    cache.put(digest, labels)
+
+            with self.timed("write"):
+                self.write(labels, cache, index)
+            succeeded = True
         except Exception:
             raise
         finally:
-            self._cleanup()
-            callback()
+            self.finish(succeeded)
+            if callback:
+                callback()
 
     def _cleanup(self) -> None:
         """
-        Cleanup function. Removes the temporary file generated.
+        Cleanup function. Removes the temporary thumbnail written in debug mode.
         """
         if os.path.exists(self.temp_file_path):
             os.remove(self.temp_file_path)
 
+    @property
+    def memory(self) -> int:
+        """
+        Returns the estimated memory decoding the image will take, read from the image's header once.
+
+        :return: the estimated number of bytes the decoded image will occupy
+        """
+        if self._memory is None:
+            self._memory = estimate_memory(os.path.join(CWD, self.file_path), raw_mode=self.raw_mode, size=self.size)
+        return self._memory
+
     @property
     def size(self) -> int:
         """
@@ -347,4 +627,6 @@ class FileProcessor(object):
 
         :return: the number of bytes the shadowed image takes up on the disk
         """
-        return os.path.getsize(os.path.join(CWD, self.file_path))
+        if self.stat is None:
+            self.stat = ScanEntry.from_path(Path(CWD, self.file_path))
+        return self.stat.size
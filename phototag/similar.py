@@ -0,0 +1,193 @@
+"""
+similar.py
+
+Reuses labels across near-duplicate images (e.g. the frames of a burst), found by the Hamming distance between the
+perceptual hashes of their thumbnails, so that only one image of each group is sent to the Vision API.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import Future
+from threading import Lock
+from typing import Awaitable, Callable, Generic, List, Optional, Tuple, TypeVar
+
+from PIL import Image
+
+from phototag.constants import REUSE_DISTANCE
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE: int = 8  # Hashes are HASH_SIZE ** 2 bits, unrelated images around half of them apart
+
+T = TypeVar('T')
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """
+    :param image: The image to hash, ideally already downscaled.
+    :param hash_size: The width & height of the hash, in bits.
+    :return: The DCT-based perceptual hash of the image, as an integer.
+    """
+    import imagehash  # Pulls in SciPy, so only imported when hashing is enabled
+
+    bits = imagehash.phash(image, hash_size=hash_size).hash.flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hamming(a: int, b: int) -> int:
+    """
+    :return: The number of bits differing between two hashes.
+    """
+    return bin(a ^ b).count('1')
+
+
+class BKTree(Generic[T]):
+    """
+    A Burkhard-Keller tree, finding every hash within a Hamming distance of another without comparing it to all of
+    them: each child is keyed by its distance to its parent, so by the triangle inequality only the children keyed
+    within `distance` of the parent's own distance to the query can hold matches.
+    """
+
+    def __init__(self):
+        self.root: Optional[list] = None  # [hash, value, {distance: child}]
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, key: int, value: T) -> None:
+        """
+        Adds a hash & its value to the tree. Equal hashes are kept side by side.
+        """
+        self.size += 1
+        if self.root is None:
+            self.root = [key, value, {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, value, {}]
+                return
+            node = child
+
+    def find(self, key: int, distance: int) -> List[Tuple[int, T]]:
+        """
+        :param key: The hash to look for.
+        :param distance: The most bits a match may differ by.
+        :return: The distance & value of every match, closest first.
+        """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            between = hamming(key, node[0])
+            if between <= distance:
+                found.append((between, node[1]))
+            stack.extend(child for edge, child in node[2].items() if between - distance <= edge <= between + distance)
+        found.sort(key=lambda match: match[0])
+        return found
+
+
+def _failed(future: Future) -> bool:
+    return future.done() and future.result() is None
+
+
+class LabelReuse(object):
+    """
+    Hands out the labels of a near-duplicate image already labeled (or being labeled), so that it need not be sent.
+
+    Every image sent registers a Future in the tree before its request is made, so that neighbors arriving while it is
+    in flight (as the frames of a burst do) wait for its labels instead of sending requests of their own. If that
+    request fails, the neighbors go on to send theirs.
+    """
+
+    def __init__(self, distance: int = REUSE_DISTANCE):
+        """
+        :param distance: The most bits the hashes of two images considered near-duplicates may differ by.
+        """
+        self.distance = distance
+        self.tree: BKTree[Future] = BKTree()
+        self.lock = Lock()
+        self.requested = 0  # Images sent to the Vision API
+        self.reused = 0  # Images given a near-duplicate's labels instead
+
+    @property
+    def rate(self) -> float:
+        """The fraction of images labeled which reused a near-duplicate's labels."""
+        total = self.requested + self.reused
+        return self.reused / total if total else 0.0
+
+    def claim(self, key: int) -> Tuple[Future, bool]:
+        """
+        Finds the closest near-duplicate not known to have failed, or registers the image as the one to be sent.
+
+        :param key: The image's perceptual hash.
+        :return: The Future of the near-duplicate's labels, or of the image's own along with True if its labels must
+                 be requested (and the Future resolved).
+        """
+        with self.lock:
+            for _, future in self.tree.find(key, self.distance):
+                if not _failed(future):
+                    return future, False
+            future = Future()
+            self.tree.add(key, future)
+            return future, True
+
+    def _resolve(self, future: Future, labels: Optional[List[str]]) -> None:
+        future.set_result(labels)
+        if labels is not None:
+            with self.lock:
+                self.requested += 1
+
+    def _reused(self, labels: List[str]) -> Tuple[List[str], bool]:
+        with self.lock:
+            self.reused += 1
+        return labels, True
+
+    def labels(self, key: int, annotate: Callable[[], List[str]]) -> Tuple[List[str], bool]:
+        """
+        Returns a near-duplicate's labels, waiting for them if they are still being requested, or requests the image's
+        own labels if it has no near-duplicate.
+
+        :param key: The image's perceptual hash.
+        :param annotate: Requests the image's labels from the Vision API.
+        :return: The image's labels, and whether they were a near-duplicate's.
+        """
+        while True:
+            future, owned = self.claim(key)
+            if owned:
+                labels = None
+                try:
+                    labels = annotate()
+                    return labels, False
+                finally:
+                    self._resolve(future, labels)
+
+            labels = future.result()
+            if labels is not None:
+                return self._reused(labels)
+
+    async def labels_async(self, key: int, annotate: Callable[[], Awaitable[List[str]]]) -> Tuple[List[str], bool]:
+        """
+        labels(), awaiting a near-duplicate's labels instead of blocking the event loop.
+        """
+        while True:
+            future, owned = self.claim(key)
+            if owned:
+                labels = None
+                try:
+                    labels = await annotate()
+                    return labels, False
+                finally:
+                    self._resolve(future, labels)
+
+            labels = await asyncio.wrap_future(future)
+            if labels is not None:
+                return self._reused(labels)
+
+    def summary(self) -> str:
+        return (f'Reused near-duplicate labels for {self.reused} of {self.requested + self.reused} images '
+                f'({self.rate:.0%}), saving {self.reused} API calls.')
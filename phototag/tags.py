@@ -1,8 +1,8 @@
 from abc import ABC
 from pathlib import Path
-from typing import List, Set
+from typing import Dict, List, Set
 
-import iptcinfo3
+from phototag import iptc, xmp
 
 
 class Tagger(ABC):
@@ -12,91 +12,131 @@ class Tagger(ABC):
 
     def __init__(self, path: Path) -> None:
         self.path = path
-        self.__saved = True
-        self.__current_tags = set(self.__load())
+        self.written = False  # Whether the last save changed the file
+        self._saved = True
+        self._loaded = self._load()  # The tags on the filesystem, in order
+        self._current_tags: Dict[str, None] = dict.fromkeys(self._loaded)  # An ordered set, in the order added
 
     @property
     def current_tags(self) -> Set[str]:
         """The current tags in the tagger instance"""
-        return self.__current_tags
+        return set(self._current_tags)
+
+    @property
+    def tags(self) -> List[str]:
+        """The tags on the filesystem, in order, as of the last load or save"""
+        return list(self._loaded)
 
     @property
     def saved(self) -> bool:
         """Whether the current tags have been saved to the filesystem"""
-        return self.__saved
+        return self._saved
 
     def reload(self) -> None:
         """
         Reloads the tags from the filesystem. Discards any unsaved changes.
         """
-        self.__current_tags = set(self.__load())
-        self.__saved = True
+        self._loaded = self._load()
+        self._current_tags = dict.fromkeys(self._loaded)
+        self._saved = True
 
     def save(self) -> None:
         """
-        Saves the current tags to the filesystem.
-        """
-        self.save()
-        self.__saved = True
+        Saves the current tags to the filesystem, unless they are unchanged.
+        Tags already on the filesystem keep their order, new tags follow in the order they were added (for labels,
+        by relevance).
+        """
+        self.written = False
+        if not self._saved:
+            tags = [tag for tag in dict.fromkeys(self._loaded) if tag in self._current_tags]
+            kept = set(tags)
+            tags += [tag for tag in self._current_tags if tag not in kept]
+            if tags != self._loaded:
+                self._save(tags)
+                self.written = True
+            self._loaded = tags
+        self._saved = True
 
     def add(self, tag: str) -> None:
         """
         Adds a tag to the tagger
         :param tag: The tag to add
         """
-        self.__current_tags.add(tag)
+        self._current_tags[tag] = None
+        self._saved = False
 
     def remove(self, tag: str) -> None:
         """
         Removes a tag from the tagger
         :param tag: The tag to remove
         """
-        self.__current_tags.remove(tag)
+        del self._current_tags[tag]
+        self._saved = False
 
     def clear(self) -> None:
         """
         Clears all current tags
         """
-        self.__current_tags.clear()
+        self._current_tags.clear()
+        self._saved = False
 
     def extend(self, tags: List[str]) -> None:
         """
         Extends the current tags with a list of tags
         :param tags: The tags to add
         """
-        self.__current_tags.update(tags)
+        self._current_tags.update(dict.fromkeys(tags))
+        self._saved = False
 
-    def __load(self) -> List[str]:
+    def _load(self) -> List[str]:
         """
         Filesystem loading implementation.
         """
         raise NotImplementedError()
 
-    def __save(self) -> None:
+    def _save(self, tags: List[str]) -> None:
         """
         Filesystem saving implementation
+        :param tags: The tags to save, in order
         """
         raise NotImplementedError()
 
 
 class IPTCTagger(Tagger):
-    def __init__(self, path: Path) -> None:
-        super().__init__(path)
-
-        self.iptc = iptcinfo3.IPTCInfo(str(path))
+    """
+    Tags JPEG files through their IPTC keywords, rewriting only the metadata at the head of the file.
+    """
 
-    def __load(self) -> List[str]:
+    def _load(self) -> List[str]:
         """
         Loads the tags from the filesystem
         :return: The tags
         """
-        return self.iptc['keywords']
+        return iptc.read_keywords(str(self.path))
 
-    def __save(self) -> None:
+    def _save(self, tags: List[str]) -> None:
         """
         Saves the tags to the filesystem
+        :param tags: The tags to save, in order
+        """
+        iptc.write_keywords(str(self.path), tags)
+
+
+class XMPTagger(Tagger):
+    """
+    Tags files through the dc:subject keywords of an XMP sidecar.
+    """
+
+    def _load(self) -> List[str]:
         """
-        self.iptc['keywords'] = list(self.__current_tags)
-        self.iptc.save()
+        Loads the tags from the filesystem, parsing no further than the dc:subject bag
+        :return: The tags
+        """
+        return xmp.read_keywords(str(self.path))
 
-# TODO: XMPTagger implementation
+    def _save(self, tags: List[str]) -> None:
+        """
+        Saves the tags to the filesystem
+        :param tags: The tags to save, in order
+        """
+        xmp.write_keywords(str(self.path), tags)
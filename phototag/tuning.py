@@ -0,0 +1,136 @@
+"""
+tuning.py
+
+Picks the image count & buffer size limits of a run from the host's resources (CPUs & available memory) and from a
+short calibration: a few of the selected files are thumbnailed up front, measuring the CPU time & memory each takes.
+"""
+
+import logging
+import math
+import os
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Union
+
+from phototag.decode import thumbnail, estimate_memory
+from phototag.helpers import ScanEntry
+
+logger = logging.getLogger(__name__)
+
+AUTO = "auto"
+
+CALIBRATION_FILES: int = 4
+# The share of available memory decoded images may take up, leaving the rest to the interpreter & the OS
+MEMORY_FRACTION: float = 0.5
+# Assumed Vision API round trip, during which a file's thread waits without using a CPU
+ASSUMED_LATENCY: float = 0.5
+MAX_IMAGE_COUNT: int = 256
+# Used when nothing can be calibrated (e.g. when streaming)
+DEFAULT_SECONDS: float = 0.1
+DEFAULT_MEMORY: int = 64 * 1024 ** 2
+
+
+class Calibration(NamedTuple):
+    """The cost of processing a file, measured on a sample of the selected files."""
+    seconds: float  # Median time taken to decode & encode a file
+    memory: int  # Largest estimated decoded memory of a file
+    files: int  # The number of files sampled
+
+
+class Limits(NamedTuple):
+    """The limits a MasterFileProcessor is created with."""
+    image_count: int
+    buffer_size: int
+
+
+def cpu_count() -> int:
+    """
+    :return: The number of CPUs this process may run on.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS & Windows
+        return os.cpu_count() or 1
+
+
+def available_memory() -> Optional[int]:
+    """
+    :return: The memory available to new processes without swapping, in bytes, or None if unknown.
+    """
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _sample(files: Sequence[Union[Path, ScanEntry]], count: int) -> List[Union[Path, ScanEntry]]:
+    """
+    :return: Up to `count` files spread evenly through the selection, so that a single directory is not
+             over-represented.
+    """
+    if len(files) <= count:
+        return list(files)
+    step = len(files) / count
+    return [files[int(index * step)] for index in range(count)]
+
+
+def calibrate(files: Sequence[Union[Path, ScanEntry]], raw_mode: str = "full", decoder: str = "auto",
+              count: int = CALIBRATION_FILES) -> Optional[Calibration]:
+    """
+    Thumbnails a sample of the files, measuring the time & memory processing them takes.
+
+    :param files: The files selected for processing.
+    :param raw_mode: The RAW decoding mode that will be used.
+    :param decoder: The decode backend that will be used.
+    :param count: The number of files sampled.
+    :return: The costs measured, or None if no file could be thumbnailed.
+    """
+    seconds, memory = [], []
+    for item in _sample(files, count):
+        path = str(item.path if isinstance(item, ScanEntry) else item)
+        try:
+            start = time.perf_counter()
+            thumbnail(path, raw_mode=raw_mode, backend=decoder)
+            seconds.append(time.perf_counter() - start)
+            memory.append(estimate_memory(path, raw_mode=raw_mode))
+        except Exception as error:
+            logger.debug(f'Could not calibrate with "{path}": {error}')
+    if not seconds:
+        return None
+    return Calibration(sorted(seconds)[len(seconds) // 2], max(memory), len(seconds))
+
+
+def tune(calibration: Optional[Calibration], cpus: Optional[int] = None, memory: Optional[int] = None,
+         latency: float = ASSUMED_LATENCY) -> Limits:
+    """
+    Picks limits keeping every CPU busy while staying within the memory available.
+
+    Each file spends `calibration.seconds` on a CPU and about `latency` waiting on the Vision API, so keeping every CPU
+    busy takes cpus * (1 + latency / seconds) files in flight. The buffer holds that many of the largest files sampled,
+    capped to MEMORY_FRACTION of the memory available.
+
+    :param calibration: The costs measured by calibrate(), or None to assume defaults.
+    :param cpus: The number of CPUs, read from the host if not given.
+    :param memory: The memory available in bytes, read from the host if not given.
+    :param latency: The expected Vision API round trip, in seconds.
+    :return: The image count & buffer size to use.
+    """
+    cpus = cpus or cpu_count()
+    memory = memory if memory is not None else available_memory()
+    seconds = calibration.seconds if calibration is not None else DEFAULT_SECONDS
+    file_memory = calibration.memory if calibration is not None else DEFAULT_MEMORY
+
+    image_count = min(MAX_IMAGE_COUNT, max(cpus, math.ceil(cpus * (1 + latency / max(seconds, 0.001)))))
+    buffer_size = image_count * file_memory
+    if memory is not None:
+        # At least a single file is always let through (see single_override)
+        buffer_size = max(file_memory, min(buffer_size, int(memory * MEMORY_FRACTION)))
+        image_count = max(1, min(image_count, buffer_size // max(file_memory, 1)))
+    return Limits(image_count, buffer_size)
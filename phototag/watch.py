@@ -0,0 +1,169 @@
+"""
+watch.py
+
+Watches a (hot) folder for images that are new or changed, handing each one over once it has stopped being written,
+so that a single long-lived process (one Vision API client, one warm decode pool) tags files as they land.
+"""
+
+import logging
+import os
+import time
+from pathlib import Path
+from threading import Event, Lock
+from typing import Callable, Dict, Generator, List, Optional, Set, Tuple
+
+from phototag.constants import RAW_EXTS
+from phototag.helpers import ScanEntry, get_extension, scan, valid_extension
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL: float = 1.0  # Seconds between scans
+DEFAULT_SETTLE: float = 2.0  # Seconds a file must go unchanged before it is considered fully written
+DEFAULT_RETRY: float = 30.0  # Seconds before a file that failed is tried again, doubling with each failure
+MAX_RETRY: float = 60 * 60.0
+
+# The size & modification time of an image, and of its XMP sidecar for RAW files
+State = Tuple[int, int, Optional[Tuple[int, int]]]
+
+
+class Watcher(object):
+    """
+    Finds images that are new or changed since they were last handed over, by comparing the size & modification time
+    of every file between scans of the folder.
+
+    A file is handed over once its state held for `settle` seconds, so files still being copied or uploaded are left
+    alone. RAW files are tagged through their XMP sidecars, so they wait for theirs to arrive, however late, and a
+    change to the sidecar alone counts as a change to the RAW file. Files are remembered as they are after tagging, so
+    that tagging them does not hand them over again; files that failed are handed over again after a backoff.
+    """
+
+    def __init__(self, root: Path, depth: Optional[int] = 1, interval: float = DEFAULT_INTERVAL,
+                 settle: float = DEFAULT_SETTLE, skip_existing: bool = False,
+                 handled: Optional[Callable[[ScanEntry], bool]] = None, retry: float = DEFAULT_RETRY):
+        """
+        :param root: The folder watched.
+        :param depth: The number of directory levels watched, the root being the first. Infinite if None or negative.
+        :param interval: Seconds between scans.
+        :param settle: Seconds a file's size & modification time must hold before it is handed over.
+        :param skip_existing: If true, the files present when watching starts are not handed over unless they change.
+        :param handled: Tells whether a file seen for the first time was already tagged (e.g. by a previous run).
+        :param retry: Seconds before a file that failed settles again, doubled with each consecutive failure.
+        """
+        self.root, self.depth, self.interval, self.settle = root, depth, interval, settle
+        self.handled, self.retry = handled, retry
+        self.known: Dict[Path, State] = {}  # The state of each file as of when it was last handled
+        self.settling: Dict[Path, Tuple[State, float]] = {}  # Files changed, with their state & since when it held
+        self.inflight: Set[Path] = set()  # Files handed over & not yet done
+        self.failed: Dict[Path, Tuple[int, float]] = {}  # Files that failed, with their failure count & retry time
+        self.lock = Lock()
+        self.stopped = Event()
+        self.scans = 0
+
+        if skip_existing:
+            for path, (entry, sidecar) in self._scan().items():
+                self.known[path] = (entry.size, entry.mtime_ns, sidecar)
+
+    def _scan(self) -> Dict[Path, Tuple[ScanEntry, Optional[Tuple[int, int]]]]:
+        """
+        :return: Every image in the folder along with the state of its sidecar, for RAW files that have one.
+        """
+        entries = {entry.path: entry for entry in scan(self.root, depth=self.depth)}
+        self.scans += 1
+        images = {}
+        for path, entry in entries.items():
+            extension = get_extension(path.name).lower()
+            if not valid_extension(extension):
+                continue
+            sidecar = None
+            if extension in RAW_EXTS:
+                xmp = entries.get(path.with_suffix(".xmp"))
+                if xmp is None:
+                    continue  # Not ready until its sidecar arrives
+                sidecar = (xmp.size, xmp.mtime_ns)
+            images[path] = (entry, sidecar)
+        return images
+
+    def poll(self) -> List[ScanEntry]:
+        """
+        Scans the folder once.
+
+        :return: The files that changed & have since settled, now handed over.
+        """
+        now = time.monotonic()
+        images = self._scan()
+        ready = []
+        with self.lock:
+            for path, (entry, sidecar) in images.items():
+                state = (entry.size, entry.mtime_ns, sidecar)
+                if path in self.inflight or self.known.get(path) == state:
+                    self.settling.pop(path, None)
+                    continue
+                if path in self.failed and now < self.failed[path][1]:
+                    continue  # Backing off
+                if path not in self.known and path not in self.settling and self.handled is not None \
+                        and self.handled(entry):
+                    self.known[path] = state
+                    continue
+
+                previous = self.settling.get(path)
+                if previous is None or previous[0] != state:
+                    self.settling[path] = (state, now)  # New, or still being written
+                elif now - previous[1] >= self.settle:
+                    del self.settling[path]
+                    self.inflight.add(path)
+                    ready.append(entry)
+
+            # Forget files that were deleted (or moved away)
+            for files in (self.known, self.settling, self.failed):
+                for path in [path for path in files if path not in images]:
+                    del files[path]
+        return ready
+
+    def done(self, path: Path, succeeded: bool = True) -> None:
+        """
+        Remembers a file handed over as it is now, after tagging, so that it is only handed over again if it changes.
+        Files that failed are not remembered, but settle again once their backoff has passed.
+
+        :param path: The path of the file, as handed over.
+        :param succeeded: Whether tagging the file succeeded.
+        """
+        if not succeeded:
+            with self.lock:
+                self.inflight.discard(path)
+                failures = self.failed[path][0] + 1 if path in self.failed else 1
+                delay = min(MAX_RETRY, self.retry * 2 ** (failures - 1))
+                self.failed[path] = (failures, time.monotonic() + delay)
+            logger.info(f'Retrying "{path}" in {delay:g}s.')
+            return
+
+        try:
+            stat = os.stat(path)
+            sidecar = None
+            if get_extension(path.name).lower() in RAW_EXTS:
+                xmp = os.stat(path.with_suffix(".xmp"))
+                sidecar = (xmp.st_size, xmp.st_mtime_ns)
+            state = (stat.st_size, stat.st_mtime_ns, sidecar)
+        except FileNotFoundError:
+            state = None
+        with self.lock:
+            self.inflight.discard(path)
+            self.failed.pop(path, None)
+            if state is not None:
+                self.known[path] = state
+
+    def files(self) -> Generator[ScanEntry, None, None]:
+        """
+        Scans the folder every interval until stopped, for MasterFileProcessor to stream.
+
+        :return: A generator of the files handed over, as they settle.
+        """
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            yield from self.poll()
+            self.stopped.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def stop(self) -> None:
+        """
+        Stops scanning; files already handed over are still processed.
+        """
+        self.stopped.set()
@@ -0,0 +1,248 @@
+"""
+workqueue.py
+
+A lease-based work queue letting several runs (on one or many hosts) tag the same library together, stored in a
+SQLite file on the library's own shared storage.
+
+Every run adds the files it selected (adding is idempotent), then claims them a batch at a time. Claims are leases:
+a background thread renews them while the run is alive, and once a run stops renewing (it crashed, or its host went
+away), its leases expire and the files are claimed by another run.
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Dict, Generator, Iterable, Iterator, List, Optional, Set, Union
+
+from phototag.helpers import ScanEntry, library_key
+
+logger = logging.getLogger(__name__)
+
+# The states a file in the queue goes through
+PENDING, LEASED, DONE, FAILED = 0, 1, 2, 3
+STATES = {PENDING: "pending", LEASED: "leased", DONE: "done", FAILED: "failed"}
+
+DEFAULT_LEASE: float = 120.0  # Seconds a claim lasts without being renewed; hosts' clocks must agree within this
+DEFAULT_CLAIM_SIZE: int = 16
+# Claims a file may go through before it is given up on; files crashing every run that claims them end up failed
+MAX_ATTEMPTS: int = 3
+ADD_CHUNK: int = 1000  # Files added per transaction
+
+
+class WorkQueue(object):
+    """
+    Hands out the files of a shared library to the runs tagging it, each file to a single run at a time.
+
+    The database uses SQLite's default rollback journal, as WAL mode relies on shared memory that network filesystems
+    do not provide; every change is a short IMMEDIATE transaction, so runs only ever wait on each other briefly.
+    """
+
+    def __init__(self, path: str, worker: Optional[str] = None, lease: float = DEFAULT_LEASE,
+                 claim_size: int = DEFAULT_CLAIM_SIZE, max_attempts: int = MAX_ATTEMPTS):
+        """
+        Opens (or creates) a work queue.
+
+        :param path: The path of the SQLite database file, on storage every run can reach.
+        :param worker: The name claims are made under; unique to this process by default.
+        :param lease: Seconds a claim lasts without being renewed. Renewed every third of that while running.
+        :param claim_size: The number of files claimed at once.
+        :param max_attempts: The number of claims a file may go through before it is marked failed.
+        """
+        self.path, self.lease, self.claim_size, self.max_attempts = path, lease, claim_size, max_attempts
+        self.worker = worker or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.held: Set[str] = set()  # Files claimed by this worker & not yet completed
+        self.claimed, self.reclaimed, self.completed = 0, 0, 0
+        self.lock = Lock()
+        self.stopped = Event()
+        self.heartbeat: Optional[Thread] = None
+
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                state INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS files_state ON files (state, expires);
+        """)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Runs the block in a write transaction, taken up front so that concurrent claims cannot interleave.
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def add(self, files: Iterable[Union[Path, ScanEntry]]) -> int:
+        """
+        Adds files to the queue, ignoring those already in it (whatever their state).
+
+        :param files: The files (or ScanEntry objects) to add, relative to the library (the current directory).
+        :return: The number of files newly added.
+        """
+        added, chunk = 0, []
+        for item in files:
+            chunk.append((library_key(item.path if isinstance(item, ScanEntry) else item),))
+            if len(chunk) >= ADD_CHUNK:
+                added += self._add(chunk)
+                chunk = []
+        return added + (self._add(chunk) if chunk else 0)
+
+    def _add(self, rows: List[tuple]) -> int:
+        with self._transaction() as cursor:
+            before = self.connection.total_changes
+            cursor.executemany("INSERT OR IGNORE INTO files (path) VALUES (?)", rows)
+            return self.connection.total_changes - before
+
+    def claim(self, count: Optional[int] = None) -> List[str]:
+        """
+        Leases pending files, or files whose lease expired (their worker having died), to this worker.
+
+        :param count: The most files claimed, claim_size by default.
+        :return: The files claimed, relative to the library. Empty if there is nothing to claim right now.
+        """
+        count = count if count is not None else self.claim_size
+        now = time.time()
+        with self._transaction() as cursor:
+            # Files that took down every worker claiming them are not handed out again
+            cursor.execute("UPDATE files SET state = ?, owner = NULL WHERE state = ? AND expires < ? AND attempts >= ?",
+                           (FAILED, LEASED, now, self.max_attempts))
+            pending = [path for path, in cursor.execute(
+                "SELECT path FROM files WHERE state = ? ORDER BY rowid LIMIT ?", (PENDING, count))]
+            expired = [path for path, in cursor.execute(
+                "SELECT path FROM files WHERE state = ? AND expires < ? LIMIT ?",
+                (LEASED, now, count - len(pending)))] if len(pending) < count else []
+            claimed = pending + expired
+            cursor.executemany("UPDATE files SET state = ?, owner = ?, expires = ?, attempts = attempts + 1 "
+                               "WHERE path = ?", [(LEASED, self.worker, now + self.lease, path) for path in claimed])
+
+        if expired:
+            logger.info(f'Reclaimed {len(expired)} files whose lease expired.')
+        self.held.update(claimed)
+        self.claimed += len(claimed)
+        self.reclaimed += len(expired)
+        self._start_heartbeat()
+        return claimed
+
+    def renew(self) -> int:
+        """
+        Extends the lease on every file this worker holds.
+
+        :return: The number of leases renewed.
+        """
+        with self._transaction() as cursor:
+            return cursor.execute("UPDATE files SET expires = ? WHERE owner = ? AND state = ?",
+                                  (time.time() + self.lease, self.worker, LEASED)).rowcount
+
+    def complete(self, path: Union[str, Path], succeeded: bool = True) -> None:
+        """
+        Marks a claimed file as done (or failed), so that no other worker claims it.
+
+        :param path: The file, as claimed or relative to the library.
+        :param succeeded: Whether the file was processed successfully.
+        """
+        key = library_key(Path(path))
+        with self._transaction() as cursor:
+            updated = cursor.execute("UPDATE files SET state = ?, owner = NULL, expires = NULL "
+                                     "WHERE path = ? AND owner = ?", (DONE if succeeded else FAILED, key,
+                                                                      self.worker)).rowcount
+        if not updated:
+            # Renewals fell behind (e.g. a long pause) and another worker claimed it; tagging twice is harmless
+            logger.warning(f'"{key}" was completed after its lease had been taken over.')
+        self.held.discard(key)
+        self.completed += 1
+
+    def release(self) -> int:
+        """
+        Hands the files this worker claimed but did not complete back to the queue, without counting the claim.
+
+        :return: The number of files released.
+        """
+        with self._transaction() as cursor:
+            released = cursor.execute("UPDATE files SET state = ?, owner = NULL, expires = NULL, "
+                                      "attempts = MAX(attempts - 1, 0) WHERE owner = ? AND state = ?",
+                                      (PENDING, self.worker, LEASED)).rowcount
+        self.held.clear()
+        return released
+
+    def outstanding(self) -> int:
+        """
+        :return: The number of files pending, or leased to other workers (which may yet die).
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM files WHERE state = ? OR (state = ? AND owner != ?)",
+                (PENDING, LEASED, self.worker)).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: The number of files in each state.
+        """
+        with self.lock:
+            counts = dict(self.connection.execute("SELECT state, COUNT(*) FROM files GROUP BY state").fetchall())
+        return {name: counts.get(state, 0) for state, name in STATES.items()}
+
+    def files(self, poll: Optional[float] = None) -> Generator[Path, None, None]:
+        """
+        Claims files a batch at a time as they are pulled, for MasterFileProcessor to stream.
+
+        Once nothing is left to claim, other workers' leases are waited on (polling) until they either finish or
+        expire and are reclaimed, so that no file is left behind by a worker that died.
+
+        :param poll: Seconds between checks for expired leases; a quarter of the lease by default.
+        :return: A generator of the files claimed, relative to the library.
+        """
+        poll = poll if poll is not None else self.lease / 4
+        while not self.stopped.is_set():
+            claimed = self.claim()
+            if claimed:
+                yield from (Path(path) for path in claimed)
+            elif self.outstanding():
+                self.stopped.wait(poll)
+            else:
+                return
+
+    def _start_heartbeat(self) -> None:
+        if self.heartbeat is None:
+            self.heartbeat = Thread(name='Lease', target=self._renew_leases, daemon=True)
+            self.heartbeat.start()
+
+    def _renew_leases(self) -> None:
+        """
+        Renews this worker's leases every third of the lease, until closed.
+        """
+        while not self.stopped.wait(self.lease / 3):
+            if self.held:
+                try:
+                    self.renew()
+                except sqlite3.Error as error:
+                    logger.warning(f'Could not renew leases: {error}')
+
+    def close(self) -> None:
+        """
+        Stops renewing leases, hands back files claimed but not completed, and closes the database connection.
+        """
+        self.stopped.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+        released = self.release()
+        if released:
+            logger.info(f'Released {released} unfinished files back to the work queue.')
+        with self.lock:
+            self.connection.close()
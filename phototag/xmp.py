@@ -1,10 +1,21 @@
 """
 xmp.py
 
-Holds a helper class for working with .xmp files and adding keywords to the file.
+Holds helpers for reading & writing the keywords (dc:subject) of .xmp sidecar files, and an older helper class for
+adding keywords to them.
 """
 
+import logging
+import os
+import shutil
+import tempfile
 import xml.etree.ElementTree as ET
+from threading import Lock
+from typing import List, Tuple
+
+from phototag.exceptions import MetadataError
+
+logger = logging.getLogger(__name__)
 
 # Constant Namespace Types
 RDF = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}RDF"
@@ -15,6 +26,92 @@ ALT = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Alt"
 LI = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}li"
 BAG = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Bag"
 
+# ElementTree's namespace prefixes are global, so registering a file's own & serializing with them go together
+_namespaces = Lock()
+
+
+def read_keywords(path: str) -> List[str]:
+    """
+    Reads the keywords of a sidecar, parsing no further than the end of its dc:subject bag.
+
+    :param path: The path of the .xmp file.
+    :return: The keywords, in order.
+    """
+    try:
+        for _, element in ET.iterparse(path, events=("end",)):
+            if element.tag == SUBJECT:
+                return [item.text or "" for item in element.iter(LI)]
+    except ET.ParseError as error:
+        raise MetadataError(f'Could not parse "{path}": {error}')
+    return []
+
+
+def _parse(path: str) -> Tuple[ET.ElementTree, List[Tuple[str, str]]]:
+    """
+    :param path: The path of the .xmp file.
+    :return: The parsed file, and the namespace prefixes it declares.
+    """
+    namespaces = []
+    try:
+        parser = ET.iterparse(path, events=("start-ns",))
+        for _, namespace in parser:
+            namespaces.append(namespace)
+    except ET.ParseError as error:
+        raise MetadataError(f'Could not parse "{path}": {error}')
+    return ET.ElementTree(parser.root), namespaces
+
+
+def write_keywords(path: str, keywords: List[str]) -> None:
+    """
+    Replaces the keywords of a sidecar. The file is written to a temporary file first, which then replaces the
+    original atomically, keeping its stat metadata.
+
+    :param path: The path of the .xmp file.
+    :param keywords: The keywords to write, in order.
+    """
+    tree, namespaces = _parse(path)
+    descriptions = list(tree.getroot().iter(DESCRIPTION))
+    if not descriptions:
+        raise MetadataError(f'"{path}" holds no rdf:Description to add keywords to.')
+
+    subject = next((subject for description in descriptions for subject in description.iter(SUBJECT)), None)
+    if subject is None:
+        subject = ET.SubElement(descriptions[0], SUBJECT)
+    bag = subject.find(BAG)
+    if bag is None:
+        for item in list(subject):
+            subject.remove(item)
+        bag = ET.SubElement(subject, BAG)
+
+    # Reuse the existing indentation, if any
+    items = list(bag)
+    indent, closing = bag.text, items[-1].tail if items else None
+    for item in items:
+        bag.remove(item)
+    for keyword in keywords:
+        ET.SubElement(bag, LI).text = keyword
+        bag[-1].tail = indent
+    if len(bag):
+        bag[-1].tail = closing
+
+    with open(path, "rb") as file:
+        declaration = file.read(5) == b"<?xml"
+
+    head, tail = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{tail}.", suffix=".tmp", dir=head or None)
+    try:
+        with os.fdopen(fd, "wb") as file, _namespaces:
+            for prefix, uri in namespaces:
+                if prefix:  # Keep the file's own prefixes, instead of ns0, ns1...
+                    ET.register_namespace(prefix, uri)
+            tree.write(file, encoding="utf-8", xml_declaration=declaration)
+        shutil.copystat(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    logger.debug(f'Wrote {len(keywords)} keywords to "{path}".')
+
 
 class XMPParser(object):
     def __init__(self, path):
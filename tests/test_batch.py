@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Callable
+
+import pytest
+from google.cloud import vision
+
+from phototag.annotate import BatchAnnotator, FakeImageAnnotatorClient, labels_from_response
+from phototag.exceptions import AnnotationError
+
+echo: Callable[[bytes], List[str]] = lambda content: [content.decode()]
+
+
+def label_all(annotator, contents: List[bytes]) -> List[List[str]]:
+    """
+    Labels every image from its own thread, like FileProcessors would
+    """
+    with ThreadPoolExecutor(max_workers=len(contents)) as pool:
+        return list(pool.map(
+            lambda content: labels_from_response(annotator.label_detection(image=vision.Image(content=content))),
+            contents
+        ))
+
+
+def test_fan_out():
+    client = FakeImageAnnotatorClient(labeler=echo)
+    annotator = BatchAnnotator(client, max_images=16, max_delay=0.5)
+    contents = [f'image-{index}'.encode() for index in range(40)]
+
+    assert label_all(annotator, contents) == [[content.decode()] for content in contents]
+    annotator.close()
+
+    assert client.images == 40
+    assert client.requests == annotator.requests == 3, 'Full batches are sent without waiting for the delay'
+    assert annotator.efficiency > 13
+
+
+def test_byte_limit():
+    client = FakeImageAnnotatorClient(labeler=echo)
+    annotator = BatchAnnotator(client, max_bytes=10, max_delay=0.5)
+    label_all(annotator, [b'1234'] * 6)
+    annotator.close()
+
+    assert client.requests == 3, 'No more than two 4 byte images fit in 10 bytes'
+
+
+def test_time_trigger():
+    client = FakeImageAnnotatorClient(labeler=echo)
+    annotator = BatchAnnotator(client, max_delay=0.01)
+
+    assert labels_from_response(annotator.label_detection(image=vision.Image(content=b'lonely'))) == ['lonely']
+    annotator.close()
+    assert client.requests == 1
+
+
+class ShortClient(FakeImageAnnotatorClient):
+    """
+    Answers for all but the last image of every batch
+    """
+
+    def batch_annotate_images(self, requests, timeout=None, **kwargs):
+        return self._respond(requests[:-1])
+
+
+def test_short_response():
+    annotator = BatchAnnotator(ShortClient(labeler=echo), max_images=2, max_delay=0.5, timeout=5)
+    first, second = annotator.submit(b'first'), annotator.submit(b'second')
+    assert labels_from_response(first.result(timeout=5)) == ['first']
+    with pytest.raises(AnnotationError):
+        second.result(timeout=5)
+    annotator.close()
@@ -0,0 +1,40 @@
+import hashlib
+import os
+from pathlib import Path
+
+from phototag.cache import LabelCache, file_digest
+
+
+def test_file_digest(tmp_path: Path):
+    path = tmp_path / 'data.bin'
+    content = os.urandom(3 * 1024 + 17)
+    path.write_bytes(content)
+
+    assert file_digest(str(path), chunk_size=1024) == hashlib.sha256(content).hexdigest()
+
+
+def test_get_put(tmp_path: Path):
+    cache = LabelCache(str(tmp_path / 'labels.sqlite'))
+    assert cache.get('a') is None
+    cache.put('a', ['Sky', 'Cloud'])
+    assert cache.get('a') == ['Sky', 'Cloud']
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    # Entries persist across instances, but are ignored when forgetting
+    assert LabelCache(str(tmp_path / 'labels.sqlite')).get('a') == ['Sky', 'Cloud']
+    assert LabelCache(str(tmp_path / 'labels.sqlite'), write_only=True).get('a') is None
+
+
+def test_eviction(tmp_path: Path):
+    cache = LabelCache(str(tmp_path / 'labels.sqlite'), max_size=200)
+    for index in range(10):
+        cache.put(f'digest-{index}', ['label'] * 3)
+        cache.get('digest-0')  # Keep the first entry recently used
+
+    assert cache.size <= 200
+    assert cache.get('digest-0') is not None, 'Recently used entries survive'
+    assert cache.get('digest-1') is None, 'Least recently used entries are evicted'
+
+    expired = LabelCache(str(tmp_path / 'labels.sqlite'), max_age=-1)
+    assert expired.size == 0
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+
+# Imported by the commands needing them, never by merely importing the CLI
+HEAVY_MODULES = ['google.cloud.vision', 'rawpy', 'PIL', 'rich']
+
+
+def test_lazy_imports():
+    script = ("import sys, phototag.cli, phototag.config; "
+              "print([module for module in sys.argv[1:] if module in sys.modules]); "
+              "print(phototag.config._config is None)")
+    result = subprocess.run([sys.executable, '-c', script, *HEAVY_MODULES], capture_output=True, text=True, check=True)
+    imported, unread = result.stdout.splitlines()
+    assert imported == '[]', f'Imported by phototag.cli: {imported}'
+    assert unread == 'True', 'The configuration is read on first use'
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from PIL import Image
+
+from phototag import iptc
+from phototag.collect import collect, read_tags, TagCollection
+
+SIDECAR = """<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+   <dc:subject><rdf:Bag><rdf:li>sky</rdf:li><rdf:li>mountain</rdf:li></rdf:Bag></dc:subject>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+def test_collect(tmp_path: Path):
+    jpegs = [tmp_path / f'{index}.jpg' for index in range(4)]
+    for index, path in enumerate(jpegs):
+        Image.new('RGB', (32, 32)).save(path)
+        iptc.write_keywords(str(path), ['sky', 'sky', 'lake'] if index % 2 else ['sky', 'tree'])
+
+    raw = tmp_path / 'photo.nef'
+    raw.write_bytes(b'not read')
+    raw.with_suffix('.xmp').write_text(SIDECAR)
+    lonely = tmp_path / 'lonely.nef'
+    lonely.write_bytes(b'not read')
+    png = tmp_path / 'image.png'
+    Image.new('RGB', (32, 32)).save(png)
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not a jpeg')
+
+    assert read_tags(raw) == ['sky', 'mountain']
+    assert read_tags(lonely) == [] and read_tags(png) == []
+
+    collection = collect(iter(jpegs + [raw, lonely, png, broken]), workers=2)
+    assert (collection.files, collection.failed) == (7, 1)
+    assert collection.counts['sky'] == 5, 'Tags repeated within a file are counted once'
+    assert collection.frequent(0.5) == [('sky', 5)]
+    assert collection.frequent(0.25) == [('sky', 5), ('lake', 2), ('tree', 2)]
+
+
+def test_frequent_empty():
+    assert TagCollection().frequent(0.5) == []
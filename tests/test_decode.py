@@ -0,0 +1,131 @@
+import io
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from phototag import backends
+from phototag.backends import PillowBackend, TurboJPEGBackend, select_backend, get_backend, target_size
+from phototag.decode import thumbnail, create_pool, encode, encode_to_budget, DecodeReport, SOURCE_LOSSY, \
+    MAX_ENCODES, MIN_DIMENSION
+from phototag.exceptions import InvalidConfigurationError
+
+
+@pytest.fixture()
+def tmp_images(tmp_path: Path):
+    """
+    Creates a large JPEG and a large RGBA PNG to be thumbnailed
+    """
+    jpeg, png = tmp_path / 'large.jpeg', tmp_path / 'large.png'
+    Image.new('RGB', (2048, 1536), color=(200, 30, 30)).save(jpeg, format='jpeg')
+    Image.new('RGBA', (1536, 2048), color=(30, 200, 30, 128)).save(png, format='png')
+    return jpeg, png
+
+
+def test_thumbnail(tmp_images):
+    jpeg, png = tmp_images
+
+    result = thumbnail(str(jpeg), raw_mode='preview')
+    assert result.source == SOURCE_LOSSY, 'RAW modes do not apply to lossy images'
+    with Image.open(io.BytesIO(result.content)) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (512, 384)
+
+    with Image.open(io.BytesIO(thumbnail(str(png), size=(256, 256)).content)) as image:
+        assert image.format == 'JPEG', 'RGBA images are converted before encoding'
+        assert image.size == (192, 256)
+
+
+def test_thumbnail_pool(tmp_images):
+    with create_pool(2) as pool:
+        results = list(pool.map(thumbnail, map(str, tmp_images)))
+
+    assert all(result.content[:2] == b'\xff\xd8' for result in results)
+
+
+def test_report():
+    report = DecodeReport()
+    for extension, source in [('NEF', 'preview'), ('nef', 'preview'), ('nef', 'half-size'), ('jpg', 'lossy')]:
+        report.record(extension, source)
+
+    assert report.summary() == ['JPG: 1 lossy', 'NEF: 1 half-size, 2 preview']
+
+    report.record('jpg', 'lossy', 40 * 1024)
+    report.record('jpg', 'lossy', 20 * 1024)
+    assert report.summary()[0] == 'JPG: 3 lossy (30.0 KB per thumbnail, 40.0 KB at most)'
+
+
+def test_pillow_backend(tmp_images, tmp_path: Path):
+    jpeg, png = tmp_images
+    backend = PillowBackend()
+
+    # DCT scaling decodes at the smallest scale still covering the thumbnail
+    with backend.open(str(jpeg), (512, 512)) as image:
+        assert image.size == (512, 384)
+    with backend.open(str(jpeg), (600, 600)) as image:
+        assert image.size == (1024, 768)
+    with backend.open(str(png), (256, 256)) as image:
+        assert image.size == (192, 256), 'PNGs are reduced by an integer factor'
+    with backend.open(str(png), (4096, 4096)) as image:
+        assert image.size == (1536, 2048), 'Images are never enlarged'
+
+    # Palette, bilevel & 16-bit PNGs are converted before being reduced
+    for mode in ['P', '1', 'I;16']:
+        path = tmp_path / f'{mode.replace(";", "")}.png'
+        Image.new(mode, (1024, 768)).save(path)
+        with backend.open(str(path), (256, 256)) as image:
+            assert image.size == (256, 192) and image.mode == 'RGB'
+
+    # Rotated 90 degrees by its EXIF orientation
+    rotated = tmp_path / 'rotated.jpeg'
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new('RGB', (2048, 1024)).save(rotated, format='jpeg', exif=exif)
+    with backend.open(str(rotated), (512, 512)) as image:
+        assert image.size == (256, 512)
+    with Image.open(io.BytesIO(thumbnail(str(rotated), backend='pillow').content)) as image:
+        assert image.size == (256, 512)
+
+
+def test_select_backend():
+    assert target_size(6000, 1000, (512, 512)) == (512, 86)
+    assert select_backend('png', 'pillow').name == 'pillow'
+    assert select_backend('jpg').name in ('vips', 'turbojpeg', 'pillow')
+    with pytest.raises(InvalidConfigurationError):
+        get_backend('unknown')
+
+
+def test_availability_cached(monkeypatch):
+    loads = []
+    monkeypatch.setattr(backends, 'turbojpeg', SimpleNamespace(TurboJPEG=lambda: loads.append(1)))
+    TurboJPEGBackend.available.cache_clear()
+    try:
+        assert all(TurboJPEGBackend.available() for _ in range(5))
+        assert len(loads) == 1, 'The shared library is loaded once, not for every image'
+    finally:
+        TurboJPEGBackend.available.cache_clear()
+
+
+def test_encode_to_budget():
+    noise = Image.effect_noise((512, 512), 64).convert('RGB')
+    full = len(encode(noise))
+
+    content, encodes = encode_to_budget(noise, full)
+    assert (len(content), encodes) == (full, 1), 'Thumbnails already within budget are encoded once'
+
+    # Fits by lowering quality alone
+    content, encodes = encode_to_budget(noise, full * 3 // 4)
+    assert len(content) <= full * 3 // 4 and encodes <= MAX_ENCODES
+    with Image.open(io.BytesIO(content)) as image:
+        assert image.size == (512, 512)
+
+    # Only fits once shrunk
+    content, encodes = encode_to_budget(noise, full // 8, optimize=False)
+    assert len(content) <= full // 8 and encodes <= MAX_ENCODES
+    with Image.open(io.BytesIO(content)) as image:
+        assert MIN_DIMENSION <= image.width < 512
+
+    # Impossible budgets return the smallest encoding found
+    content, encodes = encode_to_budget(noise, 100)
+    assert len(content) > 100 and encodes <= MAX_ENCODES
@@ -0,0 +1,57 @@
+from pathlib import Path
+from typing import List, Dict
+
+import pytest
+from PIL import Image
+
+from phototag.annotate import FakeImageAnnotatorAsyncClient
+from phototag.engine import AsyncMasterFileProcessor
+from phototag.process import FileProcessor
+
+
+@pytest.fixture()
+def tmp_images(tmp_path: Path) -> List[Path]:
+    """
+    Creates a handful of small JPEGs to be processed
+    """
+    paths = [tmp_path / f'{index}.jpg' for index in range(12)]
+    for index, path in enumerate(paths):
+        Image.new('RGB', (64 + index, 48), color=(index * 20, 0, 0)).save(path, format='jpeg')
+    return paths
+
+
+@pytest.fixture()
+def written(monkeypatch) -> Dict[str, List[str]]:
+    """
+    Records the labels each FileProcessor would write, instead of writing them
+    """
+    results: Dict[str, List[str]] = {}
+    monkeypatch.setattr(FileProcessor, 'write', lambda self, labels, cache=None, index=None: results.update({
+        self.file_path.name: labels
+    }))
+    return results
+
+
+def test_async_engine(tmp_images: List[Path], written: Dict[str, List[str]]):
+    client = FakeImageAnnotatorAsyncClient(latency=(0.01, 0.02), labeler=lambda content: [str(len(content))])
+    mp = AsyncMasterFileProcessor(tmp_images, 4, 10 ** 9, True, client=client)
+
+    concurrency: List[int] = []
+    pop = mp.waiting.pop
+    mp.waiting.pop = lambda: concurrency.append(mp.waiting.running_count) or pop()
+
+    mp.load()
+    mp.join()
+
+    assert mp.finished == len(tmp_images) and not mp.running and not mp.waiting
+    assert sorted(written.keys()) == sorted(path.name for path in tmp_images)
+    assert max(concurrency) <= 4, 'The image count limit is respected'
+    assert client.requests == len(tmp_images)
+
+
+def test_async_engine_single_override(tmp_images: List[Path], written: Dict[str, List[str]]):
+    mp = AsyncMasterFileProcessor(tmp_images, 4, 0, True, client=FakeImageAnnotatorAsyncClient())
+    mp.load()
+    mp.join()
+
+    assert len(written) == len(tmp_images), 'Files still complete one-by-one when none fit in the buffer'
@@ -0,0 +1,132 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from google.api_core import exceptions
+from google.cloud import vision
+
+from phototag.annotate import AdaptiveAnnotator, HedgedAnnotator, AsyncHedgedAnnotator, FakeImageAnnotatorClient, \
+    FakeImageAnnotatorAsyncClient, label_async, labels_from_response
+from phototag.limiter import HedgeBudget, LatencyTracker
+
+echo = lambda content: [content.decode()]
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(window=100, min_samples=10)
+    for latency in range(5):
+        tracker.record(latency)
+    assert tracker.percentile(0.95) is None, 'Too few samples to tell'
+    for latency in range(5, 200):
+        tracker.record(latency)
+    assert tracker.percentile(0.95) == 195, 'Only the most recent samples are kept'
+
+
+def test_hedge_budget():
+    budget = HedgeBudget(ratio=0.1, burst=2)
+    assert not budget.spend()
+    for _ in range(100):
+        budget.earn()
+    assert budget.spend() and budget.spend() and not budget.spend(), 'Saved up tokens are capped'
+
+
+def test_deadline():
+    client = FakeImageAnnotatorClient(stall_rate=1.0, stall=5)
+    annotator = HedgedAnnotator(client, deadline=0.05, hedging=False)
+
+    start = time.monotonic()
+    with pytest.raises(exceptions.DeadlineExceeded):
+        annotator.label_detection(image=vision.Image(content=b'stuck'))
+    assert time.monotonic() - start < 1 and annotator.exceeded == 1
+
+    # Hedged, and counted once however many of the requests given up on time out afterwards
+    hedged = HedgedAnnotator(client, deadline=0.1, budget=HedgeBudget(ratio=1))
+    hedged.latencies.min_samples = 1
+    hedged.latencies.record(0.01)
+    with pytest.raises(exceptions.DeadlineExceeded):
+        hedged.label_detection(image=vision.Image(content=b'stuck'))
+    time.sleep(0.2)
+    hedged.close()
+    assert hedged.hedged == 1 and hedged.exceeded == 1
+    assert hedged.metrics.to_dict()['counters']['deadlines_exceeded_total'][0]['value'] == 1
+
+
+def test_deadline_covers_retries():
+    client = FakeImageAnnotatorClient(latency=(0.02, 0.02), error_rate=1.0)
+    annotator = HedgedAnnotator(AdaptiveAnnotator(client, retries=100), deadline=0.2, hedging=False)
+
+    start = time.monotonic()
+    with pytest.raises(exceptions.ServiceUnavailable):
+        annotator.label_detection(image=vision.Image(content=b'unavailable'))
+    assert time.monotonic() - start < 0.3, 'Retries stop once the deadline would pass'
+    assert annotator.client.retried < 100
+
+    adaptive = AdaptiveAnnotator(FakeImageAnnotatorClient(latency=(0.01, 0.01)))
+    assert HedgedAnnotator(adaptive).latencies is adaptive.latencies, 'Latencies are measured around the requests'
+
+
+class StallingClient(FakeImageAnnotatorClient):
+    """
+    Stalls the first request for one image in 25, answering any other request quickly
+    """
+
+    def __init__(self):
+        super().__init__(latency=(0.005, 0.01), labeler=echo)
+        self.seen = set()
+
+    def _delay_for(self, requests, timeout) -> float:
+        content = requests[0].image.content
+        first = content not in self.seen
+        self.seen.add(content)
+        delay = 2.0 if first and int(content) % 25 == 24 else random.uniform(*self.latency)
+        return delay if timeout is None else min(delay, timeout)
+
+    def batch_annotate_images(self, requests, timeout=None, **kwargs):
+        time.sleep(self._delay_for(requests, timeout))
+        return self._respond(requests)
+
+
+class AsyncStallingClient(StallingClient):
+    async def batch_annotate_images(self, requests, timeout=None, **kwargs):
+        await asyncio.sleep(self._delay_for(requests, timeout))
+        return self._respond(requests)
+
+
+def test_hedging():
+    client = StallingClient()
+    annotator = HedgedAnnotator(client, deadline=5, budget=HedgeBudget(ratio=0.2))
+    annotator.latencies.min_samples = 10
+
+    def label(index: int):
+        return labels_from_response(annotator.label_detection(image=vision.Image(content=str(index).encode())))
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(label, range(200)))
+    annotator.close()
+
+    assert results == [[str(index)] for index in range(200)]
+    assert 8 <= annotator.won <= annotator.hedged, 'Every stalled request is hedged, and won by its hedge'
+    assert annotator.hedged <= 200 * 0.2, 'Hedges stay within the budget'
+    assert time.monotonic() - start < 2, 'Stalled requests are hedged rather than waited upon'
+    counters = annotator.metrics.to_dict()['counters']
+    assert counters['hedges_won_total'][0]['value'] == annotator.won
+
+
+def test_async_hedging():
+    client = AsyncStallingClient()
+    annotator = AsyncHedgedAnnotator(client, deadline=10, budget=HedgeBudget(ratio=0.5))
+    annotator.latencies.min_samples = 10
+
+    async def label_all():
+        results = []
+        for start in range(0, 100, 10):
+            results += await asyncio.gather(*(label_async(annotator, str(index).encode())
+                                              for index in range(start, start + 10)))
+        return results
+
+    start = time.monotonic()
+    assert asyncio.run(label_all()) == [[str(index)] for index in range(100)]
+    assert 4 <= annotator.won <= annotator.hedged and time.monotonic() - start < 2
@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from phototag import iptc
+from phototag.index import TagIndex
+from phototag.process import FileProcessor
+
+SIDECAR = """<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+   <dc:subject><rdf:Bag><rdf:li>sky</rdf:li><rdf:li>mountain</rdf:li></rdf:Bag></dc:subject>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+
+def test_query(tmp_path: Path):
+    index = TagIndex(str(tmp_path / 'index.sqlite'))
+    index.update(tmp_path / 'a.jpg', ['Sky', 'Lake', 'sky'])
+    index.update(tmp_path / 'b.jpg', ['Sky', 'Tree'])
+    index.update(tmp_path / 'c.jpg', ['Tree'])
+
+    a, b, c = (str((tmp_path / name).resolve()) for name in ['a.jpg', 'b.jpg', 'c.jpg'])
+    assert index.query(['sky']) == [a, b], 'Tags are matched case-insensitively'
+    assert index.query(['tree', 'SKY']) == [b]
+    assert index.query(['sky', 'missing']) == [] and index.query([]) == []
+    assert index.query(['lake', 'tree', 'missing'], any=True) == [a, b, c]
+    assert index.query(['sky', 'tree'], any=True, limit=2) == [a, b]
+    assert index.count(['sky', 'tree'], any=True) == 3 and index.count(['sky', 'lake']) == 1
+    assert index.counts() == [('Sky', 2), ('Tree', 2), ('Lake', 1)]
+
+    # Updating replaces a file's tags, keeping the counts in step
+    index.update(tmp_path / 'a.jpg', ['Tree'])
+    index.remove(tmp_path / 'c.jpg')
+    assert index.tags(tmp_path / 'a.jpg') == ['Tree']
+    assert index.query(['tree']) == [a, b]
+    assert index.counts() == [('Tree', 2), ('Sky', 1)]
+    index.close()
+
+    assert TagIndex(str(tmp_path / 'index.sqlite')).query(['sky']) == [b], 'The index persists across instances'
+
+
+def test_refresh(tmp_path: Path):
+    jpegs = [tmp_path / f'{number}.jpg' for number in range(3)]
+    for path in jpegs:
+        Image.new('RGB', (32, 32)).save(path)
+        iptc.write_keywords(str(path), ['lake'])
+    raw = tmp_path / 'photo.nef'
+    raw.write_bytes(b'not read')
+
+    index = TagIndex(str(tmp_path / 'index.sqlite'))
+    stats = index.refresh(jpegs + [raw], workers=2, prune=tmp_path)
+    assert (stats.added, stats.changed, stats.unchanged, stats.removed) == (4, 0, 0, 0)
+    assert index.count(['lake']) == 3
+
+    # Only the changed image & the sidecar written since are read again; deleted files are pruned
+    iptc.write_keywords(str(jpegs[0]), ['lake', 'boat'])
+    raw.with_suffix('.xmp').write_text(SIDECAR)
+    os.remove(jpegs[2])
+    stats = index.refresh(jpegs[:2] + [raw], workers=2, prune=tmp_path)
+    assert (stats.added, stats.changed, stats.unchanged, stats.removed) == (0, 2, 1, 1)
+    assert index.query(['lake']) == [str(jpegs[0].resolve()), str(jpegs[1].resolve())]
+    assert index.query(['boat', 'mountain'], any=True) == [str(jpegs[0].resolve()), str(raw.resolve())]
+
+    assert index.refresh(jpegs[:2] + [raw], workers=2).unchanged == 3
+    index.close()
+
+
+def test_write_updates_index(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (32, 32)).save(path)
+    iptc.write_keywords(str(path), ['existing'])
+
+    index = TagIndex(str(tmp_path / 'index.sqlite'))
+    FileProcessor(path).write(['Sky', 'Cloud'], index=index)
+    assert sorted(index.tags(path)) == ['Cloud', 'Sky', 'existing'], 'Tags already on the file are indexed too'
+    assert index.refresh([path]).unchanged == 1, 'The index is up to date with the file as written'
+    index.close()
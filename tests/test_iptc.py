@@ -0,0 +1,107 @@
+import os
+from pathlib import Path
+
+import iptcinfo3
+import pytest
+from PIL import Image
+
+from phototag import iptc
+from phototag.exceptions import MetadataError
+from phototag.tags import IPTCTagger
+
+
+@pytest.fixture()
+def jpeg(tmp_path: Path) -> str:
+    path = str(tmp_path / 'image.jpg')
+    Image.new('RGB', (64, 48), color=(200, 10, 10)).save(path, format='jpeg', quality=90)
+    return path
+
+
+def image_data(path: str) -> bytes:
+    """
+    :return: Everything from the start of scan onwards
+    """
+    with open(path, 'rb') as file:
+        _, offset = iptc.read_header(file)
+        file.seek(offset)
+        return file.read()
+
+
+def test_insert_and_read(jpeg: str):
+    data = image_data(jpeg)
+    assert iptc.read_keywords(jpeg) == []
+    assert iptc.write_keywords(jpeg, ['dog', 'grass', 'Café'])
+
+    assert iptc.read_keywords(jpeg) == ['dog', 'grass', 'Café']
+    assert image_data(jpeg) == data, 'Image data is copied over untouched'
+    with Image.open(jpeg) as image:
+        image.load()
+
+    info = iptcinfo3.IPTCInfo(jpeg)
+    assert [keyword.decode() for keyword in info['keywords']] == ['dog', 'grass', 'Café'], \
+        'Other IPTC readers understand the keywords written'
+
+
+def test_replace(jpeg: str):
+    iptc.write_keywords(jpeg, ['dog', 'grass'])
+    assert iptc.write_keywords(jpeg, ['sky', 'dog'])
+    assert iptc.read_keywords(jpeg) == ['dog', 'sky'], 'Existing keywords keep their order'
+
+    with open(jpeg, 'rb') as file:
+        segments, _ = iptc.read_header(file)
+    assert len([segment for segment in segments if segment.marker == iptc.APP13]) == 1
+
+
+def test_unchanged(jpeg: str):
+    iptc.write_keywords(jpeg, ['dog', 'grass'])
+    stat = os.stat(jpeg)
+    assert not iptc.write_keywords(jpeg, ['grass', 'dog'])
+    assert os.stat(jpeg).st_mtime_ns == stat.st_mtime_ns
+
+
+def test_in_place(jpeg: str):
+    iptc.write_keywords(jpeg, ['cat'])
+    inode = os.stat(jpeg).st_ino
+    assert iptc.write_keywords(jpeg, ['dog'])
+    assert os.stat(jpeg).st_ino == inode, 'Same length headers are patched in place'
+    assert iptc.read_keywords(jpeg) == ['dog']
+
+
+def test_keeps_other_datasets(jpeg: str):
+    info = iptcinfo3.IPTCInfo(jpeg, force=True)
+    info['caption/abstract'] = 'A red square'
+    info['keywords'] = ['red']
+    info.save()
+    os.remove(jpeg + '~')
+
+    iptc.write_keywords(jpeg, ['red', 'square'])
+    info = iptcinfo3.IPTCInfo(jpeg)
+    assert info['caption/abstract'] == b'A red square'
+    assert iptc.read_keywords(jpeg) == ['red', 'square']
+
+
+def test_not_jpeg(tmp_path: Path):
+    path = tmp_path / 'image.png'
+    Image.new('RGB', (8, 8)).save(path)
+    with pytest.raises(MetadataError):
+        iptc.write_keywords(str(path), ['dog'])
+
+
+def test_tagger(jpeg: str):
+    iptc.write_keywords(jpeg, ['dog'])
+    tagger = IPTCTagger(Path(jpeg))
+    assert tagger.current_tags == {'dog'}
+
+    tagger.extend(['grass', 'dog'])
+    assert not tagger.saved
+    tagger.save()
+    assert tagger.saved and tagger.written
+    assert iptc.read_keywords(jpeg) == ['dog', 'grass']
+
+    tagger.extend(['dog'])
+    tagger.save()
+    assert not tagger.written
+
+    tagger.extend(['sky', 'cloud', 'grass'])
+    tagger.save()
+    assert iptc.read_keywords(jpeg) == ['dog', 'grass', 'sky', 'cloud'], 'New tags keep the order they were added in'
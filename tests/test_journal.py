@@ -0,0 +1,58 @@
+import os
+from pathlib import Path
+
+from phototag.helpers import ScanEntry
+from phototag.journal import RunJournal
+
+
+def entry(path: Path, size: int = 10, mtime_ns: int = 1) -> ScanEntry:
+    return ScanEntry(path, size, mtime_ns, 0)
+
+
+def test_record_and_resume(tmp_path: Path):
+    journal_path = str(tmp_path / 'journal')
+    journal = RunJournal(journal_path)
+    journal.record(entry(tmp_path / 'a.jpg'))
+    journal.record(entry(tmp_path / 'b.jpg'))
+    assert journal.finished(entry(tmp_path / 'a.jpg'))
+    journal.close()
+
+    journal = RunJournal(journal_path)
+    assert journal.finished(entry(tmp_path / 'a.jpg')) and journal.finished(entry(tmp_path / 'b.jpg'))
+    assert not journal.finished(entry(tmp_path / 'c.jpg'))
+    assert not journal.finished(entry(tmp_path / 'a.jpg', size=11)), 'Changed files are processed again'
+    assert not journal.finished(entry(tmp_path / 'a.jpg', mtime_ns=2))
+    journal.close()
+
+
+def test_partial_line(tmp_path: Path):
+    journal_path = str(tmp_path / 'journal')
+    journal = RunJournal(journal_path)
+    journal.record(entry(tmp_path / 'a.jpg'))
+    journal.close()
+    with open(journal_path, 'a') as file:
+        file.write('["' + str(tmp_path / 'b.jpg'))  # Interrupted mid-write
+
+    journal = RunJournal(journal_path)
+    assert journal.finished(entry(tmp_path / 'a.jpg')) and not journal.finished(entry(tmp_path / 'b.jpg'))
+    journal.record(entry(tmp_path / 'c.jpg'))
+    journal.close()
+
+    journal = RunJournal(journal_path)
+    assert journal.finished(entry(tmp_path / 'c.jpg')), 'Records after a partial line are readable'
+    journal.close()
+
+
+def test_compaction(tmp_path: Path):
+    journal_path = str(tmp_path / 'journal')
+    journal = RunJournal(journal_path, compact_min=20)
+    for mtime_ns in range(30):
+        journal.record(entry(tmp_path / 'a.jpg', mtime_ns=mtime_ns))
+    journal.close()
+
+    with open(journal_path) as file:
+        assert len(file.readlines()) < 20
+    journal = RunJournal(journal_path)
+    assert journal.finished(entry(tmp_path / 'a.jpg', mtime_ns=29))
+    journal.close()
+    assert not os.path.exists(journal_path + '.tmp')
@@ -0,0 +1,96 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from google.api_core import exceptions
+from google.cloud import vision
+
+from phototag import annotate
+from phototag.annotate import AdaptiveAnnotator, AsyncAdaptiveAnnotator, FakeImageAnnotatorClient, \
+    FakeImageAnnotatorAsyncClient, label_async, labels_from_response
+from phototag.limiter import AdaptiveLimiter, AsyncAdaptiveLimiter, backoff
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(annotate, 'backoff', lambda attempt: 0.001)
+
+
+def test_backoff():
+    assert all(0 <= backoff(attempt, base=0.5, cap=4) <= min(4, 0.5 * 2 ** (attempt - 1)) for attempt in range(1, 10))
+
+
+def test_additive_increase():
+    limiter = AdaptiveLimiter(initial=2, maximum=3)
+    for _ in range(20):
+        limiter._adapt(time.monotonic(), 0.05, throttled=False)
+    assert limiter.limit == 3, 'The limit grows with successes, up to the maximum'
+
+
+def test_latency_jitter():
+    rng = random.Random(0)
+    limiter = AdaptiveLimiter(initial=4, maximum=32)
+    for _ in range(2000):
+        limiter._adapt(time.monotonic(), rng.uniform(0, 0.06), throttled=False)
+    assert limiter.limit == 32 and limiter.slow == 0, 'Jitter alone never decreases the limit'
+
+
+def test_multiplicative_decrease():
+    limiter = AdaptiveLimiter(initial=8)
+    started = [limiter.acquire() for _ in range(4)]
+    for start in started:
+        limiter.release(start, throttled=True)
+    assert limiter.limit == 4, 'Requests already in flight during a decrease do not decrease the limit again'
+
+    limiter.release(limiter.acquire(), throttled=True)
+    assert limiter.limit == 2 and limiter.throttled == 5
+
+
+def test_latency_decrease():
+    limiter = AdaptiveLimiter(initial=8, maximum=8, tolerance=2)
+    for _ in range(50):
+        limiter._adapt(time.monotonic(), 0.1, throttled=False)
+    limiter._adapt(time.monotonic(), 1.0, throttled=False)
+    assert limiter.limit == 8 and limiter.slow == 0, 'A single slow request is not a sustained rise'
+
+    for _ in range(10):
+        limiter._adapt(time.monotonic(), 1.0, throttled=False)
+    assert limiter.slow > 0 and limiter.limit < 8, 'A sustained rise in latency decreases the limit'
+
+
+def test_throttled_client():
+    client = FakeImageAnnotatorClient(latency=(0.005, 0.01), labeler=lambda content: [content.decode()], capacity=4)
+    annotator = AdaptiveAnnotator(client, AdaptiveLimiter(initial=2, maximum=32), retries=20)
+
+    def label(index: int):
+        image = vision.Image(content=str(index).encode())
+        return labels_from_response(annotator.label_detection(image=image))
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(label, range(200)))
+
+    assert results == [[str(index)] for index in range(200)], 'Every throttled request is retried until it succeeds'
+    assert client.throttled > 0 and annotator.retried == client.throttled
+    assert annotator.limiter.limit < 8, 'The limit backs off towards the capacity'
+
+
+def test_retries_exhausted():
+    client = FakeImageAnnotatorClient(error_rate=1.0)
+    annotator = AdaptiveAnnotator(client, retries=2)
+    with pytest.raises(exceptions.ServiceUnavailable):
+        annotator.label_detection(image=vision.Image(content=b'image'))
+    assert annotator.retried == 2 and annotator.limiter.in_flight == 0
+
+
+def test_async_throttled_client():
+    client = FakeImageAnnotatorAsyncClient(latency=(0.005, 0.01), labeler=lambda content: [content.decode()],
+                                           capacity=4)
+    annotator = AsyncAdaptiveAnnotator(client, AsyncAdaptiveLimiter(initial=2, maximum=32), retries=20)
+
+    async def label_all():
+        return await asyncio.gather(*(label_async(annotator, str(index).encode()) for index in range(200)))
+
+    assert asyncio.run(label_all()) == [[str(index)] for index in range(200)]
+    assert client.throttled > 0 and client.peak_in_flight <= annotator.limiter.maximum
@@ -0,0 +1,44 @@
+from pathlib import Path
+
+from phototag.metrics import Histogram, Metrics, PrometheusExporter
+
+
+def test_histogram():
+    histogram = Histogram([0.1, 1, 10])
+    for value in [0.05, 0.1, 0.5, 5, 50]:
+        histogram.observe(value)
+
+    assert histogram.cumulative() == [('0.1', 2), ('1', 3), ('10', 4), ('+Inf', 5)]
+    assert histogram.count == 5 and histogram.sum == 55.65
+    assert histogram.quantile(0.5) == 1 and histogram.quantile(1) == float('inf')
+
+
+def test_prometheus():
+    metrics = Metrics()
+    metrics.describe('files_total', 'Files finished, by result.')
+    metrics.increment('files_total', result='succeeded')
+    metrics.increment('files_total', 2, result='succeeded')
+    metrics.set('files_active', 3)
+    metrics.observe('stage_seconds', 0.2, buckets=[0.1, 1], stage='decode')
+
+    lines = metrics.to_prometheus().splitlines()
+    assert '# HELP phototag_files_total Files finished, by result.' in lines
+    assert '# TYPE phototag_files_total counter' in lines
+    assert 'phototag_files_total{result="succeeded"} 3' in lines
+    assert 'phototag_files_active 3' in lines
+    assert 'phototag_stage_seconds_bucket{stage="decode",le="0.1"} 0' in lines
+    assert 'phototag_stage_seconds_bucket{stage="decode",le="+Inf"} 1' in lines
+    assert 'phototag_stage_seconds_count{stage="decode"} 1' in lines
+
+
+def test_exporter(tmp_path: Path):
+    metrics = Metrics()
+    metrics.set('files_active', 1)
+    path = tmp_path / 'phototag.prom'
+
+    exporter = PrometheusExporter(metrics, str(path), interval=60)
+    metrics.set('files_active', 2)
+    exporter.close()
+
+    assert 'phototag_files_active 2' in path.read_text(), 'Metrics are written once more when closed'
+    assert [child.name for child in tmp_path.iterdir()] == ['phototag.prom']
@@ -0,0 +1,129 @@
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+from PIL import Image
+
+from phototag.annotate import FakeImageAnnotatorClient
+from phototag.decode import estimate_memory
+from phototag.process import AdmissionQueue, FileProcessor, MasterFileProcessor
+
+
+class StubProcessor(FileProcessor):
+    """
+    A FileProcessor with a fixed memory estimate, shadowing no real file
+    """
+
+    def __init__(self, memory: int):
+        super().__init__(Path(f'{memory}.jpg'))
+        self._memory = memory
+
+
+def test_estimate_memory(tmp_path: Path):
+    rgb, grey = tmp_path / 'rgb.png', tmp_path / 'grey.png'
+    Image.new('RGB', (300, 200)).save(rgb)
+    Image.new('L', (300, 200)).save(grey)
+
+    assert estimate_memory(str(rgb)) == 300 * 200 * 4
+    assert estimate_memory(str(grey)) == 300 * 200
+
+
+def test_admission_queue():
+    queue = AdmissionQueue(image_count=3, buffer_size=90, single_override=False)
+    for key, memory in enumerate([50, 10, 200, 30, 20]):
+        queue.push(key, StubProcessor(memory))
+
+    admitted: List[FileProcessor] = []
+    while True:
+        item = queue.pop()
+        if item is None:
+            break
+        admitted.append(item[1])
+
+    assert [fp.memory for fp in admitted] == [10, 20, 30], 'Smallest first, up to the image count'
+    assert (queue.running_count, queue.running_memory) == (3, 60)
+
+    queue.release(admitted[0])
+    assert queue.pop() is None, '50 does not fit into the remaining 40 bytes'
+    queue.release(admitted[1])
+    assert queue.pop()[1].memory == 50
+    assert queue.running_memory == 80
+
+
+def test_admission_single_override():
+    queue = AdmissionQueue(image_count=4, buffer_size=100, single_override=True)
+    queue.push(0, StubProcessor(500))
+    queue.push(1, StubProcessor(600))
+
+    first = queue.pop()
+    assert first is not None, 'A file too large for the buffer is admitted when nothing else is running'
+    assert queue.pop() is None
+    queue.release(first[1])
+    assert queue.pop() is not None
+
+
+def test_threaded_processor(tmp_path: Path, monkeypatch):
+    paths = [tmp_path / f'{index}.jpg' for index in range(8)]
+    for index, path in enumerate(paths):
+        Image.new('RGB', (32, 32 + index)).save(path)
+
+    written: List[str] = []
+    monkeypatch.setattr(FileProcessor, 'write',
+                        lambda self, labels, cache=None, index=None: written.append(self.file_path.name))
+
+    finished: List[FileProcessor] = []
+    mp = MasterFileProcessor(paths, 3, 32 * 40 * 4 * 2, True, client=FakeImageAnnotatorClient(latency=(0, 0.01)),
+                             max_bytes=4096, on_finished=finished.append)
+    mp.load()
+    mp.join()
+
+    assert sorted(written) == sorted(path.name for path in paths)
+    assert (mp.total_active, mp.total_size) == (0, 0)
+
+    stages = {entry['labels']['stage']: entry['count'] for entry in mp.metrics.to_dict()['histograms']['stage_seconds']}
+    assert all(stages[stage] == len(paths) for stage in ['queue', 'lookup', 'optimize', 'decode', 'encode', 'annotate'])
+    assert mp.finished == len(finished) == len(paths) and mp.failed == 0
+    assert all(0 < fp.upload_bytes <= 4096 for fp in finished)
+    assert mp.metrics.to_dict()['histograms']['thumbnail_bytes'][0]['count'] == len(paths)
+
+
+def test_streaming_processor(tmp_path: Path, monkeypatch):
+    paths = [tmp_path / f'{index}.jpg' for index in range(10)]
+    for path in paths:
+        Image.new('RGB', (16, 16)).save(path)
+
+    events: List[str] = []
+    monkeypatch.setattr(FileProcessor, 'write', lambda self, labels, cache=None, index=None: events.append('processed'))
+
+    def discover():
+        """Yields files slowly, like a walk over network storage"""
+        for path in paths:
+            events.append('discovered')
+            time.sleep(0.02)
+            yield path
+        yield tmp_path / 'lonely.nef'  # A RAW file without its sidecar
+
+    skipped: List[Path] = []
+    mp = MasterFileProcessor(discover(), 2, 10 ** 9, True, client=FakeImageAnnotatorClient(), stream=True, window=3,
+                             on_skipped=skipped.append)
+    mp.load()
+    mp.join()
+
+    assert events.count('processed') == len(paths) and mp.discovered == len(paths)
+    assert skipped == [tmp_path / 'lonely.nef'], 'Files that cannot be processed are handed to on_skipped'
+    assert events.index('processed') < len(paths) - 1, 'Processing starts before discovery has finished'
+
+
+@pytest.mark.filterwarnings('error::pytest.PytestUnhandledThreadExceptionWarning')  # Nothing is raised in threads
+def test_untaggable_files(tmp_path: Path):
+    png = tmp_path / 'image.png'
+    Image.new('RGB', (32, 32)).save(png)
+    client = FakeImageAnnotatorClient()
+    finished: List[FileProcessor] = []
+    mp = MasterFileProcessor([png], 1, 10 ** 9, True, client=client, on_finished=finished.append)
+    mp.load()
+    mp.join()
+
+    assert mp.failed == 1 and not finished[0].succeeded
+    assert client.requests == 0 and 'optimize' not in finished[0].timings, 'Files that cannot be tagged are not labeled'
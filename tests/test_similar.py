@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image, ImageDraw
+
+from phototag.annotate import FakeImageAnnotatorClient
+from phototag.process import FileProcessor, MasterFileProcessor
+from phototag.similar import BKTree, LabelReuse, hamming, perceptual_hash
+
+
+def scene(seed: int, offset: int = 0) -> Image.Image:
+    """
+    A few random shapes; frames of the same scene differ only by a slight shift, as in a burst.
+    """
+    rng = random.Random(seed)
+    image = Image.new('RGB', (256, 192), color=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x, y = rng.randrange(200), rng.randrange(140)
+        draw.ellipse((x + offset, y, x + offset + rng.randrange(20, 80), y + rng.randrange(20, 60)),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return image
+
+
+def test_perceptual_hash():
+    first, burst, other = perceptual_hash(scene(0)), perceptual_hash(scene(0, offset=2)), perceptual_hash(scene(1))
+    assert hamming(first, burst) <= 6
+    assert hamming(first, other) > 12
+
+
+def test_bk_tree():
+    rng = random.Random(0)
+    keys = [rng.getrandbits(64) for _ in range(2000)]
+    tree = BKTree()
+    for number, key in enumerate(keys):
+        tree.add(key, number)
+    tree.add(keys[0], 'duplicate')
+    keys.append(keys[0])
+    assert len(tree) == len(keys)
+
+    for query in keys[:20] + [key ^ 0b101 for key in keys[20:40]]:
+        expected = sorted(hamming(query, key) for key in keys if hamming(query, key) <= 24)
+        assert [distance for distance, _ in tree.find(query, 24)] == expected
+    assert [value for _, value in tree.find(keys[0], 0)] in ([0, 'duplicate'], ['duplicate', 0])
+
+
+def test_label_reuse():
+    reuse = LabelReuse(distance=2)
+    started, release = threading.Event(), threading.Event()
+    results: Dict[int, tuple] = {}
+
+    def slow() -> List[str]:
+        started.set()
+        release.wait()
+        return ['Sky']
+
+    first = threading.Thread(target=lambda: results.update({0: reuse.labels(0b1111, slow)}))
+    first.start()
+    started.wait()
+    # A near-duplicate waits for the request in flight instead of making its own
+    second = threading.Thread(target=lambda: results.update({1: reuse.labels(0b1110, lambda: ['Other'])}))
+    second.start()
+    time.sleep(0.05)
+    assert 1 not in results
+    release.set()
+    first.join()
+    second.join()
+    assert results == {0: (['Sky'], False), 1: (['Sky'], True)}
+
+    assert reuse.labels(0b11110000, lambda: ['Tree']) == (['Tree'], False), 'Distant hashes are labeled separately'
+    assert (reuse.requested, reuse.reused) == (2, 1)
+
+    def failing() -> List[str]:
+        raise RuntimeError('unavailable')
+
+    try:
+        reuse.labels(0b1 << 40, failing)
+    except RuntimeError:
+        pass
+    assert reuse.labels(0b11 << 40, lambda: ['Lake']) == (['Lake'], False), 'Failed neighbors are not reused'
+
+
+def test_processor_reuses_labels(tmp_path: Path, monkeypatch):
+    paths = []
+    for number in range(12):
+        path = tmp_path / f'{number:02}.jpg'
+        scene(number // 6, offset=number % 6).save(path, format='jpeg')  # Two bursts of six frames
+        paths.append(path)
+
+    written: Dict[str, List[str]] = {}
+    monkeypatch.setattr(FileProcessor, 'write', lambda self, labels, cache=None, index=None: written.update({
+        self.file_path.name: labels
+    }))
+    client = FakeImageAnnotatorClient(latency=(0.05, 0.05), labeler=lambda content: [str(len(content))])
+    reuse = LabelReuse()
+    mp = MasterFileProcessor(paths, 12, 10 ** 9, True, client=client, reuse=reuse)
+    mp.load()
+    mp.join()
+
+    assert len(written) == len(paths)
+    assert client.requests == reuse.requested == 2 and reuse.reused == 10
+    assert len({tuple(written[path.name]) for path in paths[:6]}) == 1, 'A burst shares its labels'
+    assert mp.metrics.to_dict()['counters']['labels_reused_total'][0]['value'] == 10
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from PIL import Image
+
+from phototag.tuning import Calibration, calibrate, tune, available_memory, cpu_count, MAX_IMAGE_COUNT
+
+
+def test_calibrate(tmp_path: Path):
+    paths = [tmp_path / f'{index}.jpg' for index in range(10)]
+    for path in paths:
+        Image.new('RGB', (640, 480)).save(path)
+    (tmp_path / 'broken.jpg').write_bytes(b'not an image')
+
+    calibration = calibrate(paths, count=3)
+    assert calibration.files == 3
+    assert calibration.seconds > 0 and calibration.memory == 640 * 480 * 4
+
+    assert calibrate([tmp_path / 'broken.jpg']) is None, 'Files that cannot be thumbnailed are skipped'
+
+
+def test_tune():
+    # 4 CPUs, each file taking 0.1s of CPU time & 0.5s waiting on the API: 4 * (1 + 5) files keep every CPU busy
+    limits = tune(Calibration(0.1, 10 * 1024 ** 2, 4), cpus=4, memory=8 * 1024 ** 3)
+    assert limits == (24, 24 * 10 * 1024 ** 2)
+
+    # Memory bound: half of 200 MB holds 10 files
+    limits = tune(Calibration(0.1, 10 * 1024 ** 2, 4), cpus=4, memory=200 * 1024 ** 2)
+    assert limits == (10, 100 * 1024 ** 2)
+
+    # The largest file always fits, however little memory is available
+    assert tune(Calibration(1.0, 500 * 1024 ** 2, 4), cpus=64, memory=800 * 1024 ** 2) == (1, 500 * 1024 ** 2)
+
+    assert tune(Calibration(0.0001, 1024, 4), cpus=64, memory=None).image_count == MAX_IMAGE_COUNT
+    assert tune(None, cpus=2, memory=None).image_count >= 2
+
+
+def test_host():
+    assert cpu_count() >= 1
+    assert available_memory() is None or available_memory() > 0
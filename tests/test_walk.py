@@ -1,3 +1,5 @@
+import contextlib
+import os
 from pathlib import Path
 from random import choice
 from string import ascii_lowercase
@@ -5,7 +7,7 @@ from typing import List, Callable, Tuple
 
 import pytest
 
-from phototag.helpers import walk
+from phototag.helpers import walk, scan
 
 letter: Callable[[], str] = lambda: choice(ascii_lowercase)
 extension: Callable[[], str] = lambda: choice(['jpeg', 'jpg', 'png'])
@@ -22,7 +24,7 @@ def tmp_walkable(tmp_path: Path):
 
     results: List[List[Path]] = []
     for index, file_count in enumerate(sub_dir_counts):
-        files: List[Path] = [current_dir / file() for _ in range(file_count)]
+        files: List[Path] = [current_dir / f'{file_index}{file()}' for file_index in range(file_count)]
         for path in files:
             path.touch()
 
@@ -44,3 +46,30 @@ def test_walk(tmp_walkable: Tuple[Path, List[List[Path]]]):
     assert len(list(walk(root, depth=1))) == sum(counts[:1]), "Depth 1"
     assert len(list(walk(root, depth=2))) == sum(counts[:2]), "Depth 2"
     assert len(list(walk(root, depth=3))) == sum(counts[:3]), "Depth 3"
+
+
+def test_scan(tmp_walkable: Tuple[Path, List[List[Path]]]):
+    root: Path = tmp_walkable[0]
+    counts: List[int] = list(map(len, tmp_walkable[1]))
+
+    entries = list(scan(root, workers=3))
+    expected = sorted(path.resolve() for files in tmp_walkable[1] for path in files)
+    assert sorted(entry.path for entry in entries) == expected
+    assert all(entry.size == 0 and entry.inode > 0 for entry in entries), "Stat information is carried along"
+
+    assert len(list(scan(root, depth=1))) == sum(counts[:1]), "Depth 1"
+    assert len(list(scan(root, depth=3))) == sum(counts[:3]), "Depth 3"
+
+
+def test_scan_vanishing(tmp_path: Path, monkeypatch):
+    for name in ['a.jpg', 'b.jpg', 'c.jpg']:
+        (tmp_path / name).touch()
+    scandir = os.scandir
+
+    def vanishing(path):
+        entries = list(scandir(path))
+        (tmp_path / 'b.jpg').unlink()  # Deleted between the listing & the stat call
+        return contextlib.nullcontext(iter(entries))
+
+    monkeypatch.setattr(os, 'scandir', vanishing)
+    assert sorted(entry.path.name for entry in scan(tmp_path)) == ['a.jpg', 'c.jpg']
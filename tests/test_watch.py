@@ -0,0 +1,103 @@
+import os
+import time
+from pathlib import Path
+from threading import Thread
+from typing import List
+
+from PIL import Image
+
+from phototag import iptc
+from phototag.annotate import FakeImageAnnotatorClient
+from phototag.process import FileProcessor, MasterFileProcessor
+from phototag.watch import Watcher
+
+
+def names(entries) -> List[str]:
+    return sorted(entry.path.name for entry in entries)
+
+
+def test_watcher(tmp_path: Path):
+    Image.new('RGB', (32, 32)).save(tmp_path / 'old.jpg')
+    watcher = Watcher(tmp_path, settle=0, skip_existing=True)
+    assert watcher.poll() == []
+
+    # Files are handed over once their size & modification time held between two scans
+    partial = tmp_path / 'new.jpg'
+    partial.write_bytes(b'\xff\xd8 still uploading')
+    (tmp_path / 'notes.txt').write_text('not an image')
+    assert watcher.poll() == []
+    Image.new('RGB', (32, 32)).save(partial)
+    assert watcher.poll() == []
+    assert names(watcher.poll()) == ['new.jpg']
+    assert watcher.poll() == [], 'Files in flight are not handed over twice'
+
+    # Tagging changes the file, but is remembered as done
+    iptc.write_keywords(str(partial), ['sky'])
+    watcher.done(partial.resolve())
+    assert watcher.poll() == [] and watcher.poll() == []
+
+    # RAW files wait for their sidecar, and a sidecar changing alone hands the RAW file over again
+    raw = tmp_path / 'photo.nef'
+    raw.write_bytes(b'raw')
+    assert watcher.poll() == [] and watcher.poll() == []
+    raw.with_suffix('.xmp').write_text('<x:xmpmeta xmlns:x="adobe:ns:meta/"/>')
+    watcher.poll()
+    assert names(watcher.poll()) == ['photo.nef']
+    watcher.done(raw.resolve())
+    raw.with_suffix('.xmp').write_text('<x:xmpmeta xmlns:x="adobe:ns:meta/"> </x:xmpmeta>')
+    watcher.poll()
+    assert names(watcher.poll()) == ['photo.nef']
+
+    os.remove(tmp_path / 'old.jpg')
+    watcher.poll()
+    assert tmp_path.resolve() / 'old.jpg' not in watcher.known, 'Deleted files are forgotten'
+
+
+def test_watcher_settle(tmp_path: Path):
+    watcher = Watcher(tmp_path, settle=0.3, handled=lambda entry: entry.path.name == 'done.jpg')
+    for name in ['done.jpg', 'fresh.jpg']:
+        Image.new('RGB', (32, 32)).save(tmp_path / name)
+    assert watcher.poll() == []
+    assert watcher.poll() == [], 'Files are left alone until they held for the settle time'
+    time.sleep(0.35)
+    assert names(watcher.poll()) == ['fresh.jpg'], 'Files already handled by a previous run are skipped'
+
+
+def test_watcher_retry(tmp_path: Path):
+    watcher = Watcher(tmp_path, settle=0, retry=0.2)
+    Image.new('RGB', (32, 32)).save(tmp_path / 'broken.jpg')
+    watcher.poll()
+    assert names(watcher.poll()) == ['broken.jpg']
+
+    watcher.done((tmp_path / 'broken.jpg').resolve(), succeeded=False)
+    assert watcher.poll() == [] and watcher.poll() == [], 'Files that failed back off before they are retried'
+    time.sleep(0.25)
+    watcher.poll()
+    assert names(watcher.poll()) == ['broken.jpg'], 'Files that failed are handed over again, even if unchanged'
+    watcher.done((tmp_path / 'broken.jpg').resolve(), succeeded=False)
+    assert watcher.failed[(tmp_path / 'broken.jpg').resolve()][0] == 2
+
+
+def test_watch_processing(tmp_path: Path, monkeypatch):
+    written: List[str] = []
+    monkeypatch.setattr(FileProcessor, 'write',
+                        lambda self, labels, cache=None, index=None: written.append(self.file_path.name))
+
+    watcher = Watcher(tmp_path, interval=0.05, settle=0)
+    mp = MasterFileProcessor(watcher.files(), 4, 10 ** 9, True, client=FakeImageAnnotatorClient(), stream=True,
+                             on_finished=lambda fp: watcher.done(fp.file_path))
+    mp.load()
+    thread = Thread(target=mp.join)
+    thread.start()
+
+    for number in range(3):
+        Image.new('RGB', (32, 32 + number)).save(tmp_path / f'{number}.jpg')
+        time.sleep(0.1)
+    deadline = time.monotonic() + 10
+    while len(written) < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    watcher.stop()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive(), 'The processor finishes once the watcher stops'
+    assert sorted(written) == ['0.jpg', '1.jpg', '2.jpg']
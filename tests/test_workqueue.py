@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from phototag.helpers import shard_of
+from phototag.workqueue import WorkQueue
+
+
+def test_shard_of():
+    paths = [Path('library', f'{number:04}.jpg') for number in range(300)]
+    shards = [shard_of(path, 3) for path in paths]
+    assert set(shards) == {0, 1, 2} and all(shards.count(shard) > 50 for shard in range(3))
+    assert shard_of(Path('library/0001.jpg'), 3) == shard_of(Path('./library/../library/0001.jpg'), 3)
+
+
+def test_claim_complete_release(tmp_path: Path):
+    path = str(tmp_path / 'queue.sqlite')
+    first, second = WorkQueue(path, lease=60, claim_size=2), WorkQueue(path, lease=60, claim_size=2)
+    assert first.add(Path(f'{number}.jpg') for number in range(5)) == 5
+    assert second.add(Path(f'{number}.jpg') for number in range(6)) == 1, 'Adding is idempotent'
+
+    assert first.claim() == ['0.jpg', '1.jpg']
+    assert second.claim(3) == ['2.jpg', '3.jpg', '4.jpg'], 'Claimed files are not handed out twice'
+    first.complete('0.jpg')
+    first.complete('1.jpg', succeeded=False)
+    assert first.stats() == {'pending': 1, 'leased': 3, 'done': 1, 'failed': 1}
+    assert first.outstanding() == 4 and second.outstanding() == 1
+
+    second.close()  # Files claimed but not completed are handed back
+    assert first.claim(10) == ['2.jpg', '3.jpg', '4.jpg', '5.jpg']
+    first.close()
+
+
+def test_expired_leases(tmp_path: Path):
+    path = str(tmp_path / 'queue.sqlite')
+    dead, alive = WorkQueue(path, lease=1, max_attempts=2), WorkQueue(path, lease=1, max_attempts=2)
+    dead.add([Path('a.jpg'), Path('b.jpg')])
+    assert dead.claim() == ['a.jpg', 'b.jpg']
+    dead.stopped.set()  # Stops renewing, as a crashed run would
+
+    assert alive.claim() == []
+    time.sleep(1.1)
+    assert alive.claim() == ['a.jpg', 'b.jpg'] and alive.reclaimed == 2
+    alive.stopped.set()
+    time.sleep(1.1)
+    assert alive.claim() == [], 'Files claimed by too many workers that died are given up on'
+    assert alive.stats()['failed'] == 2
+
+
+def work(path: str, log: str, die_after: Optional[int]) -> None:
+    """
+    Runs a worker over the queue, appending each file it processes to its log. Exits abruptly, holding its claims,
+    after die_after files.
+    """
+    queue = WorkQueue(path, lease=1, claim_size=4)
+    for number, file in enumerate(queue.files(poll=0.1), start=1):
+        time.sleep(0.01)
+        with open(log, 'a') as handle:
+            handle.write(f'{file}\n')
+        if number == die_after:
+            os._exit(1)
+        queue.complete(file)
+    queue.close()
+
+
+def test_multiple_processes(tmp_path: Path):
+    path = str(tmp_path / 'queue.sqlite')
+    queue = WorkQueue(path)
+    queue.add(Path(f'{number:03}.jpg') for number in range(120))
+    queue.close()
+
+    logs = [str(tmp_path / f'{number}.log') for number in range(3)]
+    processes = [multiprocessing.Process(target=work, args=(path, log, 5 if number == 0 else None))
+                 for number, log in enumerate(logs)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+    assert [process.exitcode for process in processes] == [1, 0, 0]
+
+    processed = [Path(log).read_text().split() if os.path.exists(log) else [] for log in logs]
+    survivors = processed[1] + processed[2]
+    assert len(survivors) == len(set(survivors)), 'Live workers never process the same file'
+    assert set(survivors) | set(processed[0][:4]) == {f'{number:03}.jpg' for number in range(120)}
+    assert processed[0][4] in survivors, 'The file the dead worker was processing is reclaimed'
+    assert WorkQueue(path).stats() == {'pending': 0, 'leased': 0, 'done': 120, 'failed': 0}
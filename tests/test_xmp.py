@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from phototag import xmp
+from phototag.exceptions import MetadataError
+from phototag.tags import XMPTagger
+
+SIDECAR = """<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="Adobe XMP Core 5.6-c140">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:crs="http://ns.adobe.com/camera-raw-settings/1.0/"
+   crs:Exposure2012="+0.35">
+   {subject}
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+"""
+
+SUBJECT = """<dc:subject>
+    <rdf:Bag>
+     <rdf:li>dog</rdf:li>
+     <rdf:li>grass</rdf:li>
+     <rdf:li>dog</rdf:li>
+    </rdf:Bag>
+   </dc:subject>"""
+
+
+@pytest.fixture()
+def sidecar(tmp_path: Path) -> Path:
+    path = tmp_path / 'image.xmp'
+    path.write_text(SIDECAR.format(subject=SUBJECT))
+    return path
+
+
+def test_read(sidecar: Path):
+    assert xmp.read_keywords(str(sidecar)) == ['dog', 'grass', 'dog']
+
+
+def test_merge(sidecar: Path):
+    tagger = XMPTagger(sidecar)
+    assert tagger.current_tags == {'dog', 'grass'}
+    tagger.extend(['sky', 'dog'])
+    tagger.save()
+
+    assert tagger.written
+    assert xmp.read_keywords(str(sidecar)) == ['dog', 'grass', 'sky'], 'Keywords are merged as a set'
+    content = sidecar.read_text()
+    assert 'crs:Exposure2012="+0.35"' in content and 'ns0:' not in content, 'Namespace prefixes are kept'
+
+
+def test_unchanged(sidecar: Path):
+    tagger = XMPTagger(sidecar)
+    tagger.extend(['sky'])
+    tagger.save()
+    stat = os.stat(sidecar)
+
+    tagger = XMPTagger(sidecar)
+    tagger.extend(['sky', 'grass'])
+    tagger.save()
+    assert not tagger.written
+    assert os.stat(sidecar).st_mtime_ns == stat.st_mtime_ns
+
+
+def test_preserves_stat(sidecar: Path):
+    os.utime(sidecar, ns=(1_000_000_000, 2_000_000_000))
+    os.chmod(sidecar, 0o640)
+    tagger = XMPTagger(sidecar)
+    tagger.add('sky')
+    tagger.save()
+
+    stat = os.stat(sidecar)
+    assert stat.st_mtime_ns == 2_000_000_000 and stat.st_mode & 0o777 == 0o640
+    assert [path.name for path in sidecar.parent.iterdir()] == ['image.xmp'], 'No temporary files are left behind'
+
+
+def test_no_subject(tmp_path: Path):
+    path = tmp_path / 'image.xmp'
+    path.write_text(SIDECAR.format(subject=''))
+    assert xmp.read_keywords(str(path)) == []
+
+    xmp.write_keywords(str(path), ['dog'])
+    assert xmp.read_keywords(str(path)) == ['dog']
+
+
+def test_invalid(tmp_path: Path):
+    path = tmp_path / 'image.xmp'
+    path.write_text('<x:xmpmeta')
+    with pytest.raises(MetadataError):
+        XMPTagger(path)